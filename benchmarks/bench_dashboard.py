@@ -0,0 +1,58 @@
+"""
+streamlit_app: get_data_from_db and groupby_hour of the plotting and dataframe pages against db_app
+"""
+import ast
+import json
+import os
+
+from common import Suite, ROOT_DIR, get_parser, finish
+from bench_db import WORK_DIR, fill_database, use_database, main
+
+PANDAS_OK = False
+try:
+    import pandas as pd
+    PANDAS_OK = True
+except ModuleNotFoundError:
+    PANDAS_OK = False
+
+PAGES = {'plotting': '2_📊_plotting.py', 'dataframe': '3_田_dataframe.py'}
+
+
+def load_page_functions(file_name: str, request_session) -> dict:
+    """
+    Only the data functions of a page, the page itself needs a running streamlit
+    """
+    with open(os.path.join(ROOT_DIR, 'streamlit_app', 'pages', file_name), encoding='utf-8') as file:
+        tree = ast.parse(file.read())
+    tree.body = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name in ('get_data_from_db', 'groupby_hour')]
+    namespace = {'pd': pd, 'json': json, 'request_session': request_session}
+    exec(compile(tree, file_name, 'exec'), namespace)
+    return namespace
+
+
+def run_dashboard_benchmarks(suite: Suite, repeat: int, rows: int, hours: int) -> None:
+    from fastapi.testclient import TestClient
+
+    use_database(fill_database(os.path.join(WORK_DIR, f'dashboard_{rows}.db'), rows))
+    url = f'http://testserver/data/measurements?hours={hours}'
+    with TestClient(main.app) as client:
+        for page, file_name in PAGES.items():
+            functions = load_page_functions(file_name, client)
+            params = {'page': page, 'rows': rows, 'hours': hours}
+            suite.run('get_data_from_db', lambda: functions['get_data_from_db'](url), params=params, repeat=repeat)
+            df = functions['get_data_from_db'](url)
+            suite.run('groupby_hour', lambda: functions['groupby_hour'](df), params={**params, 'frame_rows': len(df)}, repeat=repeat)
+
+
+if __name__ == '__main__':
+    parser = get_parser(__doc__)
+    parser.add_argument('--rows', type=int, default=100000, help='Measurements in the database')
+    parser.add_argument('--hours', type=int, default=6, help='Hours of measurements the pages load')
+    args = parser.parse_args()
+    suite = Suite('dashboard')
+    if PANDAS_OK:
+        run_dashboard_benchmarks(suite, 3 if args.quick else 10, 10000 if args.quick else args.rows, 1 if args.quick else args.hours)
+    else:
+        for name in ('get_data_from_db', 'groupby_hour'):
+            suite.skip(name, 'pandas is not installed')
+    finish(suite, args)
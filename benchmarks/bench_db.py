@@ -0,0 +1,133 @@
+"""
+db_app: ingest through crud, POST /data and POST /data/batch, /data/measurements at growing table sizes
+"""
+import atexit
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from typing import List
+
+from common import Suite, use_app, get_parser, finish
+
+WORK_DIR = tempfile.mkdtemp(prefix='um34c-bench-')
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORK_DIR, 'ingest.db')
+use_app('db_app')
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+import crud, main, models, schemas
+from database import SessionLocal
+from examples import Examples
+
+EXAMPLE = Examples.post_data.value['sample 1']['value']
+BD_ADDRESS = EXAMPLE['bd_address']
+
+
+def get_example(created_at: datetime) -> dict:
+    return {**EXAMPLE, 'created_at': created_at.isoformat()}
+
+
+def get_measurement_template() -> dict:
+    """
+    Values of one measurement row, for whatever columns the measurement table has
+    """
+    return {column.name: EXAMPLE[column.name] for column in models.Measurement.__table__.columns if column.name in EXAMPLE}
+
+
+def fill_database(path: str, rows: int, interval: float = 1.0, chunk_size: int = 50000):
+    """
+    Database with rows measurements, one every interval seconds up to now. An existing file with as many rows is reused.
+    """
+    engine = create_engine('sqlite:///' + path, connect_args={'check_same_thread': False})
+    models.Base.metadata.create_all(bind=engine)
+    with engine.connect() as connection:
+        count = connection.execute(select(func.count()).select_from(models.Measurement.__table__)).scalar()
+    if count == rows:
+        return engine
+    if count:
+        raise ValueError(f'{path} has {count} rows instead of {rows}, delete it to fill it again')
+
+    template = get_measurement_template()
+    start = datetime.now() - timedelta(seconds=rows * interval)
+    with engine.begin() as connection:
+        connection.exec_driver_sql('PRAGMA synchronous = OFF')
+        connection.execute(models.Device.__table__.insert(), [{'bd_address': BD_ADDRESS, 'model_id': EXAMPLE['model_id']}])
+        configuration = schemas.ConfigurationCreate(**get_example(start)).dict()
+        connection.execute(models.Configuration.__table__.insert(), [configuration])
+        connection.execute(models.GroupData.__table__.insert(),
+                           [{'bd_address': BD_ADDRESS, 'measurement_id': 1, 'group_no': group_no, **group}
+                            for group_no, group in enumerate(EXAMPLE['group_data'])])
+        for offset in range(0, rows, chunk_size):
+            connection.execute(models.Measurement.__table__.insert(),
+                               [{**template, 'created_at': start + timedelta(seconds=i * interval)}
+                                for i in range(offset + 1, min(offset + chunk_size, rows) + 1)])
+    return engine
+
+
+def use_database(engine) -> None:
+    """
+    Makes the endpoints of db_app use the given database
+    """
+    session_class = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def get_db():
+        db = session_class()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    main.app.dependency_overrides[main.get_db] = get_db
+    main.app.dependency_overrides[main.get_read_db] = get_db
+
+
+def run_ingest_benchmarks(suite: Suite, repeat: int, batch_size: int = 1000) -> None:
+    db = SessionLocal()
+    timestamps = iter(datetime.now() + timedelta(seconds=i) for i in range(10 ** 9))
+    examples = [get_example(next(timestamps)) for _ in range(batch_size)]
+    suite.run('ingest_crud', lambda: crud.create_measurement_and_configuration(db, schemas.UM34CResponse(**get_example(next(timestamps)))),
+              repeat=repeat, number=10)
+    suite.run('ingest_batch_crud', lambda: crud.create_measurements_batch(
+              db, [schemas.UM34CResponse(**get_example(next(timestamps))) for _ in range(batch_size)]),
+              params={'batch_size': batch_size}, repeat=repeat, items=batch_size)
+    # Without the validation of the samples, which the endpoint does before crud
+    batch = [schemas.UM34CResponse(**get_example(next(timestamps))) for _ in range(batch_size)]
+    suite.run('ingest_batch_crud_validated', lambda: crud.create_measurements_batch(db, batch),
+              params={'batch_size': batch_size}, repeat=repeat, items=batch_size)
+    suite.run('validate_batch', lambda: [schemas.UM34CResponse(**example) for example in examples],
+              params={'batch_size': batch_size}, repeat=repeat, items=batch_size)
+    db.close()
+    with TestClient(main.app) as client:
+        suite.run('ingest_post_data', lambda: client.post('/data', json=get_example(next(timestamps))).raise_for_status(),
+                  repeat=repeat, number=10)
+        suite.run('ingest_post_data_batch', lambda: client.post(
+                  '/data/batch', json=[get_example(next(timestamps)) for _ in range(batch_size)]).raise_for_status(),
+                  params={'batch_size': batch_size}, repeat=repeat, items=batch_size)
+
+
+def run_query_benchmarks(suite: Suite, repeat: int, sizes: List[int], db_dir: str) -> None:
+    for rows in sizes:
+        engine = fill_database(os.path.join(db_dir, f'measurements_{rows}.db'), rows)
+        use_database(engine)
+        with TestClient(main.app) as client:
+            for path in ('/data/measurements?limit=1', '/data/measurements?limit=100', '/data/measurements?hours=1'):
+                suite.run('query', lambda: client.get(path).raise_for_status(), params={'rows': rows, 'path': path},
+                          repeat=repeat if rows <= 10000 else max(repeat // 4, 3))
+        main.app.dependency_overrides.clear()
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = get_parser(__doc__)
+    parser.add_argument('--rows', default='10000,1000000,10000000', help='Comma separated table sizes for the query benchmarks')
+    parser.add_argument('--db-dir', default=WORK_DIR, help='Directory for the filled databases, existing ones are reused')
+    args = parser.parse_args()
+    repeat = 5 if args.quick else 20
+    suite = Suite('db')
+    run_ingest_benchmarks(suite, repeat)
+    run_query_benchmarks(suite, repeat, [10000] if args.quick else [int(rows) for rows in args.rows.split(',')], args.db_dir)
+    finish(suite, args)
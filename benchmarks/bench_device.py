@@ -0,0 +1,96 @@
+"""
+device_control_app: frame decoding, response building and the request_data endpoint against simulator.py
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+from common import Suite, use_app, get_parser, finish
+
+WORK_DIR = tempfile.mkdtemp(prefix='um34c-bench-')
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+os.environ.update({'DISCOVERY_CACHE_FILE': os.path.join(WORK_DIR, 'discovery_cache.json'),
+                   'SIMULATOR_ADDRESS': 'unix://' + os.path.join(WORK_DIR, 'um34c.sock'),
+                   'BD_ADDRESS': '00:00:00:00:00:01',
+                   'COALESCE_WINDOW': '0',
+                   'SAMPLER_ENABLED': 'false',
+                   'RECORD_FRAMES': 'false',
+                   'POLLING_BD_ADDRESSES': '',
+                   'SPOOL_DIR': os.path.join(WORK_DIR, 'spool'),
+                   'PROFILE_DIR': os.path.join(WORK_DIR, 'profiles')})
+use_app('device_control_app')
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+
+from simulator import Simulator, VirtualMeter
+from routers.bl_connection import BluetoothDevice
+from routers.commands import data_preperation_raw, data_preperation_decoded, build_response_data, encode_response_data
+from routers.commands_decoder import NUMPY_OK, decode_frame, decode_frames
+from routers.commands_models import UM34CResponse, UM34CResponseRaw
+from routers.commands_recorder import FrameRecorder, FrameReplay
+
+
+def run_response_benchmarks(suite: Suite, repeat: int) -> None:
+    frame_bytes = VirtualMeter('00:00:00:00:00:01').frame()
+    frame = decode_frame(frame_bytes)
+    bl_device = BluetoothDevice(None, '00:00:00:00:00:01', simulator_address=os.environ['SIMULATOR_ADDRESS'])
+
+    suite.run('decode_frame', lambda: decode_frame(frame_bytes), repeat=repeat, number=1000, items=1)
+    suite.run('data_preperation_raw', lambda: data_preperation_raw(frame), repeat=repeat, number=200, items=1)
+    suite.run('data_preperation_decoded', lambda: data_preperation_decoded(frame), repeat=repeat, number=200, items=1)
+
+    variants = {'full': {}, 'values_only': {'values_only': True}, 'keys': {'q': ['voltage', 'amperage', 'wattage']}}
+    for raw, model in ((False, UM34CResponse), (True, UM34CResponseRaw)):
+        for variant, options in variants.items():
+            params = {'raw': raw, 'variant': variant}
+            suite.run('build_response_data', lambda: build_response_data(bl_device, frame, raw=raw, **options),
+                      params=params, repeat=repeat, number=200)
+            # What FastAPI does with the result: validation against the response model, jsonable_encoder and json.dumps
+            suite.run('serialize_response', lambda: encode_response_data(jsonable_encoder(
+                      model.validate(build_response_data(bl_device, frame, raw=raw, **options)), exclude_unset=True)),
+                      params=params, repeat=repeat, number=100)
+
+
+def run_batch_benchmarks(suite: Suite, repeat: int, frames: int) -> None:
+    meter = VirtualMeter('00:00:00:00:00:01')
+    data = b''.join(meter.frame() for _ in range(frames))
+    if NUMPY_OK:
+        suite.run('decode_frames', lambda: decode_frames(data), params={'frames': frames}, repeat=repeat, items=frames)
+    else:
+        suite.skip('decode_frames', 'numpy is not installed', params={'frames': frames})
+
+    path = os.path.join(WORK_DIR, 'bench.um34clog')
+    recorder = FrameRecorder(path)
+    for offset in range(0, len(data), 130):
+        recorder.record('00:00:00:00:00:01', data[offset:offset + 130])
+    recorder.close()
+    # Decoding and conversion to db rows of a whole log, without the upload
+    suite.run('replay', lambda: FrameReplay(path, speed=0, sink=lambda row: None).run(),
+              params={'frames': frames}, repeat=max(repeat // 4, 3), items=frames)
+
+
+def run_endpoint_benchmarks(suite: Suite, repeat: int) -> None:
+    simulator = Simulator(os.environ['SIMULATOR_ADDRESS'], latency=0.0, jitter=0.0)
+    simulator.start_thread()
+    try:
+        import main
+        with TestClient(main.app) as client:
+            for path in ('/command/request_data', '/command/request_data?values_only=true',
+                         '/command/request_data?keys=voltage&keys=amperage', '/command/request_data_raw'):
+                suite.run('endpoint', lambda: client.get(path).raise_for_status(), params={'path': path}, repeat=repeat, number=10)
+    finally:
+        simulator.stop_thread()
+
+
+if __name__ == '__main__':
+    parser = get_parser(__doc__)
+    parser.add_argument('--frames', type=int, default=10000, help='Frames for the batch decoding and replay benchmarks')
+    args = parser.parse_args()
+    repeat = 5 if args.quick else 20
+    suite = Suite('device')
+    run_response_benchmarks(suite, repeat)
+    run_batch_benchmarks(suite, repeat, 1000 if args.quick else args.frames)
+    run_endpoint_benchmarks(suite, repeat)
+    finish(suite, args)
@@ -0,0 +1,105 @@
+"""
+Helpers shared by the benchmark suites
+
+Every suite is a script that can run on its own and prints its results, with --json as one JSON document.
+run.py runs all suites in separate processes (device_control_app and db_app both have a config and a main module)
+and stores the results.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from typing import Callable, List, Union
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def use_app(name: str) -> str:
+    """
+    Makes the modules of an app importable the same way as when the app runs, e.g. use_app('db_app')
+    """
+    app_dir = os.path.join(ROOT_DIR, name)
+    sys.path.insert(0, app_dir)
+    os.chdir(app_dir)
+    return app_dir
+
+
+def measure(fn: Callable, repeat: int = 20, number: int = 1, warmup: int = 1, items: int = 1) -> dict:
+    """
+    Calls fn number times per round for repeat rounds and returns the seconds per call
+
+    - **items** : units one call handles (frames, rows), for items_per_sec
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    times.sort()
+    median = times[len(times) // 2]
+    return {'repeat': repeat,
+            'number': number,
+            'mean': sum(times) / len(times),
+            'median': median,
+            'p95': times[int(0.95 * (len(times) - 1))],
+            'min': times[0],
+            'max': times[-1],
+            'items_per_sec': items / median if median > 0 else None,
+            }
+
+
+class Suite:
+    """
+    Collects the results of one suite, a benchmark that raises is recorded with its error instead of ending the suite
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.results: List[dict] = list()
+
+    def run(self, name: str, fn: Callable, params: Union[dict, None] = None, **options) -> Union[dict, None]:
+        result = {'suite': self.name, 'name': name, 'params': params or {}}
+        try:
+            result.update(measure(fn, **options))
+        except Exception as error:
+            result['error'] = repr(error)
+            traceback.print_exc(file=sys.stderr)
+        self.results.append(result)
+        print(format_result(result), file=sys.stderr)
+        return result
+
+    def skip(self, name: str, reason: str, params: Union[dict, None] = None) -> None:
+        result = {'suite': self.name, 'name': name, 'params': params or {}, 'skipped': reason}
+        self.results.append(result)
+        print(format_result(result), file=sys.stderr)
+
+
+def format_params(params: dict) -> str:
+    return ','.join(f'{key}={value}' for key, value in params.items())
+
+
+def format_result(result: dict) -> str:
+    title = f"{result['suite']}.{result['name']}" + (f"[{format_params(result['params'])}]" if result['params'] else '')
+    if 'error' in result:
+        return f'{title:70} ERROR {result["error"]}'
+    if 'skipped' in result:
+        return f'{title:70} skipped: {result["skipped"]}'
+    rate = f"{result['items_per_sec']:14,.1f} /s" if result['items_per_sec'] else ''
+    return f"{title:70} median {result['median'] * 1000:10.3f} ms  p95 {result['p95'] * 1000:10.3f} ms {rate}"
+
+
+def get_parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON to stdout')
+    parser.add_argument('--quick', action='store_true', help='Fewer rounds and smaller data sets, for a smoke test')
+    return parser
+
+
+def finish(suite: Suite, args: argparse.Namespace) -> None:
+    if args.json:
+        json.dump(suite.results, sys.stdout)
+        sys.stdout.write('\n')
@@ -0,0 +1,92 @@
+"""
+Runs the benchmark suites and stores the results as JSON, e.g.
+
+    python benchmarks/run.py --quick
+    python benchmarks/run.py --suite db --rows 10000,1000000 --compare benchmarks/results/<earlier run>.json
+
+Every suite runs in its own process. Results go to benchmarks/results/<time>-<commit>.json together with
+the commit, python version and machine, so runs can be compared over time.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from typing import List
+
+from common import ROOT_DIR, format_params
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SUITES = {'device': 'bench_device.py', 'db': 'bench_db.py', 'dashboard': 'bench_dashboard.py'}
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_suite(name: str, options: List[str]) -> List[dict]:
+    process = subprocess.run([sys.executable, os.path.join(BENCHMARK_DIR, SUITES[name]), '--json', *options],
+                             stdout=subprocess.PIPE, text=True)
+    lines = process.stdout.strip().splitlines()
+    if process.returncode != 0 or not lines:
+        return [{'suite': name, 'name': 'suite', 'params': {}, 'error': f'exit code {process.returncode}'}]
+    return json.loads(lines[-1])
+
+
+def get_key(result: dict) -> tuple:
+    return result['suite'], result['name'], format_params(result['params'])
+
+
+def compare(results: List[dict], path: str) -> None:
+    """
+    Prints the change of the median time against an earlier run, positive is slower
+    """
+    with open(path) as file:
+        earlier = {get_key(result): result for result in json.load(file)['results']}
+    print(f'\nCompared to {path}:')
+    for result in results:
+        before = earlier.get(get_key(result))
+        if before is None or 'median' not in before or 'median' not in result:
+            continue
+        change = (result['median'] / before['median'] - 1) * 100
+        suite, name, params = get_key(result)
+        print(f"{f'{suite}.{name}' + (f'[{params}]' if params else ''):70} {before['median'] * 1000:10.3f} ms -> "
+              f"{result['median'] * 1000:10.3f} ms {change:+7.1f} %")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the benchmark suites and stores the results as JSON')
+    parser.add_argument('--suite', action='append', choices=list(SUITES), help='Suite to run, can be given more than once (default all)')
+    parser.add_argument('--quick', action='store_true', help='Fewer rounds and smaller data sets, for a smoke test')
+    parser.add_argument('--rows', default=None, help='Comma separated table sizes for the db query benchmarks')
+    parser.add_argument('--db-dir', default=None, help='Directory to keep the filled databases in between runs')
+    parser.add_argument('--output', default=os.path.join(BENCHMARK_DIR, 'results'), help='Directory for the result files')
+    parser.add_argument('--compare', default=None, help='Earlier result file to compare with')
+    args = parser.parse_args()
+
+    started = datetime.now()
+    options = ['--quick'] if args.quick else []
+    results = []
+    for name in args.suite or list(SUITES):
+        suite_options = list(options)
+        if name == 'db' and args.rows:
+            suite_options += ['--rows', args.rows]
+        if name == 'db' and args.db_dir:
+            suite_options += ['--db-dir', args.db_dir]
+        results.extend(run_suite(name, suite_options))
+
+    commit = get_commit()
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{started.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(path, 'w') as file:
+        json.dump({'created': started.isoformat(), 'commit': commit, 'quick': args.quick,
+                   'python': platform.python_version(), 'platform': platform.platform(), 'machine': platform.machine(),
+                   'cpu_count': os.cpu_count(), 'results': results}, file, indent=2)
+    print(f'Results stored in {path}')
+    if args.compare:
+        compare(results, args.compare)
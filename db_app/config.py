@@ -2,10 +2,25 @@ from pydantic import BaseSettings
 
 class Settings(BaseSettings):
     database_url: str = 'sqlite:///./sql_app.db'
+    max_batch_size: int = 10000
+
+    # SQLite storage profile, 'wal' or 'default' for the rollback journal and no further settings.
+    # Unchanged devices and configurations are not rewritten. The cache behind that is dropped whenever
+    # PRAGMA data_version shows a commit of another connection, more than one writer process is fine
+    sqlite_profile: str = 'wal'
+    sqlite_synchronous: str = 'NORMAL'
+    sqlite_mmap_size: int = 268435456
+    # Negative values are KiB, positive values pages
+    sqlite_cache_size: int = -65536
+    sqlite_busy_timeout: int = 5000
+    # Pages after which a commit checkpoints by itself, the checkpoint thread usually is faster
+    sqlite_wal_autocheckpoint: int = 10000
+    sqlite_checkpoint_interval: float = 10.0
+    read_pool_size: int = 4
 
     class Config:
         env_file = '.env'
 
 
 def get_settings():
-    return Settings()
\ No newline at end of file
+    return Settings()
@@ -1,20 +1,313 @@
 from sqlalchemy.orm import Session
 from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from pydantic.datetime_parse import parse_datetime
 
 import models, schemas
 
 from datetime import datetime, timedelta
+from typing import Dict, List, Tuple, Union
+
+
+DEVICE_FIELDS = list(schemas.DeviceCreate.__fields__)
+MEASUREMENT_FIELDS = list(schemas.MeasurementCreate.__fields__)
+CONFIGURATION_FIELDS = list(schemas.ConfigurationCreate.__fields__)
+SAMPLE_FIELDS = [key for key in schemas.UM34CResponse.__fields__ if key != 'group_data']
+SAMPLE_TYPES = {key: schemas.UM34CResponse.__fields__[key].type_ for key in SAMPLE_FIELDS}
+
+
+class WriteCache:
+    """
+    What one database connection last wrote, to skip unchanged configurations and group data
+
+    Only valid as long as no other connection writes to the database. With SQLite get_write_cache clears it
+    whenever PRAGMA data_version tells that another connection committed, with other databases there is no cache.
+    """
+    def __init__(self, data_version: Union[int, None] = None):
+        self.data_version = data_version
+        # Configuration values without created_at, per bd_address
+        self.configurations: Dict[str, dict] = dict()
+        # (mah, mwh) per group_no, per bd_address
+        self.group_data: Dict[str, Dict[int, Tuple[int, int]]] = dict()
 
 
 def create_measurement_and_configuration(db: Session, response: schemas.UM34CResponse):
-    data = response.dict()
-    for i, val in enumerate(data['group_data']):
-        data.update({'group'+str(i)+'_mah': val['mah']})
-        data.update({'group'+str(i)+'_mwh': val['mwh']})
-    create_device(db, schemas.DeviceCreate(**{key: data[key] for key in schemas.DeviceCreate.schema()['properties'].keys()}))
-    create_measurement(db, schemas.MeasurementCreate(**{key: data[key] for key in schemas.MeasurementCreate.schema()['properties'].keys()}))
-    create_configuration(db, schemas.ConfigurationCreate(**{key: data[key] for key in schemas.ConfigurationCreate.schema()['properties'].keys()}))
-    return {'created_id': db.query(func.max(models.Measurement.id)).first()[0]}
+    """
+    Stores one sample, with an unchanged configuration and group data this is the measurement INSERT only
+    """
+    data = get_row(response)
+    try:
+        cache = get_write_cache(db)
+        changed = store_devices_and_configurations(db, cache, [data])
+        created_id = create_measurement(db, data)
+        group_data = store_group_data(db, cache, [data], [created_id])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    remember_configurations(cache, changed)
+    cache.group_data.update(group_data)
+    return {'created_id': created_id}
+
+
+def create_measurements_batch(db: Session, responses: List[schemas.UM34CResponse]) -> dict:
+    """
+    Stores many samples, also of several devices, in one transaction
+
+    Devices and configurations are written once per device, the configuration from the device's last sample
+    in the batch, the group data whenever it changes. Returns the ids of the first and the last measurement.
+    """
+    return create_rows_batch(db, [get_row(response) for response in responses])
+
+
+def create_rows_batch(db: Session, rows: List[dict]) -> dict:
+    """
+    create_measurements_batch for samples as get_row or get_row_from_dict give them
+    """
+    if not rows:
+        return {'count': 0, 'first_id': None, 'last_id': None}
+    latest = {row['bd_address']: row for row in rows}
+    try:
+        cache = get_write_cache(db)
+        # The devices before their measurements, for the foreign key
+        changed = store_devices_and_configurations(db, cache, list(latest.values()))
+        ids = insert_measurements(db, rows)
+        group_data = store_group_data(db, cache, rows, ids)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    remember_configurations(cache, changed)
+    cache.group_data.update(group_data)
+    return {'count': len(rows), 'first_id': ids[0], 'last_id': ids[-1]}
+
+
+def get_row(response: schemas.UM34CResponse) -> dict:
+    """
+    The values of a sample as dict, response.dict() takes about 50 times as long
+    """
+    row = {key: getattr(response, key) for key in SAMPLE_FIELDS}
+    row['group_data'] = [{'mah': group.mah, 'mwh': group.mwh} for group in response.group_data]
+    return row
+
+
+def get_row_from_dict(data: dict) -> dict:
+    """
+    The values of a sample as get_row gives them, from the JSON of a sample without building a UM34CResponse
+
+    Values of exactly the field's type (also ints for floats and created_at as string) are taken as they are,
+    anything else goes through UM34CResponse for its conversions and validation errors. Takes a tenth of the time.
+    """
+    try:
+        row = dict()
+        for key, field_type in SAMPLE_TYPES.items():
+            value = data[key]
+            if type(value) is field_type:
+                row[key] = value
+            elif field_type is float and type(value) is int:
+                row[key] = float(value)
+            elif field_type is datetime and type(value) is str:
+                row[key] = parse_datetime(value)
+            else:
+                raise TypeError(key)
+        if type(data['group_data']) is not list:
+            raise TypeError('group_data')
+        row['group_data'] = [{'mah': group['mah'], 'mwh': group['mwh']} for group in data['group_data']]
+        if not all(type(group['mah']) is int and type(group['mwh']) is int for group in row['group_data']):
+            raise TypeError('group_data')
+        return row
+    except (KeyError, TypeError, ValueError):
+        return get_row(schemas.UM34CResponse.parse_obj(data))
+
+
+def get_insert(db: Session):
+    """
+    insert() of the database's dialect, for ON CONFLICT
+    """
+    return postgresql.insert if db.get_bind().dialect.name == 'postgresql' else sqlite.insert
+
+
+def get_configuration_key(configuration: dict) -> dict:
+    return {key: value for key, value in configuration.items() if key != 'created_at'}
+
+
+def get_write_cache(db: Session) -> WriteCache:
+    """
+    The WriteCache of the session's connection, call it before the first write of the transaction
+
+    With SQLite it starts the transaction with BEGIN IMMEDIATE, no other connection can commit until it ends.
+    PRAGMA data_version changes when another connection committed since the last call, the cache is cleared then.
+    """
+    connection = db.connection()
+    if connection.dialect.name != 'sqlite':
+        return WriteCache()
+    if not connection.connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+    data_version = connection.exec_driver_sql('PRAGMA data_version').scalar()
+    cache = connection.connection.info.get('write_cache')
+    if cache is None or cache.data_version != data_version:
+        cache = connection.connection.info['write_cache'] = WriteCache(data_version)
+    return cache
+
+
+def store_devices_and_configurations(db: Session, cache: WriteCache, rows: List[dict]) -> List[dict]:
+    """
+    Upserts the devices and configurations of rows (one row per device) the connection has not written as they are
+
+    Returns the written configurations, for remember_configurations once the transaction is committed.
+    The created_at of a configuration is the time of its last change.
+    """
+    known = cache.configurations
+    configurations = [{key: row[key] for key in CONFIGURATION_FIELDS} for row in rows]
+    changed = [configuration for configuration in configurations
+               if known.get(configuration['bd_address']) != get_configuration_key(configuration)]
+    if not changed:
+        return changed
+    new_devices = [{key: row[key] for key in DEVICE_FIELDS} for row in rows if row['bd_address'] not in known]
+    if new_devices:
+        upsert_devices(db, new_devices)
+    upsert_configurations(db, changed)
+    return changed
+
+
+def remember_configurations(cache: WriteCache, configurations: List[dict]) -> None:
+    for configuration in configurations:
+        cache.configurations[configuration['bd_address']] = get_configuration_key(configuration)
+
+
+def upsert_devices(db: Session, devices: List[dict]) -> None:
+    statement = get_insert(db)(models.Device.__table__).on_conflict_do_nothing(index_elements=['bd_address'])
+    db.execute(statement, devices)
+
+
+def upsert_configurations(db: Session, configurations: List[dict]) -> None:
+    statement = get_insert(db)(models.Configuration.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['bd_address'],
+        set_={key: statement.excluded[key] for key in CONFIGURATION_FIELDS if key != 'bd_address'})
+    db.execute(statement, configurations)
+
+
+def create_measurement(db: Session, row: dict) -> int:
+    return insert_measurements(db, [row])[0]
+
+
+# Compiled INSERT and bind processors of the measurement table, per dialect name
+measurement_inserts: Dict[str, tuple] = dict()
+
+
+def insert_measurements(db: Session, rows: List[dict]) -> List[int]:
+    """
+    Inserts the measurements of rows and returns their ids, in the order of rows
+
+    With SQLite the rows go to executemany of the DBAPI cursor, in the transaction of db, which is several times
+    faster than an execute through SQLAlchemy. Other databases get multi-row INSERTs with RETURNING.
+    """
+    connection = db.connection()
+    table = models.Measurement.__table__
+    if connection.dialect.name != 'sqlite':
+        statement = table.insert().returning(table.c.id)
+        ids = []
+        # PostgreSQL allows 65535 parameters per statement
+        for start in range(0, len(rows), 1000):
+            values = [{key: row[key] for key in MEASUREMENT_FIELDS} for row in rows[start:start + 1000]]
+            ids.extend(connection.execute(statement.values(values)).scalars())
+        return ids
+
+    if connection.dialect.name not in measurement_inserts:
+        compiled = table.insert().compile(dialect=connection.dialect, column_keys=MEASUREMENT_FIELDS)
+        processors = [(key, table.c[key].type.dialect_impl(connection.dialect).bind_processor(connection.dialect))
+                      for key in compiled.positiontup]
+        measurement_inserts[connection.dialect.name] = (str(compiled), processors)
+    sql, processors = measurement_inserts[connection.dialect.name]
+    cursor = connection.connection.cursor()
+    cursor.executemany(sql, ([row[key] if process is None else process(row[key]) for key, process in processors] for row in rows))
+    # The transaction holds the write lock and the table has no AUTOINCREMENT, the new rowids follow the highest one
+    last_id = cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+
+def get_latest_group_data(db: Session, bd_addresses: List[str], before_id: int = None) -> Dict[str, Dict[int, Tuple[int, int]]]:
+    """
+    (mah, mwh) per group_no of the devices, as they were before the measurement before_id or are now
+    """
+    table = models.GroupData.__table__
+    latest = db.query(func.max(table.c.id)).filter(table.c.bd_address.in_(bd_addresses))
+    if before_id is not None:
+        latest = latest.filter(table.c.measurement_id < before_id)
+    latest = latest.group_by(table.c.bd_address, table.c.group_no)
+    group_data = {bd_address: dict() for bd_address in bd_addresses}
+    for bd_address, group_no, mah, mwh in db.query(table.c.bd_address, table.c.group_no, table.c.mah, table.c.mwh).filter(table.c.id.in_(latest)):
+        group_data[bd_address][group_no] = (mah, mwh)
+    return group_data
+
+
+def store_group_data(db: Session, cache: WriteCache, rows: List[dict], ids: List[int]) -> Dict[str, Dict[int, Tuple[int, int]]]:
+    """
+    Adds a group_data row for every group whose values differ from the device's previous sample
+
+    rows are the samples of the measurements ids. Returns the group data of the devices
+    after rows, for cache.group_data once the transaction is committed.
+    """
+    known = cache.group_data
+    bd_addresses = {row['bd_address'] for row in rows}
+    unknown = [bd_address for bd_address in bd_addresses if bd_address not in known]
+    group_data = {bd_address: dict(known[bd_address]) for bd_address in bd_addresses if bd_address in known}
+    if unknown:
+        group_data.update(get_latest_group_data(db, unknown))
+
+    changes = []
+    for row, measurement_id in zip(rows, ids):
+        groups = group_data[row['bd_address']]
+        for group_no, group in enumerate(row['group_data']):
+            values = (group['mah'], group['mwh'])
+            if groups.get(group_no) != values:
+                groups[group_no] = values
+                changes.append({'bd_address': row['bd_address'], 'measurement_id': measurement_id,
+                                'group_no': group_no, 'mah': values[0], 'mwh': values[1]})
+    if changes:
+        db.execute(models.GroupData.__table__.insert(), changes)
+    return group_data
+
+
+def add_group_data(db: Session, measurements: list) -> List[dict]:
+    """
+    Measurement rows in the shape of schemas.Measurement, with the group0_mah ... group9_mwh they were taken with
+
+    Merges the measurements, in id order, with the group_data rows of their devices in one pass.
+    """
+    if not measurements:
+        return []
+    measurements = sorted(measurements, key=lambda measurement: measurement.id)
+    bd_addresses = list({measurement.bd_address for measurement in measurements})
+    first_id, last_id = measurements[0].id, measurements[-1].id
+    group_data = get_latest_group_data(db, bd_addresses, before_id=first_id)
+    table = models.GroupData.__table__
+    changes = db.query(table.c.bd_address, table.c.measurement_id, table.c.group_no, table.c.mah, table.c.mwh) \
+        .filter(table.c.bd_address.in_(bd_addresses), table.c.measurement_id.between(first_id, last_id)) \
+        .order_by(table.c.measurement_id, table.c.id).all()
+
+    def get_columns(groups: Dict[int, Tuple[int, int]]) -> dict:
+        columns = dict()
+        for group_no in range(10):
+            columns[f'group{group_no}_mah'], columns[f'group{group_no}_mwh'] = groups.get(group_no, (None, None))
+        return columns
+
+    group_columns = {bd_address: get_columns(groups) for bd_address, groups in group_data.items()}
+    result = []
+    position = 0
+    for measurement in measurements:
+        if position < len(changes) and changes[position].measurement_id <= measurement.id:
+            while position < len(changes) and changes[position].measurement_id <= measurement.id:
+                change = changes[position]
+                group_data[change.bd_address][change.group_no] = (change.mah, change.mwh)
+                group_columns[change.bd_address] = None
+                position += 1
+            group_columns = {bd_address: columns or get_columns(group_data[bd_address]) for bd_address, columns in group_columns.items()}
+        data = dict(measurement._mapping)
+        data.update(group_columns[measurement.bd_address])
+        result.append(data)
+    return result
 
 
 def get_all_devices(db: Session):
@@ -28,38 +321,12 @@ def get_all_configurations(db: Session):
 def get_measurements_by_limit(db: Session, limit: int):
     offset = db.query(func.max(models.Measurement.id)).first()[0] - limit
     offset = offset if offset >= 0 else 0
-    resp = db.query(models.Measurement).offset(offset).limit(limit).all()
-    return resp
+    resp = db.query(models.Measurement.__table__).offset(offset).limit(limit).all()
+    return add_group_data(db, resp)
 
 
 def get_measurements_by_hours(db: Session, hours: int):
     time_delta = datetime.now() - timedelta(hours=hours)
     time_delta = time_delta.replace(minute=0, second=0, microsecond=0)
-    resp = db.query(models.Measurement).filter(models.Measurement.created_at > time_delta).all()
-    return resp
-
-
-def create_device(db: Session, device: schemas.DeviceCreate):
-    if device.bd_address not in [device.bd_address for device in get_all_devices(db)]:
-        db_device_data = models.Device(**device.dict())
-        db.add(db_device_data)
-        db.commit()
-        db.refresh(db_device_data)
-
-
-def create_measurement(db: Session, measurement: schemas.MeasurementCreate):
-    db_measurement_data = models.Measurement(**measurement.dict())
-    db.add(db_measurement_data)
-    db.commit()
-    db.refresh(db_measurement_data)
-
-
-def create_configuration(db: Session, configuration: schemas.ConfigurationCreate):
-    if configuration.bd_address not in [configs.bd_address for configs in get_all_configurations(db)]:
-        db_configuration_data = models.Configuration(**configuration.dict())
-        db.add(db_configuration_data)
-        db.commit()
-        db.refresh(db_configuration_data)
-    else:
-        db.query(models.Configuration).filter(models.Configuration.bd_address == configuration.bd_address).update(configuration.dict(), synchronize_session="fetch")
-        db.commit()
+    resp = db.query(models.Measurement.__table__).filter(models.Measurement.created_at > time_delta).all()
+    return add_group_data(db, resp)
@@ -1,9 +1,114 @@
-from sqlalchemy import create_engine
+import sqlite3
+import threading
+from typing import Union
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from config import Settings, get_settings
+
+
+def set_pragmas(settings: Settings, read_only: bool):
+    """
+    Connect listener with the pragmas of the SQLite storage profile
+    """
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not read_only:
+            cursor.execute('PRAGMA journal_mode = WAL')
+            cursor.execute(f'PRAGMA wal_autocheckpoint = {int(settings.sqlite_wal_autocheckpoint)}')
+        cursor.execute(f'PRAGMA synchronous = {settings.sqlite_synchronous}')
+        cursor.execute(f'PRAGMA mmap_size = {int(settings.sqlite_mmap_size)}')
+        cursor.execute(f'PRAGMA cache_size = {int(settings.sqlite_cache_size)}')
+        cursor.execute(f'PRAGMA busy_timeout = {int(settings.sqlite_busy_timeout)}')
+        if read_only:
+            cursor.execute('PRAGMA query_only = ON')
+        cursor.close()
+    return on_connect
+
+
+def create_engines(settings: Settings) -> tuple:
+    """
+    Engine for the writes and engine for the query endpoints
+
+    With the wal profile the writes go through one connection and the queries through read_pool_size read-only
+    connections. In WAL mode readers see the last commit and neither block the writer nor wait for it.
+    """
+    if not settings.database_url.startswith('sqlite'):
+        engine = create_engine(settings.database_url)
+        return engine, engine
+    if settings.sqlite_profile != 'wal':
+        engine = create_engine(settings.database_url, connect_args={'check_same_thread': False})
+        return engine, engine
+
+    write_engine = create_engine(settings.database_url, connect_args={'check_same_thread': False},
+                                 poolclass=QueuePool, pool_size=1, max_overflow=0, pool_timeout=60)
+    read_engine = create_engine(settings.database_url, connect_args={'check_same_thread': False},
+                                poolclass=QueuePool, pool_size=settings.read_pool_size, max_overflow=0, pool_timeout=60)
+    event.listen(write_engine, 'connect', set_pragmas(settings, read_only=False))
+    event.listen(read_engine, 'connect', set_pragmas(settings, read_only=True))
+    return write_engine, read_engine
+
+
+class Checkpointer:
+    """
+    Checkpoints the WAL every interval seconds in the background, with its own connection
+
+    A PASSIVE checkpoint copies what no reader still needs into the database file without waiting for locks,
+    so commits rarely have to checkpoint themselves and the WAL file stays small.
+    """
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = float(interval)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.checkpoints = 0
+        self.last_result = None
+
+    def checkpoint(self, mode: str = 'PASSIVE') -> tuple:
+        connection = sqlite3.connect(self.path, timeout=0)
+        try:
+            self.last_result = connection.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+            self.checkpoints += 1
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            connection.close()
+        return self.last_result
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            self.checkpoint()
+
+    def start(self) -> None:
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='sqlite-checkpoint', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the thread and truncates the WAL, if no connection uses it
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(self.interval)
+        self.checkpoint('TRUNCATE')
+
+
+def get_checkpointer(settings: Settings, engine) -> Union[Checkpointer, None]:
+    if engine.dialect.name != 'sqlite' or settings.sqlite_profile != 'wal' or settings.sqlite_checkpoint_interval <= 0:
+        return None
+    if not engine.url.database or engine.url.database == ':memory:':
+        return None
+    return Checkpointer(engine.url.database, settings.sqlite_checkpoint_interval)
 
-from config import get_settings
 
-engine = create_engine(get_settings().database_url, connect_args={'check_same_thread': False})
+engine, read_engine = create_engines(get_settings())
+checkpointer = get_checkpointer(get_settings(), engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+Base = declarative_base()
@@ -1,12 +1,18 @@
+import time
 from typing import List
 
-from fastapi import Depends, FastAPI, Body, Query
+from fastapi import Depends, FastAPI, Body, Query, Request, Response, HTTPException, status
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from pydantic.error_wrappers import ErrorWrapper
 from sqlalchemy.orm import Session
 
-import crud, models, schemas
-from database import SessionLocal, engine
+import crud, metrics, models, schemas
+from config import get_settings
+from database import SessionLocal, ReadSessionLocal, checkpointer, engine
 from examples import Examples
 
+# Also switches the database to WAL before the first reader opens it
 models.Base.metadata.create_all(bind=engine)
 
 
@@ -21,23 +27,96 @@ def get_db():
     finally:
         db.close()
 
+
+# Dependency of the query endpoints, read-only connections that do not wait for the writer
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@app.on_event('startup')
+def startup():
+    if checkpointer is not None:
+        checkpointer.start()
+
+
+@app.on_event('shutdown')
+def shutdown():
+    if checkpointer is not None:
+        checkpointer.stop()
+
+
+@app.middleware('http')
+async def observe_request_time(request: Request, call_next):
+    start_time = time.perf_counter()
+    response = await call_next(request)
+    endpoint = request.scope.get('endpoint')
+    metrics.http_request_seconds.observe(time.perf_counter() - start_time, endpoint.__name__ if endpoint is not None else 'unmatched')
+    return response
+
+
+@app.get('/metrics')
+def get_metrics():
+    """
+    Metrics in Prometheus text format: insert latency, stored samples (rows/sec with rate()) and request latency
+    """
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.post('/data', response_model=schemas.CreateDataResponse)
 def create_data(response: schemas.UM34CResponse = Body(examples=Examples.post_data),  db: Session = Depends(get_db)):
-    return crud.create_measurement_and_configuration(db=db, response=response)
+    with metrics.insert_seconds.time():
+        created = crud.create_measurement_and_configuration(db=db, response=response)
+    metrics.inserted_rows.inc()
+    return created
+
+
+# The samples are validated by crud.get_row_from_dict, the request body schema is that of UM34CResponse
+BATCH_REQUEST_BODY = {'requestBody': {'content': {'application/json': {'schema': {
+    'title': 'Responses', 'type': 'array', 'items': {'$ref': '#/components/schemas/UM34CResponse'}}}}}}
+
+
+@app.post('/data/batch', response_model=schemas.CreateBatchResponse, openapi_extra=BATCH_REQUEST_BODY)
+def create_data_batch(responses: List[dict] = Body(examples=Examples.post_data_batch), db: Session = Depends(get_db)):
+    """
+    Stores many samples, also of several devices, in one transaction
+    - **responses** : list of samples, up to MAX_BATCH_SIZE
+
+    Returns the number of stored samples and the id range of their measurements
+    """
+    max_batch_size = get_settings().max_batch_size
+    if len(responses) > max_batch_size:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f'More than {max_batch_size} samples',
+                            headers={'X-Error': f'More than {max_batch_size} samples'}
+                            )
+    rows = []
+    for i, response in enumerate(responses):
+        try:
+            rows.append(crud.get_row_from_dict(response))
+        except ValidationError as error:
+            raise RequestValidationError([ErrorWrapper(error, loc=('body', i))])
+    with metrics.insert_seconds.time():
+        created = crud.create_rows_batch(db=db, rows=rows)
+    metrics.inserted_rows.inc(amount=created['count'])
+    return created
 
 
 @app.get('/data/devices', response_model=List[schemas.Device])
-def get_devices(db: Session = Depends(get_db)):
+def get_devices(db: Session = Depends(get_read_db)):
     return crud.get_all_devices(db)
 
 
 @app.get('/data/configurations', response_model=List[schemas.Configuration])
-def get_configurations(db: Session = Depends(get_db)):
+def get_configurations(db: Session = Depends(get_read_db)):
     return crud.get_all_configurations(db)
 
 
 @app.get('/data/measurements', response_model=List[schemas.Measurement])
-def get_measurements(limit: int = Query(default=1, ge=1), hours: int = Query(default=None, ge=1),  db: Session = Depends(get_db)):
+def get_measurements(limit: int = Query(default=1, ge=1), hours: int = Query(default=None, ge=1),  db: Session = Depends(get_read_db)):
     if hours is None:
         return crud.get_measurements_by_limit(db, limit=limit)
     else:
@@ -0,0 +1,16 @@
+"""
+Metrics of db_app in the Prometheus text format, served by /metrics
+"""
+import os
+import sys
+
+# The metric types are shared with device_control_app, in shared/ of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.prometheus import CONTENT_TYPE, Counter, Histogram, Registry
+
+registry = Registry()
+
+insert_seconds = registry.register(Histogram('um34c_db_insert_seconds', 'Seconds to store the posted samples, per request'))
+inserted_rows = registry.register(Counter('um34c_db_inserted_rows_total', 'Samples stored'))
+http_request_seconds = registry.register(Histogram('um34c_db_http_request_seconds',
+                                                   'Seconds to answer an API request', labels=('endpoint',)))
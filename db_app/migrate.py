@@ -0,0 +1,214 @@
+"""
+Brings an existing SQLite database to the schema of models.py, in place
+
+    python migrate.py --check
+    python migrate.py
+    python migrate.py --database-url sqlite:///./sql_app.db --rebuild --vacuum
+
+Tables whose columns differ are rebuilt (new table, copy of the rows, drop of the old table),
+otherwise only the indexes are dropped and created to match. The group0_mah ... group9_mwh columns
+of measurement are moved to group_data before. Stop db_app while migrating.
+"""
+import argparse
+import time
+from typing import List, Union
+
+from sqlalchemy import MetaData, Table, create_engine, inspect
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex, CreateTable, DDLElement
+
+import models
+from config import get_settings
+
+
+def execute(connection: Connection, statement: Union[str, DDLElement]) -> None:
+    """
+    Runs a statement on the DBAPI connection, SQLAlchemy would commit after every DDL statement
+    """
+    sql = statement if isinstance(statement, str) else str(statement.compile(dialect=connection.dialect))
+    connection.connection.cursor().execute(sql)
+
+
+def get_column_differences(connection: Connection, table: Table) -> List[str]:
+    existing = {column['name']: column['type'] for column in inspect(connection).get_columns(table.name)}
+    differences = [f'{table.name}.{name} is not in models.py' for name in existing if name not in table.columns]
+    for column in table.columns:
+        if column.name not in existing:
+            differences.append(f'{table.name}.{column.name} is missing')
+        elif existing[column.name]._type_affinity is not column.type._type_affinity:
+            differences.append(f'{table.name}.{column.name} is {existing[column.name]} instead of {column.type}')
+    return differences
+
+
+def get_indexes(connection: Connection, table: Table) -> tuple:
+    """
+    Existing and expected indexes of the table, as name: (columns, unique)
+    """
+    existing = {index['name']: (tuple(index['column_names']), bool(index['unique'])) for index in inspect(connection).get_indexes(table.name)}
+    expected = {index.name: (tuple(column.name for column in index.columns), bool(index.unique)) for index in table.indexes}
+    return existing, expected
+
+
+def get_index_differences(connection: Connection, table: Table) -> List[str]:
+    existing, expected = get_indexes(connection, table)
+    differences = [f'index {name} is not in models.py' for name in existing if name not in expected]
+    differences += [f'index {name} is missing' for name in expected if name not in existing]
+    differences += [f'index {name} differs' for name, index in expected.items() if name in existing and existing[name] != index]
+    return differences
+
+
+def move_group_data(connection: Connection, chunk_size: int = 10000) -> None:
+    """
+    Fills group_data from the group columns of measurement, with a row for every change of a group's values
+
+    db_app writes group_data from its first sample on, also into a database with the old schema. Only the measurements
+    before the first group_data row of their device are moved, the group_data rows are renumbered in measurement order.
+    """
+    columns = {column['name'] for column in inspect(connection).get_columns('measurement')}
+    if 'group0_mah' not in columns:
+        return
+    start = time.perf_counter()
+    cursor = connection.connection.cursor
+    covered = dict(cursor().execute('SELECT bd_address, MIN(measurement_id) FROM group_data GROUP BY bd_address'))
+    groups = [group_no for group_no in range(10) if f'group{group_no}_mah' in columns and f'group{group_no}_mwh' in columns]
+    group_columns = ', '.join(f'group{group_no}_mah, group{group_no}_mwh' for group_no in groups)
+    insert = 'INSERT INTO group_data (bd_address, measurement_id, group_no, mah, mwh) VALUES (?, ?, ?, ?, ?)'
+    rows = cursor().execute(f'SELECT id, bd_address, {group_columns} FROM measurement ORDER BY id')
+    previous = dict()
+    changes = []
+    count = 0
+    for row in rows:
+        measurement_id, bd_address, values = row[0], row[1], row[2:]
+        if bd_address in covered and measurement_id >= covered[bd_address]:
+            continue
+        last = previous.get(bd_address)
+        if last == values:
+            continue
+        for i, group_no in enumerate(groups):
+            if last is None or last[2 * i:2 * i + 2] != values[2 * i:2 * i + 2]:
+                changes.append((bd_address, measurement_id, group_no, values[2 * i], values[2 * i + 1]))
+        previous[bd_address] = values
+        if len(changes) >= chunk_size:
+            cursor().executemany(insert, changes)
+            count += len(changes)
+            changes = []
+    cursor().executemany(insert, changes)
+    count += len(changes)
+    if count and covered:
+        # crud takes the row with the highest id as the latest values of a group
+        last_id = cursor().execute('SELECT MAX(id) FROM group_data').fetchone()[0]
+        cursor().execute('INSERT INTO group_data (bd_address, measurement_id, group_no, mah, mwh) '
+                         'SELECT bd_address, measurement_id, group_no, mah, mwh FROM group_data ORDER BY measurement_id, id')
+        cursor().execute('DELETE FROM group_data WHERE id <= ?', (last_id,))
+    print(f'group_data: {count} rows from the group columns of measurement took {time.perf_counter() - start:.1f} s')
+    check_group_data(connection, groups)
+
+
+def check_group_data(connection: Connection, groups: List[int]) -> None:
+    """
+    Stops the migration if a device has group columns with values before its first group_data row
+    """
+    not_null = ' OR '.join(f'group{group_no}_mah IS NOT NULL OR group{group_no}_mwh IS NOT NULL' for group_no in groups)
+    missing = connection.connection.cursor().execute(
+        f'SELECT bd_address, first_id FROM (SELECT bd_address, MIN(id) AS first_id FROM measurement WHERE {not_null} '
+        'GROUP BY bd_address) AS m WHERE NOT EXISTS (SELECT 1 FROM group_data '
+        'WHERE group_data.bd_address IS m.bd_address AND group_data.measurement_id <= m.first_id)').fetchall()
+    if missing:
+        raise SystemExit(f'The group columns of {len(missing)} devices were not moved to group_data, e.g. {missing[0]}')
+
+
+def rebuild_table(connection: Connection, table: Table) -> None:
+    """
+    The table rebuild of https://www.sqlite.org/lang_altertable.html, the caller turns the foreign keys off
+    """
+    # A copy of the metadata, for a CREATE TABLE under another name whose foreign keys still resolve
+    metadata = MetaData()
+    for other in models.Base.metadata.sorted_tables:
+        other.to_metadata(metadata)
+    new_table = table.to_metadata(metadata, name=f'{table.name}_new')
+    existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+    columns = ', '.join(f'"{column.name}"' for column in table.columns if column.name in existing)
+
+    execute(connection, f'DROP TABLE IF EXISTS "{new_table.name}"')
+    execute(connection, CreateTable(new_table))
+    execute(connection, f'INSERT INTO "{new_table.name}" ({columns}) SELECT {columns} FROM "{table.name}"')
+    execute(connection, f'DROP TABLE "{table.name}"')
+    execute(connection, f'ALTER TABLE "{new_table.name}" RENAME TO "{table.name}"')
+    for index in table.indexes:
+        execute(connection, CreateIndex(index))
+
+
+def update_indexes(connection: Connection, table: Table) -> None:
+    existing, expected = get_indexes(connection, table)
+    for name, index in existing.items():
+        if expected.get(name) != index:
+            execute(connection, f'DROP INDEX "{name}"')
+    for index in table.indexes:
+        if existing.get(index.name) != expected[index.name]:
+            execute(connection, CreateIndex(index))
+
+
+def migrate(engine: Engine, check: bool = False, rebuild: bool = False, vacuum: bool = False) -> bool:
+    """
+    Returns True if the database had or, with check, has differences to models.py
+    """
+    if engine.dialect.name != 'sqlite':
+        raise SystemExit(f'Only SQLite databases can be migrated, not {engine.dialect.name}')
+
+    with engine.connect() as connection:
+        tables = set(inspect(connection).get_table_names())
+        plan = []
+        for table in models.Base.metadata.sorted_tables:
+            if table.name not in tables:
+                print(f'{table.name}: missing, is created')
+                continue
+            column_differences = get_column_differences(connection, table)
+            index_differences = get_index_differences(connection, table)
+            for difference in column_differences + index_differences:
+                print(f'{table.name}: {difference}')
+            if rebuild or column_differences:
+                plan.append((table, rebuild_table))
+            elif index_differences:
+                plan.append((table, update_indexes))
+    changed = bool(plan) or bool(set(models.Base.metadata.tables) - tables)
+    if check or not changed:
+        print('Differences found' if changed else 'The database matches models.py')
+        return changed
+
+    models.Base.metadata.create_all(bind=engine)
+    # The DBAPI connection without its own transaction handling, the migration is one transaction
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        # Foreign keys have to be off outside of the transaction for the rebuild to keep the references
+        execute(connection, 'PRAGMA foreign_keys = OFF')
+        execute(connection, 'BEGIN')
+        try:
+            move_group_data(connection)
+            for table, step in plan:
+                start = time.perf_counter()
+                step(connection, table)
+                print(f'{table.name}: {step.__name__} took {time.perf_counter() - start:.1f} s')
+            violations = connection.exec_driver_sql('PRAGMA foreign_key_check').fetchall()
+            if violations:
+                print(f'{len(violations)} rows reference missing rows, e.g. {violations[0]}')
+            execute(connection, 'COMMIT')
+        except BaseException:
+            execute(connection, 'ROLLBACK')
+            raise
+        execute(connection, 'ANALYZE')
+        if vacuum:
+            start = time.perf_counter()
+            execute(connection, 'VACUUM')
+            print(f'VACUUM took {time.perf_counter() - start:.1f} s')
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Brings an existing SQLite database to the schema of models.py')
+    parser.add_argument('--database-url', default=get_settings().database_url, help='SQLAlchemy url of the database')
+    parser.add_argument('--check', action='store_true', help='Only print the differences, exit code 1 if there are any')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild all tables, also without differences')
+    parser.add_argument('--vacuum', action='store_true', help='VACUUM afterwards, to give the space of dropped indexes back')
+    args = parser.parse_args()
+
+    differences = migrate(create_engine(args.database_url), check=args.check, rebuild=args.rebuild, vacuum=args.vacuum)
+    raise SystemExit(1 if args.check and differences else 0)
@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    Boolean, Column, ForeignKey, Integer, String, Float, DateTime
+    Boolean, Column, ForeignKey, Integer, String, Float, DateTime, Index
 )
 from sqlalchemy.orm import relationship
 
@@ -7,68 +7,71 @@ from database import Base
 
 class Device(Base):
     __tablename__ = 'devices'
-    bd_address = Column(String, primary_key=True, unique=True, index=True)
-    model_id = Column(String, index=True)
+    bd_address = Column(String, primary_key=True)
+    model_id = Column(String)
 
     measurements = relationship('Measurement', back_populates='device')
     configuration = relationship('Configuration', back_populates='device')
+    group_data = relationship('GroupData', back_populates='device')
 
 
 class Measurement(Base):
     __tablename__ = 'measurement'
 
-    id = Column(Integer, primary_key=True, index=True)
-    bd_address = Column(Integer, ForeignKey('devices.bd_address'))
+    id = Column(Integer, primary_key=True)
+    bd_address = Column(String, ForeignKey('devices.bd_address'))
 
     created_at = Column(DateTime, index=True)
-    voltage = Column(Float, index=True)
-    amperage = Column(Float, index=True)
-    wattage = Column(Float, index=True)
-    temperature_c = Column(Integer, index=True)
-    temperature_f = Column(Integer, index=True)
-    usb_volt_pos = Column(Float, index=True)
-    usb_volt_neg = Column(Float, index=True)
-    charging_mode = Column(String, index=True)
-    thresh_mah = Column(Integer, index=True)
-    thresh_mwh = Column(Integer, index=True)
-    thresh_seconds = Column(Integer, index=True)
-    resistance = Column(Float, index=True)
-    group0_mah = Column(Integer, index=True)
-    group0_mwh = Column(Integer, index=True)
-    group1_mah = Column(Integer, index=True)
-    group1_mwh = Column(Integer, index=True)
-    group2_mah = Column(Integer, index=True)
-    group2_mwh = Column(Integer, index=True)
-    group3_mah = Column(Integer, index=True)
-    group3_mwh = Column(Integer, index=True)
-    group4_mah = Column(Integer, index=True)
-    group4_mwh = Column(Integer, index=True)
-    group5_mah = Column(Integer, index=True)
-    group5_mwh = Column(Integer, index=True)
-    group6_mah = Column(Integer, index=True)
-    group6_mwh = Column(Integer, index=True)
-    group7_mah = Column(Integer, index=True)
-    group7_mwh = Column(Integer, index=True)
-    group8_mah = Column(Integer, index=True)
-    group8_mwh = Column(Integer, index=True)
-    group9_mah = Column(Integer, index=True)
-    group9_mwh = Column(Integer, index=True)
+    voltage = Column(Float)
+    amperage = Column(Float)
+    wattage = Column(Float)
+    temperature_c = Column(Integer)
+    temperature_f = Column(Integer)
+    usb_volt_pos = Column(Float)
+    usb_volt_neg = Column(Float)
+    charging_mode = Column(String)
+    thresh_mah = Column(Integer)
+    thresh_mwh = Column(Integer)
+    thresh_seconds = Column(Integer)
+    resistance = Column(Float)
 
     device = relationship('Device', back_populates='measurements')
 
+    # Queries filter on the time, of one or all devices, every further index slows down the inserts
+    __table_args__ = (Index('ix_measurement_bd_address_created_at', 'bd_address', 'created_at'),)
+
 
 class Configuration(Base):
     __tablename__ = 'configuration'
 
-    id = Column(Integer, primary_key=True, index=True)
-    bd_address = Column(Integer, ForeignKey('devices.bd_address'), unique=True, index=True)
+    id = Column(Integer, primary_key=True)
+    bd_address = Column(String, ForeignKey('devices.bd_address'), unique=True, index=True)
 
-    created_at = Column(DateTime, index=True)
-    selected_group = Column(Integer, index=True)
-    thresh_amps = Column(Float, index=True)
-    thresh_active = Column(Boolean, index=True)
-    screen_timeout = Column(Integer, index=True)
-    screen_backlight = Column(Integer, index=True)
-    cur_screen = Column(Integer, index=True)
+    created_at = Column(DateTime)
+    selected_group = Column(Integer)
+    thresh_amps = Column(Float)
+    thresh_active = Column(Boolean)
+    screen_timeout = Column(Integer)
+    screen_backlight = Column(Integer)
+    cur_screen = Column(Integer)
 
     device = relationship('Device', back_populates='configuration')
+
+
+class GroupData(Base):
+    """
+    Values of one data group from the measurement measurement_id on, a row is only added when they change
+    """
+    __tablename__ = 'group_data'
+
+    id = Column(Integer, primary_key=True)
+    bd_address = Column(String, ForeignKey('devices.bd_address'))
+    measurement_id = Column(Integer)
+
+    group_no = Column(Integer)
+    mah = Column(Integer)
+    mwh = Column(Integer)
+
+    device = relationship('Device', back_populates='group_data')
+
+    __table_args__ = (Index('ix_group_data_bd_address_measurement_id', 'bd_address', 'measurement_id'),)
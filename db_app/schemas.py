@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import List
+from typing import List, Union
 
 
 class GroupData(BaseModel):
@@ -62,26 +62,6 @@ class MeasurementBase(BaseModel):
     thresh_mwh: int
     thresh_seconds: int
     resistance: float
-    group0_mah: int
-    group0_mwh: int
-    group1_mah: int
-    group1_mwh: int
-    group2_mah: int
-    group2_mwh: int
-    group3_mah: int
-    group3_mwh: int
-    group4_mah: int
-    group4_mwh: int
-    group5_mah: int
-    group5_mwh: int
-    group6_mah: int
-    group6_mwh: int
-    group7_mah: int
-    group7_mwh: int
-    group8_mah: int
-    group8_mwh: int
-    group9_mah: int
-    group9_mwh: int
 
 
 class MeasurementCreate(MeasurementBase):
@@ -90,6 +70,26 @@ class MeasurementCreate(MeasurementBase):
 
 class Measurement(MeasurementBase):
     id: int
+    group0_mah: Union[int, None]
+    group0_mwh: Union[int, None]
+    group1_mah: Union[int, None]
+    group1_mwh: Union[int, None]
+    group2_mah: Union[int, None]
+    group2_mwh: Union[int, None]
+    group3_mah: Union[int, None]
+    group3_mwh: Union[int, None]
+    group4_mah: Union[int, None]
+    group4_mwh: Union[int, None]
+    group5_mah: Union[int, None]
+    group5_mwh: Union[int, None]
+    group6_mah: Union[int, None]
+    group6_mwh: Union[int, None]
+    group7_mah: Union[int, None]
+    group7_mwh: Union[int, None]
+    group8_mah: Union[int, None]
+    group8_mwh: Union[int, None]
+    group9_mah: Union[int, None]
+    group9_mwh: Union[int, None]
 
     class Config:
         orm_mode = True
@@ -118,3 +118,9 @@ class Configuration(ConfigurationBase):
 
 class CreateDataResponse(BaseModel):
     created_id: int
+
+
+class CreateBatchResponse(BaseModel):
+    count: int
+    first_id: Union[int, None]
+    last_id: Union[int, None]
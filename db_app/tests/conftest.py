@@ -0,0 +1,49 @@
+import copy
+import os
+import sys
+import tempfile
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# device_control_app has a config and a main module too, the tests import the ones of db_app
+for name in ('config', 'main'):
+    if not getattr(sys.modules.get(name), '__file__', APP_DIR).startswith(APP_DIR):
+        del sys.modules[name]
+sys.path.insert(0, APP_DIR)
+# The engine of database.py, which main uses, never gets to sql_app.db
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='um34c-test-'), 'app.db')
+
+from sqlalchemy.orm import sessionmaker
+
+import database, models, schemas
+from config import Settings
+from examples import SAMPLE
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    """
+    Session factories of two writers and a reader of a new database with the wal profile
+    """
+    settings = Settings(database_url=f'sqlite:///{tmp_path / "test.db"}')
+    write_engine, read_engine = database.create_engines(settings)
+    other_engine, _ = database.create_engines(settings)
+    models.Base.metadata.create_all(bind=write_engine)
+    yield (sessionmaker(bind=write_engine), sessionmaker(bind=other_engine), sessionmaker(bind=read_engine))
+    for engine in (write_engine, other_engine, read_engine):
+        engine.dispose()
+
+
+@pytest.fixture
+def make_sample():
+    """
+    UM34CResponse of SAMPLE at the given second, with other screen, group 0 mAh or device
+    """
+    def make(second: int, cur_screen: int = 0, group0_mah: int = 0, bd_address: str = '00:00:00:00:00:00') -> schemas.UM34CResponse:
+        sample = copy.deepcopy(SAMPLE)
+        sample.update({'created_at': f'2030-01-01T00:00:{second:02d}', 'cur_screen': cur_screen, 'bd_address': bd_address})
+        sample['group_data'][0]['mah'] = group0_mah
+        return schemas.UM34CResponse(**sample)
+    return make
@@ -0,0 +1,45 @@
+from fastapi.testclient import TestClient
+
+import crud, main, models, schemas
+
+
+def test_batch_returns_the_ids_of_the_inserts(sessions, make_sample):
+    write, _, read = sessions
+    with write() as db:
+        first = crud.create_measurement_and_configuration(db, make_sample(0))
+        batch = crud.create_measurements_batch(db, [make_sample(second) for second in range(1, 6)])
+    with read() as db:
+        ids = [row.id for row in db.query(models.Measurement.id).order_by(models.Measurement.id)]
+    assert first == {'created_id': ids[0]}
+    assert batch == {'count': 5, 'first_id': ids[1], 'last_id': ids[-1]}
+
+
+def test_rows_from_dicts_match_the_validated_samples(make_sample):
+    sample = make_sample(0)
+    data = {**sample.dict(), 'created_at': '2030-01-01T00:00:00', 'voltage': 5, 'extra': 'ignored'}
+    assert crud.get_row_from_dict(data) == crud.get_row(schemas.UM34CResponse(**data))
+    # Values that need a conversion take the way through UM34CResponse
+    converted = {**data, 'temperature_c': '25', 'thresh_active': 0, 'group_data': [{'mah': '1', 'mwh': 2.0}]}
+    row = crud.get_row_from_dict(converted)
+    assert (row['temperature_c'], row['thresh_active'], row['group_data']) == (25, False, [{'mah': 1, 'mwh': 2}])
+
+
+def test_post_data_batch(sessions, make_sample):
+    write, _, read = sessions
+
+    def get_db():
+        with write() as db:
+            yield db
+
+    samples = [{**make_sample(second).dict(), 'created_at': f'2030-01-01T00:00:{second:02d}'} for second in range(3)]
+    main.app.dependency_overrides[main.get_db] = get_db
+    try:
+        client = TestClient(main.app)
+        assert client.post('/data/batch', json=samples).json() == {'count': 3, 'first_id': 1, 'last_id': 3}
+        response = client.post('/data/batch', json=[samples[0], {**samples[1], 'voltage': 'high'}])
+    finally:
+        main.app.dependency_overrides.clear()
+    assert response.status_code == 422
+    assert response.json()['detail'][0]['loc'] == ['body', 1, 'voltage']
+    with read() as db:
+        assert db.query(models.Measurement).count() == 3
@@ -0,0 +1,31 @@
+import crud, models, schemas
+
+
+def test_group_data_round_trip(sessions, make_sample):
+    write, _, read = sessions
+    values = [0, 0, 5, 5, 7, 0, 0]
+    with write() as db:
+        crud.create_measurements_batch(db, [make_sample(second, group0_mah=mah) for second, mah in enumerate(values[:4])])
+        for second, mah in enumerate(values[4:], start=4):
+            crud.create_measurement_and_configuration(db, make_sample(second, group0_mah=mah))
+    with read() as db:
+        measurements = crud.get_measurements_by_limit(db, limit=len(values))
+        # Only changes of a group are stored
+        stored = db.query(models.GroupData).filter(models.GroupData.group_no == 0).count()
+    assert [measurement['group0_mah'] for measurement in measurements] == values
+    assert [measurement['group9_mwh'] for measurement in measurements] == [9] * len(values)
+    assert stored == 4
+    for measurement in measurements:
+        schemas.Measurement(**measurement)
+
+
+def test_missing_group_data_is_none(sessions, make_sample):
+    write, _, read = sessions
+    with write() as db:
+        crud.create_measurement_and_configuration(db, make_sample(0))
+        db.query(models.GroupData).delete()
+        db.commit()
+    with read() as db:
+        measurement = crud.get_measurements_by_limit(db, limit=1)[0]
+    assert measurement['group0_mah'] is None
+    assert schemas.Measurement(**measurement).group0_mah is None
@@ -0,0 +1,55 @@
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+
+import crud, migrate, models
+
+GROUP_COLUMNS = [f'group{group_no}_{unit}' for group_no in range(10) for unit in ('mah', 'mwh')]
+MEASUREMENT_COLUMNS = ['bd_address', 'created_at', 'voltage', 'amperage', 'wattage', 'temperature_c', 'temperature_f',
+                       'usb_volt_pos', 'usb_volt_neg', 'charging_mode', 'thresh_mah', 'thresh_mwh', 'thresh_seconds', 'resistance']
+
+
+def create_old_database(path) -> None:
+    """
+    Database of the schema before group_data, with three measurements of group 0 at 1, 1 and 2 mAh, the other groups at 9
+    """
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.begin() as connection:
+        connection.exec_driver_sql('CREATE TABLE devices (bd_address VARCHAR NOT NULL PRIMARY KEY, model_id VARCHAR)')
+        connection.exec_driver_sql(
+            'CREATE TABLE configuration (id INTEGER NOT NULL PRIMARY KEY, bd_address INTEGER UNIQUE, created_at DATETIME, '
+            'selected_group INTEGER, thresh_amps FLOAT, thresh_active BOOLEAN, screen_timeout INTEGER, '
+            'screen_backlight INTEGER, cur_screen INTEGER)')
+        connection.exec_driver_sql(
+            'CREATE TABLE measurement (id INTEGER NOT NULL PRIMARY KEY, bd_address INTEGER, created_at DATETIME, '
+            'voltage FLOAT, amperage FLOAT, wattage FLOAT, temperature_c INTEGER, temperature_f INTEGER, usb_volt_pos FLOAT, '
+            'usb_volt_neg FLOAT, charging_mode VARCHAR, thresh_mah INTEGER, thresh_mwh INTEGER, thresh_seconds INTEGER, '
+            f'resistance FLOAT, {", ".join(f"{column} INTEGER" for column in GROUP_COLUMNS)})')
+        connection.exec_driver_sql("INSERT INTO devices VALUES ('00:00:00:00:00:00', '0x0d4c')")
+        columns = MEASUREMENT_COLUMNS + GROUP_COLUMNS
+        insert = f'INSERT INTO measurement ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+        for second, mah in enumerate((1, 1, 2)):
+            values = ['00:00:00:00:00:00', f'2030-01-01 00:00:{second:02d}.000000', 5.0, 0.1, 0.5, 25, 77, 0.0, 0.0,
+                      'DCP1.5A', 0, 0, 0, 50.0, mah] + [9] * (len(GROUP_COLUMNS) - 1)
+            connection.exec_driver_sql(insert, tuple(values))
+    engine.dispose()
+
+
+def test_keeps_the_group_columns_of_a_database_db_app_already_wrote_to(tmp_path, make_sample):
+    path = tmp_path / 'old.db'
+    create_old_database(path)
+    engine = create_engine(f'sqlite:///{path}')
+    # db_app on the old schema: create_all adds group_data, the new sample goes there
+    models.Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        crud.create_measurement_and_configuration(db, make_sample(3, group0_mah=3))
+
+    assert migrate.migrate(engine)
+    assert 'group0_mah' not in {column['name'] for column in inspect(engine).get_columns('measurement')}
+    with sessionmaker(bind=engine)() as db:
+        measurements = crud.get_measurements_by_limit(db, limit=4)
+        latest = crud.get_latest_group_data(db, ['00:00:00:00:00:00'])
+    assert [measurement['group0_mah'] for measurement in measurements] == [1, 1, 2, 3]
+    assert [measurement['group1_mah'] for measurement in measurements] == [9, 9, 9, 1]
+    assert latest['00:00:00:00:00:00'][0] == (3, 0)
+    assert not migrate.migrate(engine, check=True)
+    engine.dispose()
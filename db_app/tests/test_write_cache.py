@@ -0,0 +1,26 @@
+import crud, models
+
+
+def test_second_writer_invalidates_the_write_cache(sessions, make_sample):
+    write, other, read = sessions
+    with write() as first, other() as second:
+        crud.create_measurement_and_configuration(first, make_sample(0, cur_screen=1, group0_mah=1))
+        crud.create_measurement_and_configuration(second, make_sample(1, cur_screen=2, group0_mah=2))
+        crud.create_measurement_and_configuration(first, make_sample(2, cur_screen=1, group0_mah=1))
+        second.query(models.Device).delete()
+        second.commit()
+        crud.create_measurement_and_configuration(first, make_sample(3, cur_screen=1, group0_mah=1))
+    with read() as db:
+        assert [configuration.cur_screen for configuration in crud.get_all_configurations(db)] == [1]
+        assert [measurement['group0_mah'] for measurement in crud.get_measurements_by_limit(db, limit=4)] == [1, 2, 1, 1]
+        assert [device.bd_address for device in crud.get_all_devices(db)] == ['00:00:00:00:00:00']
+
+
+def test_first_sample_of_a_new_device_with_foreign_keys(sessions, make_sample):
+    write, _, read = sessions
+    with write() as db:
+        db.connection().exec_driver_sql('PRAGMA foreign_keys = ON')
+        crud.create_measurement_and_configuration(db, make_sample(0))
+        crud.create_measurements_batch(db, [make_sample(1, bd_address='00:00:00:00:00:01'), make_sample(2)])
+    with read() as db:
+        assert sorted(device.bd_address for device in crud.get_all_devices(db)) == ['00:00:00:00:00:00', '00:00:00:00:00:01']
@@ -1,3 +1,4 @@
+import json
 from os import environ
 from os.path import join, dirname
 from pydantic import BaseSettings
@@ -16,8 +17,81 @@ class BluetoothSettings(BaseSettings):
     bl_channel = environ.get('BL_CHANNEL') or '1'
     max_attempts: int = environ.get('MAX_ATTEMPTS') or '10'
     attempts_delay: int = environ.get('ATTEMPT_DELAY') or '5000'
+    max_attempts_delay: int = environ.get('MAX_ATTEMPT_DELAY') or '60000'
+    breaker_cooldown: float = environ.get('BREAKER_COOLDOWN') or '30'
+    read_timeout: float = environ.get('READ_TIMEOUT') or '5'
+    simulator_address: str = environ.get('SIMULATOR_ADDRESS') or ''
+
+
+class SimulatorSettings(BaseSettings):
+    address: str = environ.get('SIMULATOR_ADDRESS') or 'tcp://127.0.0.1:9034'
+    latency: float = environ.get('SIMULATOR_LATENCY') or '0.05'
+    jitter: float = environ.get('SIMULATOR_JITTER') or '0.01'
+    drop_rate: float = environ.get('SIMULATOR_DROP_RATE') or '0'
+    command_delay: float = environ.get('SIMULATOR_COMMAND_DELAY') or '0'
+    meters: int = environ.get('SIMULATOR_METERS') or '10'
+
+
+class ConnectionSettings(BaseSettings):
+    health_check_interval: float = environ.get('HEALTH_CHECK_INTERVAL') or '10'
+
+
+class DiscoverySettings(BaseSettings):
+    cache_file: str = environ.get('DISCOVERY_CACHE_FILE') or join(dirname(__file__), 'discovery_cache.json')
+    ttl: float = environ.get('DISCOVERY_TTL') or '86400'
+    refresh_interval: float = environ.get('DISCOVERY_REFRESH_INTERVAL') or '300'
+
+
+class SamplerSettings(BaseSettings):
+    enabled: bool = environ.get('SAMPLER_ENABLED') or 'false'
+    sample_rate: float = environ.get('SAMPLE_RATE') or '2'
+    buffer_size: int = environ.get('SAMPLE_BUFFER_SIZE') or '600'
+    coalesce_window: float = environ.get('COALESCE_WINDOW') or '0.05'
+
+
+class RecorderSettings(BaseSettings):
+    enabled: bool = environ.get('RECORD_FRAMES') or 'false'
+    directory: str = environ.get('RECORD_DIR') or join(dirname(__file__), 'recordings')
+    file_name: str = environ.get('RECORD_FILE') or 'frames.um34clog'
+
+
+class UploadSettings(BaseSettings):
+    db_url = environ.get('DB_URL') or 'http://127.0.0.1:8081/data'
+    sample_rate: float = environ.get('UPLOAD_SAMPLE_RATE') or '10'
+    queue_size: int = environ.get('UPLOAD_QUEUE_SIZE') or '1000'
+    batch_size: int = environ.get('UPLOAD_BATCH_SIZE') or '50'
+    batch_interval: float = environ.get('UPLOAD_BATCH_INTERVAL') or '1'
+    timeout: float = environ.get('UPLOAD_TIMEOUT') or '5'
+    spool_dir: str = environ.get('SPOOL_DIR') or join(dirname(__file__), 'spool')
+    spool_segment_size: int = environ.get('SPOOL_SEGMENT_SIZE') or '4000000'
+    spool_max_size: int = environ.get('SPOOL_MAX_SIZE') or '1000000000'
+
+
+class ProfilingSettings(BaseSettings):
+    enabled: bool = environ.get('PROFILING_ENABLED') or 'false'
+    directory: str = environ.get('PROFILE_DIR') or join(dirname(__file__), 'profiles')
+    max_files: int = environ.get('PROFILE_MAX_FILES') or '50'
+    sample_interval: float = environ.get('PROFILE_SAMPLE_INTERVAL') or '0.001'
+
+
+class PollingSettings(BaseSettings):
+    bd_addresses = environ.get('POLLING_BD_ADDRESSES') or ''
+    upload: bool = environ.get('POLLING_UPLOAD') or 'false'
+
+
+class CommandSettings(BaseSettings):
+    spacing: dict = json.loads(environ.get('COMMAND_SPACING') or '{}')
+    spacing_file: str = environ.get('COMMAND_SPACING_FILE') or join(dirname(__file__), 'command_spacing.json')
 
 
 class Settings(BaseSettings):
     server = ServerSettings().dict()
-    bluetooth = BluetoothSettings().dict()
\ No newline at end of file
+    bluetooth = BluetoothSettings().dict()
+    connection = ConnectionSettings().dict()
+    discovery = DiscoverySettings().dict()
+    sampler = SamplerSettings().dict()
+    upload = UploadSettings().dict()
+    recorder = RecorderSettings().dict()
+    profiling = ProfilingSettings().dict()
+    polling = PollingSettings().dict()
+    command = CommandSettings().dict()
\ No newline at end of file
@@ -1,11 +1,13 @@
 import os
 import time
-from fastapi import FastAPI, Request, Depends
-from fastapi.responses import FileResponse
+import asyncio
+from fastapi import FastAPI, Request, Depends, HTTPException
+from fastapi.responses import FileResponse, Response
+from starlette.concurrency import run_in_threadpool
 from functools import lru_cache
-from config import ServerSettings, Settings
+from config import ServerSettings, Settings, BluetoothSettings, SamplerSettings, PollingSettings, RecorderSettings
 
-from routers import bl_connection, commands
+from routers import bl_connection, commands, commands_recorder, commands_sampler, commands_uploader, devices, metrics, profiling
 
 description = """
     UM34C API to easily control and receive data from an UM34C device via an API.
@@ -28,6 +30,17 @@ description = """
     * **setting backlight of the screen**
     * **setting timeout of the screen**
     * **resetting the device**
+    * **sampling the device in background**
+
+    ## devices
+
+    Polls many devices at once, each with its own connection, sampling rate and upload to the database
+
+    ## profiling
+
+    Every response has a 'Server-Timing' header with the time per stage (device connect and round-trip,
+    data preparation, validation, JSON encoding). Requests with the header 'X-Profile: cprofile' or 'X-Profile: sampling'
+    get profiled when PROFILING_ENABLED is true, the reports can be downloaded from '/profiles'
 """
 
 app = FastAPI(
@@ -35,10 +48,61 @@ app = FastAPI(
     description=description,
     version='2022.07.05',
     openapi_tags=[{'name': 'bluetooth', 'description': 'Commands connecting to UM34C'},
-                  {'name': 'command', 'description': 'Commands controlling UM34C'}]
+                  {'name': 'command', 'description': 'Commands controlling UM34C'},
+                  {'name': 'devices', 'description': 'Polling of many devices at once'},
+                  {'name': 'profiling', 'description': 'Profiles of single requests'}]
 )
 app.include_router(bl_connection.router)
 app.include_router(commands.router)
+app.include_router(devices.router)
+app.include_router(profiling.router)
+
+
+async def start_configured_sampler():
+    settings = SamplerSettings()
+    try:
+        bl_device = await bl_connection.connection_pool.acquire(**BluetoothSettings().dict())
+    except HTTPException:
+        return
+    await commands_sampler.start_sampler(bl_device, sample_rate=settings.sample_rate, buffer_size=settings.buffer_size)
+
+
+async def start_polled_device(bd_address: str, upload: bool):
+    try:
+        await devices.start_device(bd_address, upload=upload)
+    except HTTPException:
+        pass
+
+
+@app.on_event('startup')
+async def startup():
+    bl_connection.connection_pool.start()
+    bl_connection.start_discovery()
+    if RecorderSettings().enabled:
+        commands_recorder.start_recording(commands.get_recording_path(None))
+    if SamplerSettings().enabled:
+        asyncio.get_running_loop().create_task(start_configured_sampler())
+    polling = PollingSettings()
+    for bd_address in filter(None, map(str.strip, polling.bd_addresses.split(','))):
+        asyncio.get_running_loop().create_task(start_polled_device(bd_address, polling.upload))
+
+
+def stop_threads():
+    """
+    Joins the background threads and closes the connections, waiting for the running call of every device
+    """
+    commands.stop_uploader()
+    commands_uploader.stop_all_uploaders()
+    commands_recorder.stop_replay()
+    commands_recorder.stop_recording()
+    bl_connection.connection_pool.close_all()
+    bl_connection.device_cache.stop()
+
+
+@app.on_event('shutdown')
+async def shutdown():
+    await commands_sampler.stop_all_samplers()
+    await run_in_threadpool(stop_threads)
 
 
 @app.get('/', include_in_schema=False)
@@ -56,12 +120,29 @@ async def info(settings: Settings = Depends(get_settings)):
     return settings
 
 
+@app.get('/metrics', summary='Get metrics in Prometheus text format', response_description='Metrics', tags=['main'])
+async def get_metrics():
+    """
+    Latency histograms per stage (connect, send, recv, decode, serialize) and per endpoint,
+    frames, bytes and reconnects per device and the batch sizes of the uploads to db_app
+    """
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.middleware('http')
 async def add_process_time_header(request: Request, call_next):
     start_time = time.time()
-    response = await call_next(request)
+    timing = metrics.RequestTiming()
+    token = metrics.request_timing.set(timing)
+    try:
+        response = await profiling.call_profiled(request, call_next)
+    finally:
+        metrics.request_timing.reset(token)
     process_time = time.time() - start_time
+    endpoint = request.scope.get('endpoint')
+    metrics.http_request_seconds.observe(process_time, endpoint.__name__ if endpoint is not None else 'unmatched')
     response.headers['X-Process-Time'] = str(process_time)
+    response.headers['Server-Timing'] = timing.get_header(process_time)
     response.headers.update({'X-Command-URL': request.url.path})
     return response
 
@@ -3,11 +3,23 @@ import subprocess
 
 from fastapi import APIRouter, HTTPException, status, Depends
 from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+from concurrent.futures import Future
 from datetime import datetime
-from typing import Union, List
+from typing import Union, List, Dict, Callable, Iterator
+import asyncio
+import random
 import socket
-from .commands_models import BLDeviceBase, BLDevice, BLErrorMessage400, BLErrorMessage404, BLErrorMessage409
-from config import BluetoothSettings
+import select
+import threading
+import time
+from .bl_discovery import DiscoveryCache
+from .bl_scheduler import DeviceScheduler, Priority, deadline_exceeded
+from .commands_decoder import FrameReader, UM34CFrame, decode_frame
+from .commands_models import BLDeviceBase, BLDevice, BLConnection, CachedDevice, BLErrorMessage400, BLErrorMessage404, BLErrorMessage409
+from .metrics import registry, observe_stage, time_stage, CallbackMetric, TimedRoute
+from .socket_address import parse_address
+from config import BluetoothSettings, ConnectionSettings, DiscoverySettings
 
 
 PYBLUEZ_OK = False
@@ -32,22 +44,25 @@ if platform.system() == 'Windows':
 router = APIRouter(
     prefix='/bluetooth',
     tags=['bluetooth'],
+    route_class=TimedRoute,
     dependencies=[],
     responses={}
 )
 
-device_cache = dict()
+# Called with bd_address and frame for every received frame, e.g. to record them
+frame_hooks: List[Callable[[str, memoryview], None]] = list()
+
+device_cache = DiscoveryCache(path=DiscoverySettings().cache_file, ttl=DiscoverySettings().ttl)
 
 
 # Dependency
-def get_bluetooth_device():
-    with BluetoothDevice(**BluetoothSettings().dict()) as bl_device:
-        yield bl_device
+async def get_bluetooth_device():
+    yield await connection_pool.acquire(**BluetoothSettings().dict())
 
 
 def discover_devices() -> List[BLDeviceBase]:
     found_devices = [BLDeviceBase(**{'bd_address': addr, 'name': name}) for addr, name in bluetooth.discover_devices(lookup_names=True)]
-    device_cache.update({device.name: device.bd_address for device in found_devices})
+    device_cache.update({device.name: device.bd_address for device in found_devices}, complete=True)
     return found_devices
 
 
@@ -59,22 +74,89 @@ def discover_devices_win() -> List[BLDeviceBase]:
     p = subprocess.Popen("btdiscovery", stdout=subprocess.PIPE).communicate()[0].decode('utf-8').split('\n')[:-1]
     devices = [device.replace('\r', '').replace('(', '').replace(')', '').split('\t')[:2] for device in p]
     found_devices = [BLDeviceBase(**{'bd_address': addr, 'name': name}) for addr, name in devices]
-    device_cache.update({device.name: device.bd_address for device in found_devices})
+    device_cache.update({device.name: device.bd_address for device in found_devices}, complete=True)
     return found_devices
 
 
+def get_discover_function() -> Union[Callable, None]:
+    return discover_devices if PYBLUEZ_OK else discover_devices_win if BLUETOOTH_TOOLS_OK else None
+
+
+def start_discovery() -> None:
+    device_cache.start(get_discover_function(), interval=DiscoverySettings().refresh_interval)
+
+
+class CircuitBreaker:
+    """
+    Remembers that a device is unreachable, so connecting fails fast instead of retrying again and again
+
+    - **closed** : connecting is allowed
+    - **open** : connecting fails with 409 until cooldown seconds have passed
+    - **half_open** : cooldown has passed, the next connect is a single probe attempt
+
+    A failed probe opens the breaker again with twice the cooldown, up to max_cooldown.
+    """
+    def __init__(self, cooldown: float = 30.0, max_cooldown: float = 600.0):
+        self.cooldown = float(cooldown)
+        self.max_cooldown = float(max_cooldown)
+        self.current_cooldown = self.cooldown
+        self.opened_at = None
+        self.trips = 0
+
+    def get_state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.current_cooldown:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        return self.get_state() != 'open'
+
+    def record_success(self) -> None:
+        self.opened_at = None
+        self.current_cooldown = self.cooldown
+
+    def record_failure(self) -> None:
+        if self.opened_at is not None:
+            self.current_cooldown = min(self.current_cooldown * 2, self.max_cooldown)
+        self.opened_at = time.monotonic()
+        self.trips += 1
+
+    def get_retry_in(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.current_cooldown - time.monotonic())
+
+    def get_info(self) -> dict:
+        return {'breaker_state': self.get_state(), 'breaker_trips': self.trips, 'retry_in': round(self.get_retry_in(), 3)}
+
+
 class BluetoothDevice:
-    def __init__(self, name: Union[str, None], bd_address: Union[str, None], bl_channel: int = 1, max_attempts: int = 10, attempts_delay: int = 5000):
-        if PYBLUEZ_OK:
-            self.sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
-        else:
-            self.sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+    """
+    RFCOMM connection to a device, or with simulator_address set a TCP / unix socket connection to simulator.py
+    """
+    def __init__(self, name: Union[str, None], bd_address: Union[str, None], bl_channel: int = 1, max_attempts: int = 10, attempts_delay: int = 5000,
+                 max_attempts_delay: int = 60000, breaker_cooldown: float = 30.0, read_timeout: float = 5.0,
+                 simulator_address: str = ''):
+        self.simulator_address = simulator_address or None
+        self.read_timeout = float(read_timeout) or None
+        self.sock = self.new_socket()
 
         self.device_name = name if name else None
         self.bd_address = bd_address.replace('_', ':') if bd_address else None
         self.channel = int(bl_channel)
         self.max_attempts = int(max_attempts)
         self.attempts_delay = int(attempts_delay)
+        self.max_attempts_delay = int(max_attempts_delay)
+        self.breaker = CircuitBreaker(cooldown=breaker_cooldown)
+
+        self.connected = False
+        self.connected_since = None
+        self.connects = 0
+        self.reconnects = 0
+        self.sent_bytes = 0
+        self.reader = FrameReader()
 
         if self.bd_address is None:
             self.findout_bd_address()
@@ -89,28 +171,29 @@ class BluetoothDevice:
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.sock.close()
+        self.close()
 
     def findout_bd_address(self):
-        if self.device_name in device_cache:
-            self.bd_address = device_cache[self.device_name]
+        """
+        Looks the name up in the discovery cache, a miss starts a discovery in background instead of waiting for it
+        """
+        bd_address = device_cache.get(self.device_name)
+        if bd_address is not None:
+            self.bd_address = bd_address
         else:
-            discover_devices() if PYBLUEZ_OK else discover_devices_win() if BLUETOOTH_TOOLS_OK else None
-            if self.device_name in device_cache:
-                self.bd_address = device_cache[self.device_name]
-            else:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                    detail=f"No device found named {self.device_name}",
-                                    headers={'X-Error': f"No device found named {self.device_name}"}
-                                    )
+            message = f"No device found named {self.device_name}"
+            if device_cache.discover is not None:
+                message += ', searching in background, try again later'
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=message,
+                                headers={'X-Error': message}
+                                )
 
     def get_name_by_addr(self):
-        for i in range(2):
-            for name, bd_address in device_cache.items():
-                if self.bd_address == bd_address:
-                    self.device_name = name
-                    return
-            discover_devices_win()
+        for name, bd_address in device_cache.items():
+            if self.bd_address == bd_address:
+                self.device_name = name
+                return
 
     def is_valid_address(self):
         """returns True if address is a valid Bluetooth address.
@@ -152,52 +235,367 @@ class BluetoothDevice:
     def get_channel(self) -> int:
         return self.channel
 
-    def connect(self) -> dict:
-        attempts = 0
+    def get_backoff(self, attempt: int) -> float:
+        """
+        Seconds to wait before the attempt, attempts_delay doubled per attempt and half of it randomized
+        """
+        delay = min(self.attempts_delay * 2 ** (attempt - 1), self.max_attempts_delay) / 1000
+        return delay / 2 + random.uniform(0, delay / 2)
 
-        while attempts <= self.max_attempts:
+    def new_socket(self):
+        if self.simulator_address is not None:
+            family, _ = parse_address(self.simulator_address)
+            return socket.socket(socket.AF_UNIX if family == 'unix' else socket.AF_INET, socket.SOCK_STREAM)
+        if PYBLUEZ_OK:
+            return bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+        return socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+
+    def connect_socket(self) -> None:
+        if self.simulator_address is not None:
+            _, address = parse_address(self.simulator_address)
+            self.sock.connect(address)
+            # The simulator serves many meters, the first line tells it which one
+            self.sock.sendall(f'{self.bd_address}\n'.encode())
+        else:
+            self.sock.connect((self.bd_address, self.channel))
             if PYBLUEZ_OK:
-                self.sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
-            else:
-                self.sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
-            try:
-                self.sock.connect((self.bd_address, self.channel))
-                if PYBLUEZ_OK:
-                    self.device_name = bluetooth.lookup_name(self.bd_address)
-                break
-            except TimeoutError:
-                raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT,
-                                    detail='Timeout',
-                                    headers={'X-Error': 'Timeout'}
-                                    )
-            except OSError as e:
-                pass
-            except IOError as error:
-                pass
-            finally:
-                attempts += 1
+                self.device_name = bluetooth.lookup_name(self.bd_address)
+        self.sock.settimeout(self.read_timeout)
 
-        else:
+    def get_connect_delays(self, deadline: Union[float, None] = None) -> Iterator[float]:
+        """
+        Seconds to wait before each connect attempt, for a loop that stops at the first successful attempt
+
+        While the circuit breaker is open it fails at once with 409, when half open there is only one attempt.
+        Fails with 408 if the next attempt would start after deadline, with 409 once all attempts failed.
+        """
+        if not self.breaker.allow():
+            message = f"Device unreachable, next try in {self.breaker.get_retry_in():.0f} s"
             raise HTTPException(status_code=status.HTTP_409_CONFLICT,
-                                detail='Too many attempts',
-                                headers={'X-Error': 'Too many attempts'}
+                                detail=message,
+                                headers={'X-Error': message}
                                 )
+        max_attempts = 0 if self.breaker.get_state() == 'half_open' else self.max_attempts
+        for attempt in range(max_attempts + 1):
+            delay = self.get_backoff(attempt) if attempt > 0 else 0.0
+            if deadline is not None and time.monotonic() + delay > deadline:
+                raise deadline_exceeded()
+            yield delay
+        self.breaker.record_failure()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail='Too many attempts',
+                            headers={'X-Error': 'Too many attempts'}
+                            )
+
+    def connect_attempt(self) -> bool:
+        """
+        Connects once, returns False on connect errors and timeouts. True also if it already was connected
+        """
+        if self.connected:
+            return True
+        self.sock.close()
+        self.sock = self.new_socket()
+        try:
+            with time_stage('connect'):
+                self.connect_socket()
+        except OSError:
+            return False
+        self.connected = True
+        self.connected_since = datetime.now()
+        if self.connects:
+            self.reconnects += 1
+        self.connects += 1
+        self.breaker.record_success()
+        return True
+
+    def connect(self, deadline: Union[float, None] = None) -> dict:
+        """
+        Connects with exponential backoff between the attempts, waiting in the calling thread
 
+        Not to be called on the I/O thread of an AsyncBluetoothDevice, its connect waits without holding that thread.
+        """
+        for delay in self.get_connect_delays(deadline):
+            time.sleep(delay)
+            if self.connect_attempt():
+                return self.get_connected_info()
+
+    def get_connected_info(self) -> dict:
         return {'timestamp': datetime.now(), 'name': self.device_name, 'bd_address': self.bd_address, 'channel': self.channel}
 
+    def check_connection(self) -> None:
+        """
+        Reconnects with a single attempt if the device dropped the connection, the next check tries again
+
+        For an unreachable device this is the half open probe once the breaker cooldown has passed.
+        """
+        if self.is_alive() or not self.breaker.allow():
+            return
+        self.close()
+        if not self.connect_attempt() and self.breaker.get_state() == 'half_open':
+            self.breaker.record_failure()
+
+    def close(self) -> None:
+        self.sock.close()
+        self.reader.clear()
+        self.connected = False
+        self.connected_since = None
+
+    def is_alive(self) -> bool:
+        """
+        Checks without blocking if the connection is still open
+
+        A readable socket while idle either means the peer closed the connection (empty read)
+        or that stale bytes are pending, which get drained so the next frame is not misaligned
+        """
+        if not self.connected:
+            return False
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if readable:
+                return len(self.sock.recv(1024)) > 0
+        except (OSError, ValueError):
+            return False
+        return True
+
     def send(self, command: bytes) -> None:
-        self.sock.send(command)
+        try:
+            with time_stage('send'):
+                self.sent_bytes += self.sock.send(command)
+        except OSError:
+            self.close()
+            raise
+
+    def receive_frame(self, command: bytes) -> memoryview:
+        """
+        Sends the command and returns the answer as a view into the receive buffer, valid until the next read
+
+        Bytes already buffered stay, they can be the beginning of the answer. After a timeout or error
+        the connection gets closed, which drops them.
+        """
+        try:
+            start = time.perf_counter()
+            self.sent_bytes += self.sock.send(command)
+            sent = time.perf_counter()
+            frame = self.reader.read_frame(self.sock)
+            observe_stage('send', sent - start)
+            observe_stage('recv', time.perf_counter() - sent)
+        except socket.timeout:
+            self.close()
+            raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT,
+                                detail='Timeout',
+                                headers={'X-Error': 'Timeout'}
+                                )
+        except OSError:
+            self.close()
+            raise
+        for hook in frame_hooks:
+            hook(self.bd_address, frame)
+        return frame
+
+    def send_and_receive(self, command: bytes) -> bytes:
+        return bytes(self.receive_frame(command))
 
-    def send_and_receive(self, command: bytes) -> str:
-        self.sock.send(command)
-        buffer = bytearray()
-        while len(buffer) < 130:
-            buffer += self.sock.recv(130)
-        return buffer.hex()
+    def request_frame(self, command: bytes) -> UM34CFrame:
+        """
+        Sends the command and decodes the answer straight from the receive buffer
+        """
+        frame = self.receive_frame(command)
+        with time_stage('decode'):
+            return decode_frame(frame)
 
     def get_info(self):
         return {'name': self.get_name(), 'bd_address': self.get_bd_address(), 'channel': self.get_channel()}
 
+    def get_counters(self) -> dict:
+        return {'frames': self.reader.frames, 'received_bytes': self.reader.received, 'sent_bytes': self.sent_bytes,
+                'connects': self.connects, 'reconnects': self.reconnects, 'breaker_trips': self.breaker.trips}
+
+    def get_connection_info(self):
+        return {**self.get_info(), 'connected': self.connected, 'connected_since': self.connected_since,
+                **self.reader.get_info(), **self.breaker.get_info()}
+
+
+class AsyncBluetoothDevice:
+    """
+    Awaitable interface of a BluetoothDevice
+
+    Every socket call runs on the device's own I/O thread, so a slow device never blocks the event loop
+    and the calls to one device are executed one after another, control commands first (see DeviceScheduler).
+    A deadline is a time.monotonic() value, callers still waiting for the device at that time get a 408.
+    """
+    def __init__(self, bl_device: BluetoothDevice):
+        self.device = bl_device
+        self.scheduler = DeviceScheduler(name=f'bl-io-{bl_device.get_bd_address()}')
+
+    def submit(self, fn: Callable, *args, priority: Priority = Priority.read, deadline: Union[float, None] = None,
+               **kwargs) -> Future:
+        return self.scheduler.submit(fn, *args, priority=priority, deadline=deadline, **kwargs)
+
+    def run_sync(self, fn: Callable, *args, priority: Priority = Priority.read, deadline: Union[float, None] = None,
+                 **kwargs):
+        """Runs fn on the I/O thread and waits for it, for callers outside of the event loop"""
+        return self.submit(fn, *args, priority=priority, deadline=deadline, **kwargs).result()
+
+    async def run(self, fn: Callable, *args, priority: Priority = Priority.read, deadline: Union[float, None] = None,
+                  **kwargs):
+        future = asyncio.wrap_future(self.submit(fn, *args, priority=priority, deadline=deadline, **kwargs))
+        if deadline is None:
+            return await future
+        try:
+            return await asyncio.wait_for(future, max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            raise deadline_exceeded()
+
+    async def connect(self, priority: Priority = Priority.control, deadline: Union[float, None] = None) -> dict:
+        """
+        Connects with exponential backoff, only the attempts run on the I/O thread
+
+        Between the attempts the I/O thread runs the other calls to the device, e.g. control commands or close.
+        """
+        for delay in self.device.get_connect_delays(deadline):
+            await asyncio.sleep(delay)
+            if await self.run(self.device.connect_attempt, priority=priority, deadline=deadline):
+                return self.device.get_connected_info()
+
+    def connect_sync(self, priority: Priority = Priority.read, deadline: Union[float, None] = None) -> dict:
+        """connect for callers outside of the event loop, they wait between the attempts in their own thread"""
+        for delay in self.device.get_connect_delays(deadline):
+            time.sleep(delay)
+            if self.run_sync(self.device.connect_attempt, priority=priority, deadline=deadline):
+                return self.device.get_connected_info()
+
+    async def ensure_connected(self, priority: Priority = Priority.read, deadline: Union[float, None] = None) -> None:
+        if not self.device.connected:
+            await self.connect(priority=priority, deadline=deadline)
+
+    async def send(self, command: bytes, priority: Priority = Priority.control, deadline: Union[float, None] = None) -> None:
+        await self.run(self.device.send, command, priority=priority, deadline=deadline)
+
+    async def send_and_receive(self, command: bytes, priority: Priority = Priority.read,
+                               deadline: Union[float, None] = None) -> bytes:
+        return await self.run(self.device.send_and_receive, command, priority=priority, deadline=deadline)
+
+    async def request_frame(self, command: bytes, priority: Priority = Priority.read,
+                            deadline: Union[float, None] = None) -> UM34CFrame:
+        return await self.run(self.device.request_frame, command, priority=priority, deadline=deadline)
+
+    @staticmethod
+    async def sleep(seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+    def close(self) -> None:
+        self.run_sync(self.device.close, priority=Priority.control)
+        self.scheduler.shutdown()
+
+    def get_bd_address(self) -> str:
+        return self.device.get_bd_address()
+
+    def get_name(self) -> str:
+        return self.device.get_name()
+
+    def get_channel(self) -> int:
+        return self.device.get_channel()
+
+    def get_info(self):
+        return self.device.get_info()
+
+    def get_connection_info(self):
+        return {**self.device.get_connection_info(), 'scheduler': self.scheduler.get_info()}
+
+
+class BluetoothConnectionPool:
+    """
+    Keeps one long-lived connection per bd_address open
+
+    Request handlers acquire the live connection instead of connecting for every command.
+    A background thread checks the connections and reconnects them when the device dropped the link.
+    """
+    def __init__(self, health_check_interval: float = 10.0):
+        self.devices: Dict[str, AsyncBluetoothDevice] = dict()
+        self.lock = threading.Lock()
+        self.health_check_interval = float(health_check_interval)
+        self.stop_event = threading.Event()
+        self.health_thread = None
+
+    def lookup(self, name: Union[str, None] = None, bd_address: Union[str, None] = None, **kwargs) -> Union[AsyncBluetoothDevice, None]:
+        key = bd_address.replace('_', ':') if bd_address else device_cache.get(name)
+        return self.devices.get(key)
+
+    def get_device(self, **settings) -> AsyncBluetoothDevice:
+        """
+        Returns the pooled device, creating it first if needed. Can block while discovering the bd_address
+        """
+        bl_device = self.lookup(**settings)
+        if bl_device is None:
+            new_device = BluetoothDevice(**settings)
+            with self.lock:
+                bl_device = self.devices.get(new_device.get_bd_address())
+                if bl_device is None:
+                    bl_device = self.devices[new_device.get_bd_address()] = AsyncBluetoothDevice(new_device)
+        return bl_device
+
+    async def acquire(self, **settings) -> AsyncBluetoothDevice:
+        bl_device = self.lookup(**settings) or await run_in_threadpool(self.get_device, **settings)
+        await bl_device.ensure_connected()
+        return bl_device
+
+    def acquire_sync(self, **settings) -> AsyncBluetoothDevice:
+        bl_device = self.get_device(**settings)
+        if not bl_device.device.connected:
+            bl_device.connect_sync()
+        return bl_device
+
+    def health_check(self) -> None:
+        for bl_device in list(self.devices.values()):
+            bl_device.submit(bl_device.device.check_connection, priority=Priority.maintenance)
+
+    def run_health_check(self) -> None:
+        while not self.stop_event.wait(self.health_check_interval):
+            self.health_check()
+
+    def start(self) -> None:
+        if self.health_thread is None or not self.health_thread.is_alive():
+            self.stop_event.clear()
+            self.health_thread = threading.Thread(target=self.run_health_check, name='bl-health-check', daemon=True)
+            self.health_thread.start()
+
+    def close(self, bd_address: str) -> bool:
+        with self.lock:
+            bl_device = self.devices.pop(bd_address.replace('_', ':'), None)
+        if bl_device is None:
+            return False
+        bl_device.close()
+        return True
+
+    def close_all(self) -> None:
+        self.stop_event.set()
+        for bd_address in list(self.devices.keys()):
+            self.close(bd_address)
+
+    def get_connections(self) -> List[dict]:
+        return [bl_device.get_connection_info() for bl_device in list(self.devices.values())]
+
+    def collect(self, key: str) -> List[tuple]:
+        """
+        Per device values for the metrics, key is one of BluetoothDevice.get_counters() or 'queue_depth'
+        """
+        return [((bl_device.get_bd_address(),),
+                 bl_device.scheduler.get_depth() if key == 'queue_depth' else bl_device.device.get_counters()[key])
+                for bl_device in list(self.devices.values())]
+
+
+connection_pool = BluetoothConnectionPool(**ConnectionSettings().dict())
+
+for key, kind, documentation in (('frames', 'counter', 'Frames received from the device'),
+                                 ('received_bytes', 'counter', 'Bytes received from the device'),
+                                 ('sent_bytes', 'counter', 'Bytes sent to the device'),
+                                 ('connects', 'counter', 'Successful connects to the device'),
+                                 ('reconnects', 'counter', 'Connects after the connection to the device was lost or closed'),
+                                 ('breaker_trips', 'counter', 'Times the circuit breaker of the device opened'),
+                                 ('queue_depth', 'gauge', 'Calls waiting for the I/O thread of the device')):
+    registry.register(CallbackMetric(f'um34c_device_{key}' + ('_total' if kind == 'counter' else ''), documentation, kind,
+                                     ('bd_address',), lambda key=key: connection_pool.collect(key)))
+
 
 @router.get('/', include_in_schema=False)
 async def bl_index():
@@ -218,9 +616,9 @@ async def get_nearby_devices():
     **INFO** : Will only work if pybluez is installed! Or 'Bluetooth Command Line Tools' is installed on Windows!
     """
     if PYBLUEZ_OK:
-        return discover_devices()
+        return await run_in_threadpool(discover_devices)
     elif BLUETOOTH_TOOLS_OK:
-        return discover_devices_win()
+        return await run_in_threadpool(discover_devices_win)
 
 
 @router.get('/test', response_model=BLDevice,
@@ -242,16 +640,48 @@ async def test(bl_sock=Depends(get_bluetooth_device)):
             }
 
 
-@router.get('/cache', response_model=List[BLDeviceBase],
+@router.get('/cache', response_model=List[CachedDevice],
                       summary='Shows cached bluetooth devices',
                       response_description='List of cached devices',
 )
 async def get_device_cache():
     """
     Shows cached bluetooth devices. Every time 'device_discovery' is used, the found devices and its bd address will be saved.
+    The cache is saved to disk and survives restarts.
 
-    Device discovery will be used when:
-    - any device command is used and a name but no bd_address is given. Or opposite.
-    - user uses the '/discover_devices' command
+    Device discovery will be used:
+    - in background, every DISCOVERY_REFRESH_INTERVAL seconds
+    - in background, when a device command is used with a name that is not cached, or cached longer than DISCOVERY_TTL seconds
+    - when user uses the '/discover_devices' command
+    """
+    return device_cache.get_entries()
+
+
+@router.get('/connections', response_model=List[BLConnection],
+                            summary='Shows open bluetooth connections',
+                            response_description='List of pooled connections',
+)
+async def get_connections():
+    """
+    Shows the connections kept open by the connection pool.
+
+    A connection gets opened by the first device command and stays open for the following commands.
+    """
+    return connection_pool.get_connections()
+
+
+@router.get('/disconnect/{bd_address}', response_model=List[BLConnection],
+                                        summary='Closes a pooled bluetooth connection',
+                                        response_description='List of remaining pooled connections',
+                                        responses={404: {'model': BLErrorMessage404}}
+)
+async def disconnect(bd_address: str):
+    """
+    Closes the pooled connection of the given bd_address. The next device command connects again.
     """
-    return [{'name': name, 'bd_address': bd_address} for name, bd_address in device_cache.items()]
+    if not await run_in_threadpool(connection_pool.close, bd_address):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"No connection open to {bd_address}",
+                            headers={'X-Error': f"No connection open to {bd_address}"}
+                            )
+    return connection_pool.get_connections()
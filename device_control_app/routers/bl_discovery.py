@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Union, Dict, List, Callable
+
+
+class DiscoveryCache:
+    """
+    Maps device names to bd addresses found by discovery
+
+    Entries are kept on disk, so connecting by name works right after a restart without a scan.
+    Lookups never scan: a missing or stale entry (older than ttl seconds) only wakes up the background
+    discovery thread, a stale entry is still returned meanwhile. A complete scan drops the stale entries it did not find.
+    """
+    def __init__(self, path: Union[str, None] = None, ttl: float = 86400.0):
+        self.path = path or None
+        self.ttl = float(ttl)
+        self.entries: Dict[str, dict] = dict()
+        self.lock = threading.Lock()
+        self.discover: Union[Callable, None] = None
+        self.refresh_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last_refresh = None
+        self.last_error = None
+        self.load()
+
+    def load(self) -> None:
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as file:
+                entries = json.load(file)
+            self.entries = {name: {'bd_address': entry['bd_address'], 'last_seen': float(entry['last_seen'])}
+                            for name, entry in entries.items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            self.entries = dict()
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as file:
+                json.dump(self.entries, file, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as error:
+            self.last_error = repr(error)
+
+    def is_stale(self, entry: dict) -> bool:
+        return time.time() - entry['last_seen'] > self.ttl
+
+    def get(self, name: Union[str, None], default: Union[str, None] = None) -> Union[str, None]:
+        if not name:
+            return default
+        entry = self.entries.get(name)
+        if entry is None or self.is_stale(entry):
+            self.request_refresh()
+        return entry['bd_address'] if entry is not None else default
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def __getitem__(self, name: str) -> str:
+        bd_address = self.get(name)
+        if bd_address is None:
+            raise KeyError(name)
+        return bd_address
+
+    def items(self) -> List[tuple]:
+        return [(name, entry['bd_address']) for name, entry in list(self.entries.items())]
+
+    def update(self, found: Dict[str, str], complete: bool = False) -> None:
+        """
+        Stores the found devices, after a complete scan stale devices that were not found are dropped
+        """
+        now = time.time()
+        with self.lock:
+            if complete:
+                self.entries = {name: entry for name, entry in self.entries.items()
+                                if name in found or not self.is_stale(entry)}
+            self.entries.update({name: {'bd_address': bd_address, 'last_seen': now}
+                                 for name, bd_address in found.items() if name})
+            self.save()
+
+    def request_refresh(self) -> None:
+        if self.discover is not None:
+            self.refresh_event.set()
+
+    def refresh(self) -> None:
+        try:
+            self.discover()
+            self.last_error = None
+        except Exception as error:
+            self.last_error = repr(error)
+        self.last_refresh = time.time()
+
+    def run(self, interval: float) -> None:
+        while not self.stop_event.is_set():
+            if self.refresh_event.wait(interval):
+                self.refresh_event.clear()
+            if self.stop_event.is_set():
+                break
+            self.refresh()
+
+    def start(self, discover: Union[Callable, None], interval: float = 300.0) -> None:
+        """
+        Starts the background discovery, it scans every interval seconds and whenever a lookup missed
+        """
+        self.discover = discover
+        if discover is None or (self.thread is not None and self.thread.is_alive()):
+            return
+        self.stop_event.clear()
+        if not self.entries or any(self.is_stale(entry) for entry in self.entries.values()):
+            self.refresh_event.set()
+        self.thread = threading.Thread(target=self.run, args=(float(interval),), name='bl-discovery', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.refresh_event.set()
+
+    def get_entries(self) -> List[dict]:
+        return [{'name': name, 'bd_address': entry['bd_address'], 'last_seen': datetime.fromtimestamp(entry['last_seen']), 'stale': self.is_stale(entry)}
+                for name, entry in list(self.entries.items())]
@@ -0,0 +1,128 @@
+import contextvars
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from enum import IntEnum
+from typing import Union, Callable
+
+from fastapi import HTTPException, status
+
+from .metrics import add_request_stage, request_timing
+
+
+class Priority(IntEnum):
+    control = 0
+    read = 1
+    background = 2
+    maintenance = 3
+
+
+class Job:
+    __slots__ = ('fn', 'args', 'kwargs', 'future', 'priority', 'enqueued', 'deadline', 'context')
+
+    def __init__(self, fn: Callable, args: tuple, kwargs: dict, priority: Priority, deadline: Union[float, None]):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.deadline = deadline
+        # Only calls of an API request take its context along, for its Server-Timing header
+        self.context = contextvars.copy_context() if request_timing.get() is not None else None
+
+
+def deadline_exceeded() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT,
+                         detail='Deadline exceeded',
+                         headers={'X-Error': 'Deadline exceeded'}
+                         )
+
+
+class DeviceScheduler:
+    """
+    Runs all calls to one device on a single I/O thread, in order of priority
+
+    Control commands go ahead of interactive reads, which go ahead of background sampling and health checks.
+    Calls of the same priority run in the order they were submitted. A call whose deadline (time.monotonic())
+    passed while it was queued is not run and fails with 408.
+    Calls submitted while handling an API request run in the request's context, so their stages count towards
+    its Server-Timing header. Other calls, e.g. of background samplers, run without a context of their own.
+    """
+    def __init__(self, name: str = 'bl-io'):
+        self.queue = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.stopped = False
+        self.executed = {priority: 0 for priority in Priority}
+        self.expired = {priority: 0 for priority in Priority}
+        self.waits = {priority: deque(maxlen=100) for priority in Priority}
+        self.queued = {priority: 0 for priority in Priority}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, fn: Callable, *args, priority: Priority = Priority.read, deadline: Union[float, None] = None,
+               **kwargs) -> Future:
+        if self.stopped:
+            raise RuntimeError('Scheduler is shut down')
+        job = Job(fn, args, kwargs, priority, deadline)
+        with self.lock:
+            self.queued[priority] += 1
+        self.queue.put((priority, next(self.counter), job))
+        return job.future
+
+    def run(self) -> None:
+        while True:
+            _, _, job = self.queue.get()
+            if job is None:
+                return
+            with self.lock:
+                self.queued[job.priority] -= 1
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            started = time.monotonic()
+            if job.deadline is not None and started > job.deadline:
+                self.expired[job.priority] += 1
+                job.future.set_exception(deadline_exceeded())
+                continue
+            self.waits[job.priority].append(started - job.enqueued)
+            self.executed[job.priority] += 1
+            try:
+                if job.context is None:
+                    job.future.set_result(job.fn(*job.args, **job.kwargs))
+                else:
+                    job.context.run(add_request_stage, 'queue', started - job.enqueued)
+                    job.future.set_result(job.context.run(job.fn, *job.args, **job.kwargs))
+            except BaseException as error:
+                job.future.set_exception(error)
+
+    def shutdown(self) -> None:
+        """
+        Cancels the queued calls and ends the I/O thread after the running call
+        """
+        self.stopped = True
+        while True:
+            try:
+                _, _, job = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            job.future.cancel()
+        self.queue.put((-1, next(self.counter), None))
+
+    def get_depth(self) -> int:
+        return self.queue.qsize()
+
+    def get_info(self) -> dict:
+        info = {'queue_depth': self.get_depth()}
+        for priority in Priority:
+            waits = list(self.waits[priority])
+            info[priority.name] = {'queued': self.queued[priority],
+                                   'executed': self.executed[priority],
+                                   'expired': self.expired[priority],
+                                   'wait_avg': round(sum(waits) / len(waits), 6) if waits else 0.0,
+                                   'wait_max': round(max(waits), 6) if waits else 0.0,
+                                   }
+        return info
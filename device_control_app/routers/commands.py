@@ -1,9 +1,11 @@
-from multiprocessing.dummy import Process
-from fastapi import APIRouter, Query, Path, Depends
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Query, Path, Body, Depends, Request, WebSocket, WebSocketDisconnect, HTTPException, status
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import Field, Required
-from typing import Union, List
+from typing import Union, List, Tuple
 from enum import Enum
+import asyncio
+import os
 import time
 from datetime import datetime
 import json
@@ -14,20 +16,35 @@ from .commands_dependencies import verify_key_allowed, verify_keys_allowed
 from .commands_models import (UM34CResponseRaw,
                               UM34CResponse,
                               CommandResponse,
-                              RESPONSE_FORMAT,
-                              KNOWN_DEVICES,
-                              CHARGING_MODES,
                               UM34CCommands,
-                              UM34CResponseDataRaw,
                               UM34Examples,
                               BLErrorMessage400, BLErrorMessage404, BLErrorMessage409,
-                              DBResponse
+                              DBResponse,
+                              SamplerInfo,
+                              UploaderInfo,
+                              RecorderInfo,
+                              ReplayInfo,
+                              MacroStep,
+                              MacroResponse,
+                              SpacingCalibration,
+                              COMMAND_ARGUMENT_LIMITS,
+                              COMMAND_SPACING,
+                              ENDPOINT_SPACING,
                               )
-from .bl_connection import get_bluetooth_device
+from .commands_decoder import UM34CFrame, frame_to_raw, frame_to_decoded, frame_values_raw, frame_values_decoded
+from .commands_uploader import Uploader, frame_to_db_row, request_session
+from .commands_recorder import get_recorder, start_recording, stop_recording, get_replay, start_replay, stop_replay
+from .commands_sampler import get_frame, get_sampler, start_sampler, stop_sampler, ensure_sampler
+from .commands_spacing import calibrate_spacing, load_spacing, save_spacing
+from .bl_connection import get_bluetooth_device, connection_pool
+from .metrics import time_stage, TimedRoute
+from .bl_scheduler import Priority, deadline_exceeded
+from config import BluetoothSettings, SamplerSettings, UploadSettings, CommandSettings, RecorderSettings
 
 router = APIRouter(
     prefix='/command',
     tags=['command'],
+    route_class=TimedRoute,
     dependencies=[],
     responses={400: {'model': BLErrorMessage400},
                404: {'model': BLErrorMessage404},
@@ -35,42 +52,23 @@ router = APIRouter(
 )
 
 
-def hex2int(val: str, divisor: int = 1) -> Union[int, float]:
-    num = int(val, 16) / divisor
-    if str(num).endswith('.0'):
-        return int(num)
-    return num
+def data_preperation_raw(frame: UM34CFrame) -> dict:
+    with time_stage('data_preperation_raw', histogram=False):
+        return frame_to_raw(frame)
 
 
-def data_preperation_raw(datastring: str = Field(default=Required, min_length=130, max_length=130)) -> dict:
-    response_data = dict()
-    offset = 0
-    for meta in RESPONSE_FORMAT:
-        response_data[offset // 2] = meta
-        data = datastring[offset:offset + meta['length'] * 2]
-        response_data[offset // 2].update({'value': data})
-        offset += meta['length'] * 2
-    return response_data
+def data_preperation_decoded(frame: UM34CFrame) -> dict:
+    with time_stage('data_preperation_decoded', histogram=False):
+        return frame_to_decoded(frame)
 
 
-def data_preperation_decoded(data: dict) -> dict:
-    data[0]['value'] = KNOWN_DEVICES[data[0]['value']]
-    data[16]['value'] = list(map(''.join, zip(*[iter(data[16]['value'])] * 8)))
-    data[16]['value'] = [{'mah': hex2int(x), 'mwh': hex2int(y)} for x, y in zip(data[16]['value'][0::2], data[16]['value'][1::2])]
-
-    for k, divisor in zip([i for i in data.keys() if i not in [0, 16, 128, 129]], [100, 1000, 1000, 1, 1, 1, 100, 100, 1, 1, 1, 100, 1, 1, 1, 1, 10, 1]):
-        data[k]['value'] = hex2int(data[k]['value'], divisor)
-    data[100].update(CHARGING_MODES[data[100]['value']])
-
-    units = {0: 'None', 2: 'V', 4: 'A', 6: 'W', 10: 'C', 12: 'F', 14: '1', 16: 'mAh/mWh', 96: 'V', 98: 'V', 100: 'None', 102: 'mAh', 106: 'mWh', 110: 'A', 112: 's', 116: 'None', 118: 'min', 120: '1', 122: 'Ω', 126: '1'}
-    for offset, unit in units.items():
-        data[offset].update({'value_unit': unit})
-    return data
+def get_command_code(code: bytes) -> str:
+    return '0' + str(code)[3:-1]
 
 
 def get_command_response(bl_device, command: Enum, code: Union[bytes, None] = None) -> dict:
     code = command.value if code is None else code
-    return {**{'timestamp': datetime.now()}, **bl_device.get_info(), **{'command': command.name, 'command_code': '0' + str(code)[3:-1]}}
+    return {**{'timestamp': datetime.now()}, **bl_device.get_info(), **{'command': command.name, 'command_code': get_command_code(code)}}
 
 
 def add2hex(hex_val: bytes, add: int) -> bytes:
@@ -78,6 +76,71 @@ def add2hex(hex_val: bytes, add: int) -> bytes:
     return bytes.fromhex(hex(val)[2:])
 
 
+# Spacing from the last /command/calibrate_spacing, loaded from CommandSettings().spacing_file on first use
+calibrated_spacing: Union[dict, None] = None
+
+
+def get_command_spacing() -> dict:
+    global calibrated_spacing
+    settings = CommandSettings()
+    if calibrated_spacing is None:
+        calibrated_spacing = load_spacing(settings.spacing_file)
+    return {**COMMAND_SPACING, **calibrated_spacing, **settings.spacing}
+
+
+def execute_macro(device, steps: List[Tuple[UM34CCommands, Union[int, None]]], spacing: dict,
+                  deadline: Union[float, None] = None, screen: Union[int, None] = None) -> List[dict]:
+    """
+    Sends the commands one after another, as one call on the device's I/O thread
+
+    No other call to the device comes in between, also not the steps of another macro.
+    Before each command it only waits as long as spacing gives for the previous command,
+    the time already spent on the previous command counts towards that wait.
+    With screen set, the current screen is read first and the steps to that screen go ahead of steps.
+    Commands not yet sent at deadline (time.monotonic()) fail with 408.
+    """
+    results = []
+    start = ready_at = time.monotonic()
+    if screen is not None:
+        steps = get_screen_steps(device.request_frame(UM34CCommands.request_data.value).cur_screen, screen) + steps
+    for command, argument in steps:
+        waited = max(0.0, ready_at - time.monotonic())
+        if deadline is not None and time.monotonic() + waited > deadline:
+            raise deadline_exceeded()
+        if waited:
+            time.sleep(waited)
+        step_start = time.monotonic()
+        code = command.value if argument is None else add2hex(command.value, argument)
+        data = None
+        if command is UM34CCommands.request_data:
+            data = frame_values_decoded(device.request_frame(code))
+        else:
+            device.send(code)
+        step_end = time.monotonic()
+        ready_at = step_end + spacing.get(command.name, 0.0)
+        results.append({'command': command.name, 'command_code': get_command_code(code), 'argument': argument,
+                        'started': step_start - start, 'waited': waited, 'duration': step_end - step_start, 'data': data})
+    return results
+
+
+async def run_macro(bl_device, steps: List[Tuple[UM34CCommands, Union[int, None]]], spacing: Union[dict, None] = None,
+                    deadline: Union[float, None] = None, screen: Union[int, None] = None) -> List[dict]:
+    """
+    Runs execute_macro on the device's I/O thread, ahead of reads as a control command
+
+    Without spacing it waits as configured for /command/macro (see get_command_spacing).
+    """
+    spacing = get_command_spacing() if spacing is None else spacing
+    return await bl_device.run(execute_macro, bl_device.device, steps, spacing, deadline, screen,
+                               priority=Priority.control, deadline=deadline)
+
+
+def get_screen_steps(cur_screen: int, no: int) -> List[Tuple[UM34CCommands, None]]:
+    diff = no - cur_screen
+    command = UM34CCommands.next_screen if diff > 0 else UM34CCommands.previous_screen
+    return [(command, None)] * abs(diff)
+
+
 def get_model_keys(model) -> list:
     return list(model.schema()['properties'])
 
@@ -91,27 +154,32 @@ def filter_response_data(*, data: dict, q=List[str]) -> dict:
     return response_q
 
 
-def get_response_data(bl_device,
-                      q: Union[List[str], None] = None, raw: bool = False, values_only: bool = False,) -> dict:
-    data = bl_device.send_and_receive(command=UM34CCommands.request_data.value)
-    response = data_preperation_raw(datastring=data)
+async def get_response_data(bl_device,
+                            q: Union[List[str], None] = None, raw: bool = False, values_only: bool = False,
+                            max_age: Union[float, None] = None) -> dict:
+    sample = await get_frame(bl_device, max_age=max_age)
+    return build_response_data(bl_device, sample.frame, q=q, raw=raw, values_only=values_only, timestamp=sample.timestamp)
 
-    if raw:
-        response[16]['value'] = list(map(''.join, zip(*[iter(response[16]['value'])] * 8)))
-        response[16]['value'] = [{'mah': x, 'mwh': y} for x, y in zip(response[16]['value'][0::2], response[16]['value'][1::2])]
-    else:
-        response = data_preperation_decoded(data=response)
 
-    response_new = {}
-    for key, (k, v) in zip(get_model_keys(UM34CResponseDataRaw), response.items()):
-        if not values_only:
-            response_new[key] = {'byte_offset': k, **v, 'byte_length': v['length'], 'value_type': type(v['value']).__name__}
-        else:
-            response_new[key] = {'value': v['value']}
+def build_response_data(bl_device, frame: UM34CFrame,
+                        q: Union[List[str], None] = None, raw: bool = False, values_only: bool = False,
+                        timestamp: Union[datetime, None] = None) -> dict:
+    if values_only:
+        values = frame_values_raw(frame) if raw else frame_values_decoded(frame)
+        response = {key: {'value': value} for key, value in values.items()}
+    else:
+        response = data_preperation_raw(frame) if raw else data_preperation_decoded(frame)
     if q is not None:
-        response_new = filter_response_data(data=response_new, q=q)
+        response = filter_response_data(data=response, q=q)
 
-    return {**get_command_response(bl_device, UM34CCommands.request_data), 'data': [response_new]}
+    command_response = get_command_response(bl_device, UM34CCommands.request_data)
+    if timestamp is not None:
+        command_response['timestamp'] = timestamp
+    return {**command_response, 'data': [response]}
+
+
+def encode_response_data(data: dict) -> str:
+    return json.dumps(data, default=datetime.isoformat)
 
 
 @router.get('/', include_in_schema=False)
@@ -124,11 +192,13 @@ async def command_index():
             response_description='Successfully sent command to device')
 async def request_data_raw(bl_device = Depends(get_bluetooth_device),
                            keys: Union[List[str], None] = Depends(verify_keys_allowed),
-                           values_only: bool = Query(default=False, description='If data should only contain values')):
+                           values_only: bool = Query(default=False, description='If data should only contain values'),
+                           max_age: Union[float, None] = Query(default=None, ge=0, description='Use the sampled data if it is not older than max_age seconds')):
     """
     Request a new 130 byte response of data from the device (NOT decoded)
     - **key** : filter data by given keys
     - **values_only** : If data should only contain values
+    - **max_age** : Use the sampled data if it is not older than max_age seconds (needs a running sampler)
 
     Data contains:
     - Model ID
@@ -152,7 +222,7 @@ async def request_data_raw(bl_device = Depends(get_bluetooth_device),
     - Resistance
     - Current screen
     """
-    return get_response_data(bl_device=bl_device, q=keys, raw=True, values_only=values_only)
+    return await get_response_data(bl_device=bl_device, q=keys, raw=True, values_only=values_only, max_age=max_age)
 
 
 @router.get('/request_data_raw/{key}', response_model=UM34CResponseRaw, response_model_exclude_unset=True,
@@ -161,11 +231,13 @@ async def request_data_raw(bl_device = Depends(get_bluetooth_device),
             )
 async def request_data_raw(bl_device = Depends(get_bluetooth_device),
                            key: str = Depends(verify_key_allowed),
-                           values_only: bool = Query(default=False, description='If data should only contain values')):
+                           values_only: bool = Query(default=False, description='If data should only contain values'),
+                           max_age: Union[float, None] = Query(default=None, ge=0, description='Use the sampled data if it is not older than max_age seconds')):
     """
     Request a new 130 byte response of data from the device filtered by given key (NOT decoded)
     - **key** : filter data by given keys
     - **values_only** : If data should only contain values
+    - **max_age** : Use the sampled data if it is not older than max_age seconds (needs a running sampler)
 
     Data contains:
     - Model ID
@@ -189,7 +261,7 @@ async def request_data_raw(bl_device = Depends(get_bluetooth_device),
     - Resistance
     - Current screen
     """
-    return get_response_data(bl_device=bl_device, q=[key], raw=True, values_only=values_only)
+    return await get_response_data(bl_device=bl_device, q=[key], raw=True, values_only=values_only, max_age=max_age)
 
 
 @router.get('/request_data', response_model=UM34CResponse, response_model_exclude_unset=True,
@@ -198,11 +270,13 @@ async def request_data_raw(bl_device = Depends(get_bluetooth_device),
             )
 async def request_data(bl_device = Depends(get_bluetooth_device),
                        keys: Union[List[str], None] = Query(default=None, description='Filter data by key', examples=UM34Examples.request_data_q),
-                       values_only: bool = Query(default=False, description='If data should only contain values'),):
+                       values_only: bool = Query(default=False, description='If data should only contain values'),
+                       max_age: Union[float, None] = Query(default=None, ge=0, description='Use the sampled data if it is not older than max_age seconds')):
     """
     Request a new 130 byte response of data from the device (decoded)
     - **key** : filter data by given keys
     - **values_only** : If data should only contain values
+    - **max_age** : Use the sampled data if it is not older than max_age seconds (needs a running sampler)
 
     Data contains:
     - Model ID
@@ -226,7 +300,7 @@ async def request_data(bl_device = Depends(get_bluetooth_device),
     - Resistance
     - Current screen
     """
-    return get_response_data(bl_device=bl_device, q=keys, values_only=values_only)
+    return await get_response_data(bl_device=bl_device, q=keys, values_only=values_only, max_age=max_age)
 
 
 @router.get('/request_data/{key}', response_model=UM34CResponse, response_model_exclude_unset=True,
@@ -235,11 +309,13 @@ async def request_data(bl_device = Depends(get_bluetooth_device),
             )
 async def request_data_by_key(bl_device = Depends(get_bluetooth_device),
                               key: str = Depends(verify_key_allowed),
-                              values_only: bool = Query(default=False, description='If data should only contain values')):
+                              values_only: bool = Query(default=False, description='If data should only contain values'),
+                              max_age: Union[float, None] = Query(default=None, ge=0, description='Use the sampled data if it is not older than max_age seconds')):
     """
     Request a new 130 byte response of data from the device filtered by given key (decoded)
     - **key** : filter data by given keys
     - **values_only** : If data should only contain values
+    - **max_age** : Use the sampled data if it is not older than max_age seconds (needs a running sampler)
 
     Data contains:
     - Model ID
@@ -263,7 +339,7 @@ async def request_data_by_key(bl_device = Depends(get_bluetooth_device),
     - Resistance
     - Current screen
     """
-    return get_response_data(bl_device=bl_device, q=[key], values_only=values_only)
+    return await get_response_data(bl_device=bl_device, q=[key], values_only=values_only, max_age=max_age)
 
 
 @router.get('/next_screen', response_model=CommandResponse,
@@ -274,7 +350,7 @@ async def next_screen(bl_device = Depends(get_bluetooth_device)):
     """
     Go to next screen
     """
-    bl_device.send(command=UM34CCommands.next_screen.value)
+    await bl_device.send(command=UM34CCommands.next_screen.value)
     return get_command_response(bl_device=bl_device, command=UM34CCommands.next_screen)
 
 
@@ -284,10 +360,7 @@ async def rotate_screen(bl_device = Depends(get_bluetooth_device), no_of_time: i
     Rotates the screen
     - **no_if_time** : How often it should rotate
     """
-    for i in range(no_of_time):
-        bl_device.send(command=UM34CCommands.rotate_screen.value)
-        if no_of_time > 1:
-            time.sleep(0.9)
+    await run_macro(bl_device, [(UM34CCommands.rotate_screen, None)] * no_of_time, ENDPOINT_SPACING['rotate_screen'])
     return get_command_response(bl_device=bl_device, command=UM34CCommands.rotate_screen)
 
 
@@ -296,7 +369,7 @@ async def previous_screen(bl_device = Depends(get_bluetooth_device)):
     """
     Go to previous screen
     """
-    bl_device.send(command=UM34CCommands.previous_screen.value)
+    await bl_device.send(command=UM34CCommands.previous_screen.value)
     return get_command_response(bl_device=bl_device, command=UM34CCommands.previous_screen)
 
 
@@ -312,11 +385,11 @@ async def clear_data_group(bl_device = Depends(get_bluetooth_device), group_no:
     - group_no = 9 🠖 select group number 9 then delete its data
     """
     code = UM34CCommands.clear_data_group.value
+    steps = [(UM34CCommands.clear_data_group, None)]
     if group_no is not None:
         code = add2hex(UM34CCommands.select_group.value, group_no)
-        bl_device.send(command=code)
-        time.sleep(0.03)
-    bl_device.send(command=UM34CCommands.clear_data_group.value)
+        steps.insert(0, (UM34CCommands.select_group, group_no))
+    await run_macro(bl_device, steps, ENDPOINT_SPACING['clear_data_group'])
     return get_command_response(bl_device=bl_device, command=UM34CCommands.clear_data_group, code=code)
 
 
@@ -331,7 +404,7 @@ async def select_data_group(bl_device = Depends(get_bluetooth_device), group_no:
     - 7 = set selected group to 7
     """
     code = add2hex(UM34CCommands.select_group.value, group_no)
-    bl_device.send(command=code)
+    await bl_device.send(command=code)
     return get_command_response(bl_device=bl_device, command=UM34CCommands.select_group, code=code)
 
 
@@ -347,7 +420,7 @@ async def set_recording_threshold(bl_device = Depends(get_bluetooth_device), cen
     - 30 = 0.30 A
     """
     code = add2hex(UM34CCommands.recording_threshold.value, centi_amps)
-    bl_device.send(command=code)
+    await bl_device.send(command=code)
     return get_command_response(bl_device=bl_device, command=UM34CCommands.recording_threshold, code=code)
 
 
@@ -361,7 +434,7 @@ async def set_backlight_level(bl_device = Depends(get_bluetooth_device), level:
     - 5 = full brightness
     """
     code = add2hex(UM34CCommands.backlight_level.value, level)
-    bl_device.send(command=code)
+    await bl_device.send(command=code)
     return get_command_response(bl_device=bl_device, command=UM34CCommands.backlight_level, code=code)
 
 
@@ -376,7 +449,7 @@ async def set_screen_timeout(bl_device = Depends(get_bluetooth_device), minutes:
     - 9 = screensaver after 9 minutes
     """
     code = add2hex(UM34CCommands.screen_timeout.value, minutes)
-    bl_device.send(command=code)
+    await bl_device.send(command=code)
     return get_command_response(bl_device=bl_device, command=UM34CCommands.screen_timeout, code=code)
 
 
@@ -392,16 +465,9 @@ async def set_screen(bl_device = Depends(get_bluetooth_device), no: int = Path(d
 
     Uses the next/previous screen command multiple times to go to the selected screen
     """
-    data = bl_device.send_and_receive(command=UM34CCommands.request_data.value)
-    response = data_preperation_raw(datastring=data)
-    cur_screen = int(response[126]['value'])
-    diff = no - cur_screen
-    if diff != 0:
-        command = UM34CCommands.next_screen if diff > 0 else UM34CCommands.previous_screen
-        for i in range(abs(diff)-1):
-            bl_device.send(command=command.value)
-        bl_device.send(command=command.value)
-        return get_command_response(bl_device=bl_device, command=command)
+    results = await run_macro(bl_device, [], ENDPOINT_SPACING['set_screen'], screen=no)
+    if results:
+        return get_command_response(bl_device=bl_device, command=UM34CCommands[results[0]['command']])
     else:
         return {**{'timestamp': datetime.now()}, **bl_device.get_info(), **{'command': None, 'command_code': None}}
 
@@ -415,71 +481,71 @@ async def reset_device(bl_device = Depends(get_bluetooth_device)):
     - set backlight to level 5
     - set screen timeout to 1 minute
     """
-    data = bl_device.send_and_receive(command=UM34CCommands.request_data.value)
-    response = data_preperation_raw(datastring=data)
-    cur_screen = int(response[126]['value'])
-    diff = 0 - cur_screen
-    if diff != 0:
-        command = UM34CCommands.next_screen if diff > 0 else UM34CCommands.previous_screen
-        for i in range(abs(diff)-1):
-            bl_device.send(command=command.value)
-            time.sleep(0.3)
-        bl_device.send(command=command.value)
-
+    steps = []
     for group_no in range(10):
-        code = add2hex(UM34CCommands.select_group.value, group_no)
-        bl_device.send(command=code)
-        time.sleep(0.05)
-        bl_device.send(command=UM34CCommands.clear_data_group.value)
-        time.sleep(0.3)
-    bl_device.send(command=UM34CCommands.select_group.value)
+        steps += [(UM34CCommands.select_group, group_no), (UM34CCommands.clear_data_group, None)]
+    steps += [(UM34CCommands.select_group, None),
+              (UM34CCommands.backlight_level, 5),
+              (UM34CCommands.screen_timeout, 1)]
+    await run_macro(bl_device, steps, ENDPOINT_SPACING['reset_device'], screen=0)
 
-    code = add2hex(UM34CCommands.backlight_level.value, 5)
-    bl_device.send(command=code)
+    return {**{'timestamp': datetime.now()}, **bl_device.get_info(), **{'command': None, 'command_code': None}}
 
-    code = add2hex(UM34CCommands.screen_timeout.value, 1)
-    bl_device.send(command=code)
 
-    return {**{'timestamp': datetime.now()}, **bl_device.get_info(), **{'command': None, 'command_code': None}}
+@router.post('/macro', response_model=MacroResponse, summary='Run a sequence of commands', response_description='Successfully sent all commands to device')
+async def macro(bl_device = Depends(get_bluetooth_device),
+                steps: List[MacroStep] = Body(default=..., min_items=1, max_items=200, examples=UM34Examples.macro),
+                deadline: Union[float, None] = Query(default=None, gt=0, le=600, description='Seconds the macro may take')):
+    """
+    Sends a list of commands to the device over one connection
+    - **command** : name of the command
+    - **argument** : value for select_group (0-9), recording_threshold (0-30), backlight_level (0-5) and screen_timeout (0-9)
+    - **deadline** : seconds after which commands not yet sent fail with 408
 
-request_session = requests.Session()
-request_session.trust_env = False
-url = 'http://127.0.0.1:8081/data'
+    Between two commands it only waits as long as the device needs for the previous command.
+    The response contains the timing of every step and the values of every request_data step.
+    """
+    macro_steps = []
+    for i, step in enumerate(steps):
+        limit = COMMAND_ARGUMENT_LIMITS.get(step.command.value)
+        if step.argument is not None and (limit is None or step.argument > limit):
+            message = f"Step {i}: argument {step.argument} not allowed for {step.command.value}"
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=message, headers={'X-Error': message})
+        macro_steps.append((UM34CCommands[step.command.value], step.argument))
 
+    start = time.monotonic()
+    results = await run_macro(bl_device, macro_steps, deadline=start + deadline if deadline else None)
+    return {**{'timestamp': datetime.now()}, **bl_device.get_info(), 'total_time': time.monotonic() - start, 'steps': results}
 
-class SendingProcess(Process):
-    def __init__(self):
-        Process.__init__(self)
-        self.run_loop = True
-        self.in_loop = False
 
-    def run(self):
-        self.in_loop = True
-        while self.run_loop:
-            gen = get_bluetooth_device()
-            try:
-                for bl_device in gen:
-                    data = get_response_for_db(bl_device)
-                    resp = request_session.post(url=url, json=data)
-                time.sleep(0.01)
-            except:
-                pass
-            finally:
-                pass
-        self.in_loop = False
+@router.get('/calibrate_spacing', response_model=SpacingCalibration, summary='Measures how long the device needs per command', response_description='Successfully measured the device')
+async def calibrate_command_spacing(bl_device = Depends(get_bluetooth_device),
+                                    rounds: int = Query(default=3, ge=1, le=20, description='Measurements per command'),
+                                    margin: float = Query(default=1.25, ge=1, le=5, description='Factor on the longest measurement'),
+                                    save: bool = Query(default=True, description='If /command/macro should use the spacing from now on')):
+    """
+    Sends every command whose effect shows in the frames and requests frames until it does
+    - **rounds** : Measurements per command, every command is undone after each
+    - **margin** : The spacing is the longest measurement times margin
+    - **save** : If /command/macro should use the spacing from now on, it is also saved for restarts
 
-    def terminate(self):
-        self.run_loop = False
-        while self.in_loop: pass
+    rotate_screen and clear_data_group keep their configured spacing. The device ends up with its settings as before.
+    """
+    global calibrated_spacing
+    spacing, measured = await bl_device.run(calibrate_spacing, bl_device.device, rounds, margin, priority=Priority.control)
+    path = None
+    if save:
+        path = CommandSettings().spacing_file
+        await run_in_threadpool(save_spacing, path, spacing)
+        calibrated_spacing = spacing
+    return {**{'timestamp': datetime.now()}, **bl_device.get_info(), 'spacing': spacing, 'measured': measured, 'path': path}
 
 
-sending_process = SendingProcess()
-sending_process.setDaemon(True)
+uploader: Union[Uploader, None] = None
 
 
-def get_response_for_db(bl_device):
-    response = get_response_data(bl_device=bl_device)
-    return {'created_at': str(datetime.now()), 'bd_address': bl_device.get_info()['bd_address'], **{k: v['value'] for k, v in response['data'][0].items()}}
+def get_response_for_db(bl_device, frame: UM34CFrame):
+    return frame_to_db_row(bl_device.get_bd_address(), frame)
 
 
 @router.get('/send_response_to_db', response_model=DBResponse, summary='Sends device response to db', response_description='Successfully sent data from device to db')
@@ -488,9 +554,16 @@ async def send_response_to_db(bl_device = Depends(get_bluetooth_device)):
     Gets data from the bluetooth device and sends it to the database to store the data
     - Response: id number of created data line in database
     """
-    data = get_response_for_db(bl_device)
-    resp = request_session.post(url=url, json=data)
-    
+    frame = await bl_device.request_frame(command=UM34CCommands.request_data.value)
+    data = get_response_for_db(bl_device, frame)
+    try:
+        resp = await run_in_threadpool(request_session.post, url=UploadSettings().db_url, json=data, timeout=UploadSettings().timeout)
+    except requests.RequestException as error:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=f"Database not reachable: {error}",
+                            headers={'X-Error': 'Database not reachable'}
+                            )
+
     try:
         content = json.loads(resp.content)
         content.update({'message': 'OK'})
@@ -499,24 +572,240 @@ async def send_response_to_db(bl_device = Depends(get_bluetooth_device)):
     return content
 
 
-@router.get('/send_response_to_db_loop', response_model=None, summary='Sends device response to db in loop', response_description='Successfully started process')
-async def send_response_to_db_loop():
+def stop_uploader() -> None:
+    global uploader
+    if uploader is not None:
+        uploader.stop()
+        uploader = None
+
+
+@router.get('/send_response_to_db_loop', response_model=UploaderInfo, summary='Sends device response to db in loop', response_description='Successfully started process')
+async def send_response_to_db_loop(sample_rate: Union[float, None] = Query(default=None, gt=0, le=20, description='Samples per second (default from configuration)'),
+                                   batch_size: Union[int, None] = Query(default=None, ge=1, description='Maximum samples per upload (default from configuration)')):
     """
     Starts process of a loop to get data from the bluetooth device and send it to the database to store the data
+    - **sample_rate** : Samples per second
+    - **batch_size** : Maximum samples per upload
+
+    Samples are queued, written to the spool on disk and uploaded from there in batches.
+    While the database is not reachable samples stay in the spool, they are uploaded once it is back.
     """
-    global sending_process
-    sending_process.terminate()
-    sending_process = SendingProcess()
-    sending_process.setDaemon(True)
-    sending_process.start()
-    return {'message': 'Started sending to db process loop'}
+    global uploader
+    await run_in_threadpool(stop_uploader)
+    settings = UploadSettings().dict()
+    settings.update({key: value for key, value in {'sample_rate': sample_rate, 'batch_size': batch_size}.items() if value is not None})
+    uploader = Uploader(bl_settings=BluetoothSettings().dict(), name='sending_loop', **settings)
+    uploader.start()
+    return uploader.get_info()
 
 
-@router.get('/stop_sending_loop', response_model=None, summary='Sends device response to db', response_description='Successfully stopped process')
+@router.get('/stop_sending_loop', response_model=UploaderInfo, summary='Stops sending device response to db', response_description='Successfully stopped process')
 async def stop_sending_loop():
     """
     Stops process with the loop which gets data from the bluetooth device and sends it to the database to store the data
+
+    Samples still in the queue are uploaded before it stops
+    """
+    stopped = uploader
+    await run_in_threadpool(stop_uploader)
+    return stopped.get_info() if stopped is not None else {'running': False}
+
+
+@router.get('/sending_loop', response_model=UploaderInfo, summary='Shows state of the loop sending to db', response_description='State of the sending loop')
+async def sending_loop_info():
+    """
+    Shows the counters of the loop which gets data from the bluetooth device and sends it to the database
+    - **dropped** : samples dropped because the queue was full
+    - **failed** : samples the database did not accept
+    - **spool_pending** : samples in the spool waiting for the database
+    - **spool_lag** : age in seconds of the oldest sample waiting for the database
+    """
+    return uploader.get_info() if uploader is not None else {'running': False}
+
+
+@router.get('/start_sampler', response_model=SamplerInfo, summary='Starts sampling the device in background', response_description='Successfully started sampler')
+async def start_device_sampler(bl_device = Depends(get_bluetooth_device),
+                               sample_rate: Union[float, None] = Query(default=None, gt=0, le=20, description='Samples per second (default from configuration)'),
+                               buffer_size: Union[int, None] = Query(default=None, ge=1, description='Number of samples kept in memory (default from configuration)')):
+    """
+    Starts polling the device in background and keeps the newest samples in memory
+    - **sample_rate** : Samples per second
+    - **buffer_size** : Number of samples kept in memory
+
+    Data endpoints called with **max_age** answer from the newest sample instead of asking the device
+    """
+    settings = SamplerSettings()
+    sampler = await start_sampler(bl_device,
+                                  sample_rate=sample_rate or settings.sample_rate,
+                                  buffer_size=buffer_size or settings.buffer_size)
+    return sampler.get_info()
+
+
+@router.get('/stop_sampler', response_model=None, summary='Stops sampling the device in background', response_description='Successfully stopped sampler')
+async def stop_device_sampler():
+    """
+    Stops the background sampler of the configured device
+    """
+    bl_device = connection_pool.lookup(**BluetoothSettings().dict())
+    if bl_device is None or not await stop_sampler(bl_device.get_bd_address()):
+        return {'message': 'No sampler running'}
+    return {'message': 'Stopped sampler'}
+
+
+@router.get('/sampler', response_model=SamplerInfo, summary='Shows state of the background sampler', response_description='State of the sampler')
+async def device_sampler_info():
+    """
+    Shows the state of the background sampler of the configured device
     """
-    sending_process.terminate()
-    
-    return {'message': 'Stopped sending to db process loop'}
+    bl_device = connection_pool.lookup(**BluetoothSettings().dict())
+    sampler = get_sampler(bl_device.get_bd_address()) if bl_device is not None else None
+    if sampler is None:
+        return {**BluetoothSettings().dict(include={'name', 'bd_address'}), 'running': False}
+    return sampler.get_info()
+
+
+@router.websocket('/stream')
+async def stream_data(websocket: WebSocket,
+                      bl_device = Depends(get_bluetooth_device),
+                      keys: Union[List[str], None] = Depends(verify_keys_allowed),
+                      raw: bool = Query(default=False, description='If data should not be decoded'),
+                      values_only: bool = Query(default=False, description='If data should only contain values'),
+                      max_rate: Union[float, None] = Query(default=None, gt=0, description='Maximum messages per second')):
+    """
+    Sends every new sample of the background sampler as JSON message, starts the sampler if needed
+    - **keys** : filter data by given keys
+    - **raw** : If data should not be decoded
+    - **values_only** : If data should only contain values
+    - **max_rate** : Maximum messages per second
+
+    All subscribers share the one sampler polling the device
+    """
+    await websocket.accept()
+    sampler = await ensure_sampler(bl_device)
+
+    async def send_samples():
+        async for sample in sampler.stream(max_rate=max_rate):
+            data = build_response_data(bl_device, sample.frame, q=keys, raw=raw, values_only=values_only, timestamp=sample.timestamp)
+            await websocket.send_text(encode_response_data(data))
+        await websocket.close()
+
+    sender = asyncio.get_running_loop().create_task(send_samples())
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+
+
+def get_recording_path(file_name: Union[str, None]) -> str:
+    settings = RecorderSettings()
+    os.makedirs(settings.directory, exist_ok=True)
+    return os.path.join(settings.directory, file_name or settings.file_name)
+
+
+@router.get('/start_recording', response_model=RecorderInfo, summary='Records all received frames to a file', response_description='Successfully started recording')
+async def start_frame_recording(file_name: Union[str, None] = Query(default=None, regex=r'^[\w-][\w.-]*$', description='Log file in the recordings directory (default from configuration)')):
+    """
+    Appends every frame received from any device, with capture time and bd address, to a binary log
+    - **file_name** : Log file in the recordings directory, an existing log gets extended
+
+    Logs can be fed back with '/start_replay'
+    """
+    try:
+        recorder = await run_in_threadpool(start_recording, get_recording_path(file_name))
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=str(error),
+                            headers={'X-Error': str(error)}
+                            )
+    return recorder.get_info()
+
+
+@router.get('/stop_recording', response_model=RecorderInfo, summary='Stops recording frames', response_description='Successfully stopped recording')
+async def stop_frame_recording():
+    """
+    Stops recording and closes the log file
+    """
+    recorder = await run_in_threadpool(stop_recording)
+    return recorder.get_info() if recorder is not None else {'recording': False}
+
+
+@router.get('/recording', response_model=RecorderInfo, summary='Shows state of the frame recording', response_description='State of the recording')
+async def frame_recording_info():
+    """
+    Shows the state of the frame recording
+    """
+    recorder = get_recorder()
+    return recorder.get_info() if recorder is not None else {'recording': False}
+
+
+@router.get('/start_replay', response_model=ReplayInfo, summary='Replays recorded frames', response_description='Successfully started replay')
+async def start_frame_replay(file_name: Union[str, None] = Query(default=None, regex=r'^[\w-][\w.-]*$', description='Log file in the recordings directory (default from configuration)'),
+                             speed: float = Query(default=1.0, ge=0, le=1000, description='1 for recorded speed, N for N times faster, 0 for as fast as possible'),
+                             upload: bool = Query(default=False, description='If replayed frames should be sent to db')):
+    """
+    Feeds a frame log through the decoder and, if wanted, the upload to db, no device needed
+    - **file_name** : Log file in the recordings directory
+    - **speed** : 1 for recorded speed, N for N times faster, 0 for as fast as possible
+    - **upload** : If replayed frames should be sent to db, with their recorded timestamps
+    """
+    path = get_recording_path(file_name)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"No recording named {os.path.basename(path)}",
+                            headers={'X-Error': f"No recording named {os.path.basename(path)}"}
+                            )
+    uploader = None
+    if upload:
+        uploader = Uploader(bl_settings=None, name='replay', **UploadSettings().dict())
+        uploader.start()
+    replay = await run_in_threadpool(start_replay, path, speed=speed, uploader=uploader)
+    return replay.get_info()
+
+
+@router.get('/stop_replay', response_model=ReplayInfo, summary='Stops replaying frames', response_description='Successfully stopped replay')
+async def stop_frame_replay():
+    """
+    Stops the replay, frames already queued for upload are still sent
+    """
+    replay = await run_in_threadpool(stop_replay)
+    return replay.get_info() if replay is not None else {'running': False}
+
+
+@router.get('/replay', response_model=ReplayInfo, summary='Shows state of the frame replay', response_description='State of the replay')
+async def frame_replay_info():
+    """
+    Shows the state of the last replay
+    """
+    replay = get_replay()
+    return replay.get_info() if replay is not None else {'running': False}
+
+
+@router.get('/stream_sse', response_class=StreamingResponse, summary='Stream of device data as server-sent events', response_description='Stream of events with the device data')
+async def stream_data_sse(request: Request,
+                          bl_device = Depends(get_bluetooth_device),
+                          keys: Union[List[str], None] = Depends(verify_keys_allowed),
+                          raw: bool = Query(default=False, description='If data should not be decoded'),
+                          values_only: bool = Query(default=False, description='If data should only contain values'),
+                          max_rate: Union[float, None] = Query(default=None, gt=0, description='Maximum events per second')):
+    """
+    Sends every new sample of the background sampler as server-sent event, starts the sampler if needed
+    - **keys** : filter data by given keys
+    - **raw** : If data should not be decoded
+    - **values_only** : If data should only contain values
+    - **max_rate** : Maximum events per second
+
+    All subscribers share the one sampler polling the device
+    """
+    sampler = await ensure_sampler(bl_device)
+
+    async def events():
+        async for sample in sampler.stream(max_rate=max_rate):
+            if await request.is_disconnected():
+                break
+            data = build_response_data(bl_device, sample.frame, q=keys, raw=raw, values_only=values_only, timestamp=sample.timestamp)
+            yield f'data: {encode_response_data(data)}\n\n'
+
+    return StreamingResponse(events(), media_type='text/event-stream')
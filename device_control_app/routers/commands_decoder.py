@@ -0,0 +1,280 @@
+import struct
+from collections import namedtuple
+from typing import Union
+
+from .commands_models import RESPONSE_FORMAT, KNOWN_DEVICES, CHARGING_MODES, UM34CResponseDataRaw
+
+NUMPY_OK = False
+PANDAS_OK = False
+try:
+    import numpy as np
+    NUMPY_OK = True
+except ModuleNotFoundError:
+    NUMPY_OK = False
+try:
+    import pandas as pd
+    PANDAS_OK = True
+except ModuleNotFoundError:
+    PANDAS_OK = False
+
+
+FRAME_LENGTH = 130
+GROUP_COUNT = 10
+
+STRUCT_CODES = {1: 'B', 2: 'H', 4: 'I', 80: str(GROUP_COUNT * 2) + 'I'}
+FRAME_STRUCT = struct.Struct('>' + ''.join(STRUCT_CODES[meta['length']] for meta in RESPONSE_FORMAT))
+
+FIELD_NAMES = list(UM34CResponseDataRaw.__fields__) + ['unknown', 'checksum']
+FIELD_OFFSETS = [sum(meta['length'] for meta in RESPONSE_FORMAT[:i]) for i in range(len(RESPONSE_FORMAT))]
+GROUP_INDEX = FIELD_NAMES.index('group_data')
+
+# Highest value of the small fields, a frame start whose bytes there exceed them is a model id within other data
+FRAME_LIMITS = {'selected_group': GROUP_COUNT - 1, 'thresh_active': 1, 'screen_timeout': 9, 'screen_backlight': 5, 'cur_screen': 5}
+# Position of the fields in the values of FRAME_STRUCT, where group_data takes GROUP_COUNT * 2 values
+FRAME_LIMIT_INDEXES = [(FIELD_NAMES.index(name) + (GROUP_COUNT * 2 - 1 if FIELD_NAMES.index(name) > GROUP_INDEX else 0), limit)
+                       for name, limit in FRAME_LIMITS.items()]
+
+DIVISORS = {'voltage': 100, 'amperage': 1000, 'wattage': 1000, 'usb_volt_pos': 100, 'usb_volt_neg': 100,
+            'thresh_amps': 100, 'resistance': 10}
+UNITS = {'model_id': 'None', 'voltage': 'V', 'amperage': 'A', 'wattage': 'W', 'temperature_c': 'C', 'temperature_f': 'F',
+         'selected_group': '1', 'group_data': 'mAh/mWh', 'usb_volt_pos': 'V', 'usb_volt_neg': 'V', 'charging_mode': 'None',
+         'thresh_mah': 'mAh', 'thresh_mwh': 'mWh', 'thresh_amps': 'A', 'thresh_seconds': 's', 'thresh_active': 'None',
+         'screen_timeout': 'min', 'screen_backlight': '1', 'resistance': 'Ω', 'cur_screen': '1'}
+
+UM34CFrame = namedtuple('UM34CFrame', FIELD_NAMES)
+
+# Static part of every datapoint, only 'value' and 'value_type' change per frame
+FIELD_META = {name: {'byte_offset': offset, **meta, 'byte_length': meta['length']}
+              for name, offset, meta in zip(FIELD_NAMES, FIELD_OFFSETS, RESPONSE_FORMAT)
+              if name in UNITS}
+FIELD_META_DECODED = {name: {**meta, 'value_unit': UNITS[name]} for name, meta in FIELD_META.items()}
+HEX_WIDTHS = {name: meta['length'] * 2 for name, meta in FIELD_META.items()}
+
+
+def decode_frame(data: Union[bytes, memoryview]) -> UM34CFrame:
+    """
+    Unpacks a 130 byte response, or a memoryview of it, into a record of plain integers in one step
+    """
+    values = FRAME_STRUCT.unpack(data)
+    return UM34CFrame(*values[:GROUP_INDEX],
+                      values[GROUP_INDEX:GROUP_INDEX + GROUP_COUNT * 2],
+                      *values[GROUP_INDEX + GROUP_COUNT * 2:])
+
+
+class FrameReader:
+    """
+    Cuts the byte stream of a device into 130 byte frames
+
+    Bytes are received with recv_into into one preallocated buffer and frames are handed out as
+    memoryviews of that buffer, so nothing gets copied. A frame is only valid until the next read.
+    Frames have to start with a known model id, leading bytes that don't are skipped (resync).
+    After skipping bytes a model id is only taken as the start of a frame if the frame fits FRAME_LIMITS.
+    """
+    def __init__(self, frames: int = 4):
+        self.buffer = bytearray(FRAME_LENGTH * frames)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        # False after bytes were skipped, until a frame start was checked against FRAME_LIMITS
+        self.aligned = True
+        self.headers = [bytes.fromhex(code) for code in KNOWN_DEVICES]
+        self.frames = 0
+        self.resyncs = 0
+        self.skipped = 0
+        self.received = 0
+
+    def clear(self) -> None:
+        self.start = self.end = 0
+        self.aligned = True
+
+    def buffered(self) -> int:
+        return self.end - self.start
+
+    def find_header(self) -> int:
+        """
+        Position of the first known model id in the buffered bytes, or -1
+        """
+        positions = [self.buffer.find(header, self.start, self.end) for header in self.headers]
+        positions = [position for position in positions if position >= 0]
+        return min(positions) if positions else -1
+
+    def is_frame_start(self, position: int) -> bool:
+        """
+        True if the FRAME_LENGTH bytes from position fit the frame layout, see FRAME_LIMITS
+        """
+        values = FRAME_STRUCT.unpack_from(self.buffer, position)
+        return all(values[index] <= limit for index, limit in FRAME_LIMIT_INDEXES)
+
+    def resync(self) -> None:
+        """
+        Skips the bytes before the first known model id that can be the start of a frame
+
+        Until a whole frame is buffered from a model id found after skipping, it is kept as the candidate.
+        """
+        skipped = 0
+        while True:
+            position = self.find_header()
+            if position < 0:
+                # Keep the last byte, it could be the first half of a model id
+                position = max(self.start, self.end - 1)
+            if position != self.start:
+                skipped += position - self.start
+                self.start = position
+                self.aligned = False
+            if self.aligned or self.buffered() < FRAME_LENGTH:
+                break
+            if self.is_frame_start(self.start):
+                self.aligned = True
+                break
+            skipped += 1
+            self.start += 1
+        if skipped:
+            self.resyncs += 1
+            self.skipped += skipped
+
+    def compact(self) -> None:
+        """
+        Moves the buffered bytes to the front of the buffer
+        """
+        if self.start == 0:
+            return
+        size = self.buffered()
+        self.view[:size] = self.view[self.start:self.end]
+        self.start, self.end = 0, size
+
+    def next_frame(self) -> Union[memoryview, None]:
+        """
+        Complete frame from the buffered bytes, None if more bytes are needed
+        """
+        if self.buffered() >= 2:
+            self.resync()
+        if self.buffered() < FRAME_LENGTH:
+            return None
+        frame = self.view[self.start:self.start + FRAME_LENGTH]
+        self.start += FRAME_LENGTH
+        if self.start == self.end:
+            self.clear()
+        self.frames += 1
+        return frame
+
+    def read_frame(self, sock) -> memoryview:
+        frame = self.next_frame()
+        while frame is None:
+            if self.end == len(self.buffer):
+                self.compact()
+            received = sock.recv_into(self.view[self.end:])
+            if not received:
+                raise ConnectionResetError('Connection closed by device')
+            self.end += received
+            self.received += received
+            frame = self.next_frame()
+        return frame
+
+    def get_info(self) -> dict:
+        return {'frames': self.frames, 'resyncs': self.resyncs, 'skipped_bytes': self.skipped, 'buffered': self.buffered()}
+
+
+def scale(value: int, divisor: int) -> Union[int, float]:
+    num = value / divisor
+    return int(num) if num.is_integer() else num
+
+
+def frame_values_raw(frame: UM34CFrame) -> dict:
+    values = dict()
+    for name, width in HEX_WIDTHS.items():
+        if name == 'group_data':
+            groups = frame.group_data
+            values[name] = [{'mah': format(groups[i], '08x'), 'mwh': format(groups[i + 1], '08x')}
+                            for i in range(0, GROUP_COUNT * 2, 2)]
+        else:
+            values[name] = format(getattr(frame, name), '0' + str(width) + 'x')
+    return values
+
+
+def frame_values_decoded(frame: UM34CFrame) -> dict:
+    values = frame._asdict()
+    del values['unknown'], values['checksum']
+    values['model_id'] = KNOWN_DEVICES[format(frame.model_id, '04x')]
+    groups = frame.group_data
+    values['group_data'] = [{'mah': groups[i], 'mwh': groups[i + 1]} for i in range(0, GROUP_COUNT * 2, 2)]
+    for name, divisor in DIVISORS.items():
+        values[name] = scale(values[name], divisor)
+    values['charging_mode'] = CHARGING_MODES[frame.charging_mode]['value']
+    return values
+
+
+def frame_to_raw(frame: UM34CFrame) -> dict:
+    """
+    Datapoints with the values as hex strings, the same shape the raw endpoints always returned
+    """
+    return {name: {**FIELD_META[name], 'value': value, 'value_type': type(value).__name__}
+            for name, value in frame_values_raw(frame).items()}
+
+
+def frame_to_decoded(frame: UM34CFrame) -> dict:
+    """
+    Datapoints with decoded values and units
+    """
+    response = {name: {**FIELD_META_DECODED[name], 'value': value, 'value_type': type(value).__name__}
+                for name, value in frame_values_decoded(frame).items()}
+    response['charging_mode']['description'] = CHARGING_MODES[frame.charging_mode]['description']
+    return response
+
+
+if NUMPY_OK:
+    NUMPY_CODES = {1: 'u1', 2: '>u2', 4: '>u4', 80: ('>u4', (GROUP_COUNT, 2))}
+    FRAME_DTYPE = np.dtype([(name, NUMPY_CODES[meta['length']]) for name, meta in zip(FIELD_NAMES, RESPONSE_FORMAT)])
+    MODEL_CODES = np.array([int(code, 16) for code in KNOWN_DEVICES.keys()])
+    MODEL_NAMES = np.array(list(KNOWN_DEVICES.values()) + ['Unknown'])
+    CHARGING_MODE_NAMES = np.array([mode['value'] for mode in CHARGING_MODES])
+
+
+def decode_frames(frames) -> dict:
+    """
+    Decodes many frames at once into columns of NumPy arrays
+
+    - **frames** : N x 130 uint8 array or a bytes like buffer of concatenated frames
+
+    Columns use the names of the db_app measurement table, group data is split into group0_mah ... group9_mwh.
+    Unknown model ids are returned as 'Unknown', unknown charging mode indices as the first charging mode.
+    """
+    if not NUMPY_OK:
+        raise ModuleNotFoundError('decode_frames needs numpy to be installed')
+    if isinstance(frames, np.ndarray):
+        buffer = np.ascontiguousarray(frames, dtype=np.uint8).reshape(-1)
+    else:
+        buffer = np.frombuffer(frames, dtype=np.uint8)
+    if buffer.size % FRAME_LENGTH != 0:
+        raise ValueError(f'Buffer of {buffer.size} bytes does not contain whole {FRAME_LENGTH} byte frames')
+    records = buffer.view(FRAME_DTYPE)
+
+    columns = dict()
+    for name in FIELD_NAMES:
+        values = records[name]
+        if name == 'model_id':
+            index = np.full(values.shape, len(MODEL_CODES))
+            for i, code in enumerate(MODEL_CODES):
+                index[values == code] = i
+            columns[name] = MODEL_NAMES[index]
+        elif name == 'group_data':
+            for i in range(GROUP_COUNT):
+                columns[f'group{i}_mah'] = values[:, i, 0].astype(np.int64)
+                columns[f'group{i}_mwh'] = values[:, i, 1].astype(np.int64)
+        elif name == 'charging_mode':
+            columns[name] = CHARGING_MODE_NAMES[np.where(values < len(CHARGING_MODE_NAMES), values, 0)]
+        elif name == 'thresh_active':
+            columns[name] = values != 0
+        elif name in DIVISORS:
+            columns[name] = values / DIVISORS[name]
+        else:
+            columns[name] = values.astype(np.int64)
+    return columns
+
+
+def decode_frames_df(frames):
+    """
+    Same as decode_frames but returns a pandas DataFrame
+    """
+    if not PANDAS_OK:
+        raise ModuleNotFoundError('decode_frames_df needs pandas to be installed')
+    return pd.DataFrame(decode_frames(frames), copy=False)
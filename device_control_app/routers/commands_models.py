@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from enum import Enum
-from typing import Union, List
+from typing import Union, List, Dict
 from datetime import datetime
 from config import BluetoothSettings
 
@@ -50,11 +50,44 @@ class BLDeviceBase(BaseModel):
     bd_address: Union[str, None] = Field(default=None, title='bd_address', min_length=17, max_length=17, example='aa:bb:cc:dd:ee:ff')
 
 
+class CachedDevice(BLDeviceBase):
+    last_seen: datetime = Field(title='Time the device was last found by discovery', example=datetime.now())
+    stale: bool = Field(default=False, title='Not found by discovery within DISCOVERY_TTL seconds', example=False)
+
+
 class BLDevice(BLDeviceBase):
     timestamp: Union[datetime, None] = Field(default=None, example=datetime.now())
     channel: Union[int, None] = Field(default=None, example=1)
 
 
+class PriorityStats(BaseModel):
+    queued: int = Field(default=0, title='Calls waiting for the device', example=0)
+    executed: int = Field(default=0, title='Calls sent to the device', example=1200)
+    expired: int = Field(default=0, title='Calls dropped because their deadline passed', example=0)
+    wait_avg: float = Field(default=0.0, title='Average seconds waited in the queue (last 100 calls)', example=0.012)
+    wait_max: float = Field(default=0.0, title='Longest seconds waited in the queue (last 100 calls)', example=0.2)
+
+
+class SchedulerInfo(BaseModel):
+    queue_depth: int = Field(default=0, title='Calls waiting for the device', example=1)
+    control: PriorityStats = PriorityStats()
+    read: PriorityStats = PriorityStats()
+    background: PriorityStats = PriorityStats()
+    maintenance: PriorityStats = PriorityStats()
+
+
+class BLConnection(BLDevice):
+    connected: bool = Field(default=False, example=True)
+    connected_since: Union[datetime, None] = Field(default=None, example=datetime.now())
+    frames: int = Field(default=0, title='Frames received', example=1200)
+    resyncs: int = Field(default=0, title='Times the frame start was searched for', example=0)
+    skipped_bytes: int = Field(default=0, title='Bytes skipped while searching a frame start', example=0)
+    breaker_state: str = Field(default='closed', title='closed, open (fails fast with 409) or half_open (next connect is a probe)', example='closed')
+    breaker_trips: int = Field(default=0, title='Times the device was found unreachable', example=0)
+    retry_in: float = Field(default=0.0, title='Seconds until the next connection attempt is allowed', example=0.0)
+    scheduler: Union[SchedulerInfo, None] = None
+
+
 class UM34CCommands(Enum):
     request_data = b'\xf0'
     next_screen = b'\xf1'
@@ -67,6 +100,33 @@ class UM34CCommands(Enum):
     screen_timeout = b'\xe0'
 
 
+UM34CCommandNames = Enum('UM34CCommandNames', {name: name for name in UM34CCommands.__members__}, type=str)
+
+
+# Highest argument added to the command code, commands missing here take no argument
+COMMAND_ARGUMENT_LIMITS = {'select_group': 9, 'recording_threshold': 30, 'backlight_level': 5, 'screen_timeout': 9}
+
+# Seconds /command/macro waits after a command before the next one, until /command/calibrate_spacing measured
+# the device (see commands_spacing.py). COMMAND_SPACING in the environment overrides both
+COMMAND_SPACING = {'request_data': 0.0,
+                   'next_screen': 0.3,
+                   'rotate_screen': 0.9,
+                   'previous_screen': 0.3,
+                   'clear_data_group': 0.3,
+                   'select_group': 0.05,
+                   'recording_threshold': 0.0,
+                   'backlight_level': 0.0,
+                   'screen_timeout': 0.0,
+                   }
+
+# Waits of the endpoints that send several commands, the same as before they ran as macros
+ENDPOINT_SPACING = {'rotate_screen': {'rotate_screen': 0.9},
+                    'clear_data_group': {'select_group': 0.03},
+                    'set_screen': {},
+                    'reset_device': {'next_screen': 0.3, 'previous_screen': 0.3, 'select_group': 0.05, 'clear_data_group': 0.3},
+                    }
+
+
 class CommandResponse(BLDevice):
     command: Union[str, None] = Field(title='Used command', example='0xf0')
     command_code: Union[str, None] = Field(title='Code of used command', example=UM34CCommands.request_data.name)
@@ -513,6 +573,9 @@ class UM34Examples(Enum):
                                 '8 minutes': {'description': 'Sets screen timeout to 8 minutes', 'value': 8},
                                 '9 minutes': {'description': 'Sets screen timeout to 9 minutes', 'value': 9},
                                 }
+    macro: dict = {'Set up group 3': {'description': 'Select group 3, clear it and read data', 'value': [{'command': 'select_group', 'argument': 3}, {'command': 'clear_data_group'}, {'command': 'request_data'}]},
+                   'Dim and sleep early': {'description': 'Set backlight to 1 and screen timeout to 1 minute', 'value': [{'command': 'backlight_level', 'argument': 1}, {'command': 'screen_timeout', 'argument': 1}]},
+                   }
     set_screen: dict = {'default': {'description': 'default example value', 'value': None},
                         'screen 0 (most left)': {'description': 'Go to screen 0 (most left)', 'value': 0},
                         'screen 1': {'description': 'Go to screen 1', 'value': 1},
@@ -542,4 +605,115 @@ class GroupData(BaseModel):
 
 class DBResponse(BaseModel):
   created_id: Union[int, None]
-  message: Union[str, None]
\ No newline at end of file
+  message: Union[str, None]
+
+
+class MacroStep(BaseModel):
+    command: UM34CCommandNames = Field(title='Command to send', example=UM34CCommandNames.select_group)
+    argument: Union[int, None] = Field(default=None, title='Value added to the command code', ge=0, le=30, example=3)
+
+
+class MacroStepResult(BaseModel):
+    command: str = Field(title='Used command', example=UM34CCommands.select_group.name)
+    command_code: str = Field(title='Code of used command', example='0xa3')
+    argument: Union[int, None] = Field(default=None, example=3)
+    started: float = Field(title='Seconds since start of the macro', example=0.35)
+    waited: float = Field(title='Seconds waited for the device before sending', example=0.05)
+    duration: float = Field(title='Seconds for sending (and receiving)', example=0.0004)
+    data: Union[dict, None] = Field(default=None, title='Values received for request_data')
+
+
+class MacroResponse(BLDevice):
+    total_time: float = Field(title='Seconds for the whole macro', example=0.42)
+    steps: List[MacroStepResult] = []
+
+
+class SpacingCalibration(BLDevice):
+    spacing: Dict[str, float] = Field(title='Seconds /command/macro waits after each command',
+                                      example={'next_screen': 0.21, 'select_group': 0.18})
+    measured: Dict[str, List[float]] = Field(title='Seconds until each command showed, per round',
+                                             example={'next_screen': [0.15, 0.17, 0.16], 'select_group': [0.14, 0.12, 0.13]})
+    path: Union[str, None] = Field(default=None, title='File the spacing was saved to', example='command_spacing.json')
+
+
+class SamplerInfo(BLDeviceBase):
+    channel: Union[int, None] = Field(default=None, example=1)
+    running: bool = Field(default=False, example=True)
+    sample_rate: Union[float, None] = Field(default=None, example=2.0)
+    buffer_size: Union[int, None] = Field(default=None, example=600)
+    buffered: Union[int, None] = Field(default=None, example=600)
+    samples: Union[int, None] = Field(default=None, example=12345)
+    errors: Union[int, None] = Field(default=None, example=0)
+    sample_rate_actual: Union[float, None] = Field(default=None, example=1.9)
+    subscribers: Union[int, None] = Field(default=None, example=3)
+    last_sample: Union[datetime, None] = Field(default=None, example=datetime.now())
+    last_error: Union[str, None] = Field(default=None, example=None)
+
+
+class UploaderInfo(BaseModel):
+    running: bool = Field(default=False, example=True)
+    db_url: Union[str, None] = Field(default=None, example='http://127.0.0.1:8081/data')
+    sample_rate: Union[float, None] = Field(default=None, example=10.0)
+    queue_size: Union[int, None] = Field(default=None, example=1000)
+    queued: Union[int, None] = Field(default=None, example=3)
+    produced: Union[int, None] = Field(default=None, example=12345)
+    uploaded: Union[int, None] = Field(default=None, example=12340)
+    dropped: Union[int, None] = Field(default=None, example=0)
+    failed: Union[int, None] = Field(default=None, example=2)
+    device_errors: Union[int, None] = Field(default=None, example=0)
+    batches: Union[int, None] = Field(default=None, example=250)
+    retries: Union[int, None] = Field(default=None, title='Uploads retried because the database was not reachable', example=0)
+    upload_rate: Union[float, None] = Field(default=None, example=9.8)
+    last_error: Union[str, None] = Field(default=None, example=None)
+    spool_dir: Union[str, None] = Field(default=None, example='spool/sending_loop')
+    spool_size: Union[int, None] = Field(default=None, title='Bytes in the spool', example=52000)
+    spool_segments: Union[int, None] = Field(default=None, title='Segment files of the spool', example=1)
+    spool_pending: Union[int, None] = Field(default=None, title='Samples waiting for the database', example=120)
+    spool_lag: Union[float, None] = Field(default=None, title='Age in seconds of the oldest waiting sample', example=12.5)
+    spool_dropped: Union[int, None] = Field(default=None, title='Samples dropped because the spool was full', example=0)
+
+
+class RecorderInfo(BaseModel):
+    recording: bool = Field(default=False, example=True)
+    path: Union[str, None] = Field(default=None, title='Log file', example='recordings/frames.um34clog')
+    started: Union[datetime, None] = Field(default=None, example=datetime.now())
+    records: int = Field(default=0, title='Frames recorded', example=1200)
+    size: int = Field(default=0, title='Bytes recorded', example=182400)
+
+
+class ReplayInfo(BaseModel):
+    running: bool = Field(default=False, example=True)
+    path: Union[str, None] = Field(default=None, title='Log file', example='recordings/frames.um34clog')
+    speed: float = Field(default=1.0, title='Replay speed, 0 is as fast as possible', example=10.0)
+    frames: int = Field(default=0, title='Frames replayed', example=1200)
+    errors: int = Field(default=0, title='Frames that could not be decoded', example=0)
+    frame_rate: float = Field(default=0.0, title='Frames per second', example=20.0)
+    uploader: Union[UploaderInfo, None] = None
+    last_error: Union[str, None] = Field(default=None, example=None)
+
+
+class ProfileInfo(BaseModel):
+    profile_id: str = Field(title='Id, also sent in the X-Profile-Id header of the profiled response', example='20261017-101500-123456-request_data')
+    profiler: str = Field(title='cprofile or sampling', example='cprofile')
+    created: datetime = Field(example=datetime.now())
+    size: int = Field(title='Bytes', example=48213)
+
+
+class DeviceInfo(BLConnection):
+    sampler: Union[SamplerInfo, None] = None
+    uploader: Union[UploaderInfo, None] = None
+
+
+class ThroughputStats(BaseModel):
+    devices: int = Field(default=0, example=12)
+    samplers_running: int = Field(default=0, example=12)
+    uploaders_running: int = Field(default=0, example=12)
+    sample_rate: float = Field(default=0.0, example=24.0)
+    upload_rate: float = Field(default=0.0, example=24.0)
+    samples: int = Field(default=0, example=123456)
+    sample_errors: int = Field(default=0, example=3)
+    uploaded: int = Field(default=0, example=123400)
+    dropped: int = Field(default=0, example=0)
+    failed: int = Field(default=0, example=56)
+    queue_depth: int = Field(default=0, title='Calls waiting for a device, summed over all devices', example=2)
+    control_wait_max: float = Field(default=0.0, title='Longest seconds a control command waited for a device', example=0.2)
\ No newline at end of file
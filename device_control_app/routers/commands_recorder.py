@@ -0,0 +1,234 @@
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import Union, Iterator, Callable, NamedTuple
+
+from .bl_connection import frame_hooks
+from .commands_decoder import FRAME_LENGTH, decode_frame
+from .commands_uploader import Uploader, frame_to_db_row
+
+
+# Every record: monotonic capture time, wall clock time, bd_address as 6 bytes, then the 130 byte frame
+RECORD_HEADER = struct.Struct('>dd6s')
+RECORD_LENGTH = RECORD_HEADER.size + FRAME_LENGTH
+LOG_MAGIC = b'UM34CLOG1\n'
+
+
+class Record(NamedTuple):
+    monotonic: float
+    timestamp: float
+    bd_address: str
+    frame: memoryview
+
+
+def pack_address(bd_address: str) -> bytes:
+    return bytes.fromhex(bd_address.replace(':', ''))
+
+
+def unpack_address(data: bytes) -> str:
+    return ':'.join(format(byte, '02x') for byte in data)
+
+
+class FrameRecorder:
+    """
+    Appends every received frame to a binary log
+
+    Records have a fixed length, so a log cut off by a crash only loses its last partial record, which is truncated
+    when the log is opened again. The file is flushed at least every flush_interval seconds while frames come in.
+    """
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        self.path = path
+        self.flush_interval = float(flush_interval)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size:
+            with open(path, 'rb') as file:
+                magic = file.read(len(LOG_MAGIC))
+            if not LOG_MAGIC.startswith(magic) or (size >= len(LOG_MAGIC) and magic != LOG_MAGIC):
+                raise ValueError(f'{path} is not a frame log')
+        # A log cut off within the magic starts over, one cut off within a record loses that record
+        length = len(LOG_MAGIC) + (size - len(LOG_MAGIC)) // RECORD_LENGTH * RECORD_LENGTH if size >= len(LOG_MAGIC) else 0
+        self.file = open(path, 'ab')
+        self.file.truncate(length)
+        if length == 0:
+            self.file.write(LOG_MAGIC)
+        self.lock = threading.Lock()
+        self.started = datetime.now()
+        self.records = 0
+        self.last_flush = time.monotonic()
+
+    def record(self, bd_address: str, frame: Union[bytes, memoryview]) -> None:
+        now = time.monotonic()
+        header = RECORD_HEADER.pack(now, time.time(), pack_address(bd_address))
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(header)
+            self.file.write(frame)
+            self.records += 1
+            if now - self.last_flush >= self.flush_interval:
+                self.file.flush()
+                self.last_flush = now
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+
+    def get_info(self) -> dict:
+        return {'recording': not self.file.closed,
+                'path': self.path,
+                'started': self.started,
+                'records': self.records,
+                'size': RECORD_LENGTH * self.records,
+                }
+
+
+def read_log(path: str, chunk_records: int = 1024) -> Iterator[Record]:
+    """
+    Yields the records of a log, the frames are views into a reused read buffer and only valid until the next record
+    """
+    buffer = bytearray(RECORD_LENGTH * chunk_records)
+    view = memoryview(buffer)
+    with open(path, 'rb') as file:
+        if file.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            raise ValueError(f'{path} is not a frame log')
+        while True:
+            size = file.readinto(buffer)
+            for offset in range(0, size - RECORD_LENGTH + 1, RECORD_LENGTH):
+                monotonic, timestamp, address = RECORD_HEADER.unpack_from(buffer, offset)
+                yield Record(monotonic, timestamp, unpack_address(address),
+                             view[offset + RECORD_HEADER.size:offset + RECORD_LENGTH])
+            if size < len(buffer):
+                return
+
+
+class FrameReplay:
+    """
+    Feeds a frame log through the decoder and, if given an uploader, the upload to db_app
+
+    The uploader queue is not allowed to drop rows, a replay waits for the uploads instead.
+
+    With speed 1 the frames come with their recorded spacing, with speed N N times faster and with speed 0 as fast as possible.
+    The rows keep the recorded timestamps.
+    """
+    def __init__(self, path: str, speed: float = 1.0, uploader: Union[Uploader, None] = None,
+                 sink: Union[Callable[[dict], None], None] = None):
+        self.path = path
+        self.speed = float(speed)
+        self.uploader = uploader
+        self.sink = sink
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='frame-replay', daemon=True)
+        self.started = None
+        self.finished = None
+        self.frames = 0
+        self.errors = 0
+        self.last_error = None
+
+    def start(self) -> None:
+        self.started = time.monotonic()
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def is_running(self) -> bool:
+        return self.thread.is_alive()
+
+    def wait_for(self, record: Record, first: Record) -> None:
+        if self.speed <= 0:
+            return
+        delay = self.started + (record.monotonic - first.monotonic) / self.speed - time.monotonic()
+        if delay > 0:
+            self.stop_event.wait(delay)
+
+    def run(self) -> None:
+        first = None
+        try:
+            for record in read_log(self.path):
+                if self.stop_event.is_set():
+                    break
+                first = first or record
+                self.wait_for(record, first)
+                try:
+                    row = frame_to_db_row(record.bd_address, decode_frame(record.frame), datetime.fromtimestamp(record.timestamp))
+                except (KeyError, IndexError, struct.error) as error:
+                    self.errors += 1
+                    self.last_error = repr(error)
+                    continue
+                self.frames += 1
+                if self.uploader is not None:
+                    self.uploader.put(row)
+                if self.sink is not None:
+                    self.sink(row)
+        except (OSError, ValueError) as error:
+            self.last_error = repr(error)
+        finally:
+            self.finished = time.monotonic()
+            if self.uploader is not None:
+                self.uploader.stop()
+
+    def get_rate(self) -> float:
+        if self.started is None:
+            return 0.0
+        return self.frames / max((self.finished or time.monotonic()) - self.started, 1e-9)
+
+    def get_info(self) -> dict:
+        return {'running': self.is_running(),
+                'path': self.path,
+                'speed': self.speed,
+                'frames': self.frames,
+                'errors': self.errors,
+                'frame_rate': round(self.get_rate(), 3),
+                'uploader': self.uploader.get_info() if self.uploader is not None else None,
+                'last_error': self.last_error,
+                }
+
+
+recorder: Union[FrameRecorder, None] = None
+replay: Union[FrameReplay, None] = None
+
+
+def get_recorder() -> Union[FrameRecorder, None]:
+    return recorder
+
+
+def start_recording(path: str) -> FrameRecorder:
+    """
+    Records the frames received from all devices until stop_recording()
+    """
+    global recorder
+    stop_recording()
+    recorder = FrameRecorder(path)
+    frame_hooks.append(recorder.record)
+    return recorder
+
+
+def stop_recording() -> Union[FrameRecorder, None]:
+    global recorder
+    stopped, recorder = recorder, None
+    if stopped is not None:
+        frame_hooks.remove(stopped.record)
+        stopped.close()
+    return stopped
+
+
+def get_replay() -> Union[FrameReplay, None]:
+    return replay
+
+
+def start_replay(path: str, speed: float = 1.0, uploader: Union[Uploader, None] = None) -> FrameReplay:
+    global replay
+    stop_replay()
+    replay = FrameReplay(path, speed=speed, uploader=uploader)
+    replay.start()
+    return replay
+
+
+def stop_replay() -> Union[FrameReplay, None]:
+    if replay is not None:
+        replay.stop()
+    return replay
@@ -0,0 +1,242 @@
+import asyncio
+import contextvars
+import time
+from collections import deque, namedtuple
+from datetime import datetime
+from typing import Union, Dict, List, Set, AsyncIterator, Callable
+
+from .bl_scheduler import Priority
+from .commands_models import UM34CCommands
+from config import SamplerSettings
+
+
+Sample = namedtuple('Sample', ['timestamp', 'monotonic', 'frame'])
+
+
+class DeviceSampler:
+    """
+    Polls one device at a fixed rate and keeps the latest decoded frames in a ring buffer
+
+    Read endpoints answer from the buffer when the newest sample is fresh enough,
+    so the device only sees this one poller no matter how many clients read.
+    """
+    def __init__(self, bl_device, sample_rate: float = 2.0, buffer_size: int = 600):
+        self.device = bl_device
+        self.sample_rate = float(sample_rate)
+        self.buffer = deque(maxlen=int(buffer_size))
+        self.task = None
+        self.samples = 0
+        self.errors = 0
+        self.last_error = None
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.sinks: List[Callable[[Sample], None]] = list()
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            # In an empty context, not in the one of the request that started the sampler
+            self.task = contextvars.Context().run(asyncio.get_running_loop().create_task, self.run())
+
+    async def stop(self) -> None:
+        self.publish(None)
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def is_running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    async def sample(self) -> Sample:
+        await self.device.ensure_connected(priority=Priority.background)
+        frame = await self.device.request_frame(command=UM34CCommands.request_data.value, priority=Priority.background)
+        sample = Sample(datetime.now(), time.monotonic(), frame)
+        self.buffer.append(sample)
+        self.samples += 1
+        self.publish(sample)
+        for sink in self.sinks:
+            sink(sample)
+        return sample
+
+    def publish(self, sample: Union[Sample, None]) -> None:
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(sample)
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        Queue receiving every new sample. Only the newest sample is kept if the subscriber falls behind
+        """
+        queue = asyncio.Queue(maxsize=1)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self.subscribers.discard(queue)
+
+    async def stream(self, max_rate: Union[float, None] = None) -> AsyncIterator[Sample]:
+        """
+        Yields new samples as they arrive, but not more than max_rate samples per second
+
+        Ends when the sampler gets stopped
+        """
+        queue = self.subscribe()
+        min_interval = 1 / max_rate if max_rate else 0
+        last_sent = None
+        try:
+            while True:
+                sample = await queue.get()
+                if sample is None:
+                    return
+                if last_sent is not None and sample.monotonic - last_sent < min_interval:
+                    continue
+                last_sent = sample.monotonic
+                yield sample
+        finally:
+            self.unsubscribe(queue)
+
+    async def run(self) -> None:
+        interval = 1 / self.sample_rate
+        next_time = time.monotonic()
+        while True:
+            try:
+                await self.sample()
+            except Exception as error:
+                # Also a broken frame or a failing sink must not end the sampling
+                self.errors += 1
+                self.last_error = repr(error)
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay < 0:
+                next_time = time.monotonic()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    def latest(self, max_age: Union[float, None] = None) -> Union[Sample, None]:
+        """
+        Returns the newest sample if it is not older than max_age seconds
+        """
+        if not self.buffer:
+            return None
+        sample = self.buffer[-1]
+        if max_age is not None and time.monotonic() - sample.monotonic > max_age:
+            return None
+        return sample
+
+    def get_rate(self, window: float = 10.0) -> float:
+        """
+        Samples per second within the last window seconds
+        """
+        since = time.monotonic() - window
+        count = 0
+        for sample in reversed(self.buffer):
+            if sample.monotonic < since:
+                break
+            count += 1
+        return count / window
+
+    def get_samples(self, limit: Union[int, None] = None) -> List[Sample]:
+        samples = list(self.buffer)
+        return samples[-limit:] if limit else samples
+
+    def get_info(self) -> dict:
+        latest = self.latest()
+        return {**self.device.get_info(),
+                'running': self.is_running(),
+                'sample_rate': self.sample_rate,
+                'buffer_size': self.buffer.maxlen,
+                'buffered': len(self.buffer),
+                'samples': self.samples,
+                'errors': self.errors,
+                'last_error': self.last_error,
+                'sample_rate_actual': round(self.get_rate(), 3),
+                'subscribers': len(self.subscribers),
+                'last_sample': latest.timestamp if latest else None,
+                }
+
+
+samplers: Dict[str, DeviceSampler] = dict()
+
+
+def get_sampler(bd_address: str) -> Union[DeviceSampler, None]:
+    return samplers.get(bd_address)
+
+
+async def start_sampler(bl_device, sample_rate: float, buffer_size: int) -> DeviceSampler:
+    await stop_sampler(bl_device.get_bd_address())
+    sampler = samplers[bl_device.get_bd_address()] = DeviceSampler(bl_device, sample_rate, buffer_size)
+    sampler.start()
+    return sampler
+
+
+async def ensure_sampler(bl_device) -> DeviceSampler:
+    """
+    Running sampler of the device, started with the configured settings if there is none
+    """
+    sampler = get_sampler(bl_device.get_bd_address())
+    if sampler is None or not sampler.is_running():
+        settings = SamplerSettings()
+        sampler = await start_sampler(bl_device, sample_rate=settings.sample_rate, buffer_size=settings.buffer_size)
+    return sampler
+
+
+async def stop_sampler(bd_address: str) -> bool:
+    sampler = samplers.pop(bd_address, None)
+    if sampler is None:
+        return False
+    await sampler.stop()
+    return True
+
+
+async def stop_all_samplers() -> None:
+    for bd_address in list(samplers.keys()):
+        await stop_sampler(bd_address)
+
+
+# Reads running right now and the last finished read, per bd_address
+reads: Dict[str, asyncio.Future] = dict()
+last_reads: Dict[str, Sample] = dict()
+
+
+async def request_sample(bl_device) -> Sample:
+    frame = await bl_device.request_frame(command=UM34CCommands.request_data.value)
+    sample = last_reads[bl_device.get_bd_address()] = Sample(datetime.now(), time.monotonic(), frame)
+    return sample
+
+
+async def read_frame(bl_device) -> Sample:
+    """
+    New round-trip to the device, callers arriving while one is running share its frame
+
+    The read is shielded, a caller that goes away does not cancel it for the others.
+    """
+    bd_address = bl_device.get_bd_address()
+    future = reads.get(bd_address)
+    if future is None:
+        future = reads[bd_address] = asyncio.ensure_future(request_sample(bl_device))
+        future.add_done_callback(lambda done: reads.pop(bd_address) if reads.get(bd_address) is done else None)
+    return await asyncio.shield(future)
+
+
+async def get_frame(bl_device, max_age: Union[float, None] = None) -> Sample:
+    """
+    Newest sample of the device's sampler if fresh enough, else a new round-trip to the device
+
+    A read that finished less than coalesce_window seconds ago is shared as well.
+    """
+    bd_address = bl_device.get_bd_address()
+    sampler = get_sampler(bd_address)
+    if sampler is not None and max_age is not None:
+        sample = sampler.latest(max_age)
+        if sample is not None:
+            return sample
+    window = SamplerSettings().coalesce_window
+    if max_age is not None:
+        window = min(window, max_age)
+    sample = last_reads.get(bd_address)
+    if sample is not None and time.monotonic() - sample.monotonic <= window:
+        return sample
+    return await read_frame(bl_device)
@@ -0,0 +1,90 @@
+import json
+import os
+import time
+from typing import Dict, List, Tuple, Union
+
+from fastapi import HTTPException, status
+
+from .commands_models import COMMAND_ARGUMENT_LIMITS, COMMAND_SPACING, UM34CCommands
+
+# Commands whose effect shows in the frames, with the frame field and the command that undoes them.
+# rotate_screen does not show and clear_data_group would lose data, they keep COMMAND_SPACING
+CALIBRATION_COMMANDS = {'next_screen': ('cur_screen', 'previous_screen'),
+                        'previous_screen': ('cur_screen', 'next_screen'),
+                        'select_group': ('selected_group', 'select_group'),
+                        'recording_threshold': ('thresh_amps', 'recording_threshold'),
+                        'backlight_level': ('screen_backlight', 'backlight_level'),
+                        'screen_timeout': ('screen_timeout', 'screen_timeout'),
+                        }
+
+
+def get_code(command: UM34CCommands, argument: Union[int, None]) -> bytes:
+    return command.value if argument is None else bytes([command.value[0] + argument])
+
+
+def measure_command(device, command: UM34CCommands, argument: Union[int, None], field: str, timeout: float) -> float:
+    """
+    Seconds from sending the command until a frame shows its effect on field
+
+    The time until the answer of the first frame with the change arrived, so it is an upper bound.
+    """
+    before = getattr(device.request_frame(UM34CCommands.request_data.value), field)
+    start = time.monotonic()
+    device.send(get_code(command, argument))
+    while True:
+        frame = device.request_frame(UM34CCommands.request_data.value)
+        elapsed = time.monotonic() - start
+        if getattr(frame, field) != before:
+            return elapsed
+        if elapsed > timeout:
+            message = f'{command.name} did not show in the frames within {timeout} s'
+            raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=message, headers={'X-Error': message})
+
+
+def get_arguments(name: str, current: int) -> Tuple[Union[int, None], Union[int, None]]:
+    """
+    Argument of the command and of the command that undoes it, for a device at the value current
+    """
+    limit = COMMAND_ARGUMENT_LIMITS.get(name)
+    if limit is None:
+        return None, None
+    return (current + 1) % (limit + 1), current
+
+
+def calibrate_spacing(device, rounds: int = 3, margin: float = 1.25, timeout: float = 3.0) -> Tuple[Dict[str, float], Dict[str, List[float]]]:
+    """
+    Measures for the commands of CALIBRATION_COMMANDS how long the device takes until a command shows
+
+    Every command is sent rounds times and undone after each time, the device ends up as it was.
+    Returns the spacing, the longest measurement times margin, and all measurements per command.
+    Runs on the device's I/O thread, as one call.
+    """
+    measured = {name: [] for name in CALIBRATION_COMMANDS}
+    for name, (field, undo) in CALIBRATION_COMMANDS.items():
+        for _ in range(rounds):
+            current = getattr(device.request_frame(UM34CCommands.request_data.value), field)
+            argument, undo_argument = get_arguments(name, current)
+            measured[name].append(measure_command(device, UM34CCommands[name], argument, field, timeout))
+            measured[undo].append(measure_command(device, UM34CCommands[undo], undo_argument, field, timeout))
+    spacing = {name: round(max(times) * margin, 3) for name, times in measured.items()}
+    return spacing, measured
+
+
+def load_spacing(path: str) -> Dict[str, float]:
+    """
+    Spacing saved by save_spacing, empty if there is none or it can not be read
+    """
+    if not os.path.exists(path):
+        return dict()
+    try:
+        with open(path) as file:
+            return {name: float(seconds) for name, seconds in json.load(file).items() if name in COMMAND_SPACING}
+    except (OSError, ValueError, TypeError, AttributeError):
+        return dict()
+
+
+def save_spacing(path: str, spacing: Dict[str, float]) -> None:
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(spacing, file, indent=2)
+    os.replace(tmp_path, path)
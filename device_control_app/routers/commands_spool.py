@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Union, List, Tuple
+
+
+SEGMENT_SUFFIX = '.jsonl'
+
+
+class SampleSpool:
+    """
+    Write-ahead log for samples on their way to db_app
+
+    Samples are appended as JSON lines to segment files of about segment_size bytes. The drain side reads
+    from a cursor which is only moved (and saved) when db_app accepted the samples, so nothing is lost
+    when db_app is down or the process restarts. Fully drained segments are deleted.
+    If the spool grows over max_size the oldest segment is dropped.
+    """
+    def __init__(self, directory: str, segment_size: int = 4_000_000, max_size: int = 1_000_000_000):
+        self.directory = directory
+        self.segment_size = int(segment_size)
+        self.max_size = int(max_size)
+        self.cursor_path = os.path.join(directory, 'cursor')
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+        self.cursor = self.load_cursor()
+        self.read_positions: List[Tuple[str, int]] = list()
+        self.write_file = None
+        self.write_size = 0
+        self.appended = 0
+        self.drained = 0
+        self.dropped = 0
+        self.corrupt = 0
+        self.oldest_pending = None
+        self.pending = self.count_pending()
+        self.size = sum(os.path.getsize(self.segment_path(name)) for name in self.segments)
+        self.open_segment(self.segments[-1] if self.segments else None)
+
+    def segment_path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def load_cursor(self) -> Tuple[str, int]:
+        try:
+            with open(self.cursor_path) as file:
+                name, offset = file.read().split()
+            if name in self.segments:
+                return name, int(offset)
+        except (OSError, ValueError):
+            pass
+        return (self.segments[0], 0) if self.segments else ('', 0)
+
+    def save_cursor(self) -> None:
+        tmp_path = self.cursor_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(f'{self.cursor[0]} {self.cursor[1]}')
+        os.replace(tmp_path, self.cursor_path)
+
+    def count_pending(self) -> int:
+        count = 0
+        for name in self.segments:
+            if name < self.cursor[0]:
+                continue
+            with open(self.segment_path(name), 'rb') as file:
+                if name == self.cursor[0]:
+                    file.seek(self.cursor[1])
+                count += sum(1 for line in file if line.endswith(b'\n'))
+        return count
+
+    def open_segment(self, name: Union[str, None] = None) -> None:
+        if self.write_file is not None:
+            self.write_file.close()
+        if name is None:
+            name = f'{time.time_ns():020d}{SEGMENT_SUFFIX}'
+            self.segments.append(name)
+            if not self.cursor[0]:
+                self.cursor = (name, 0)
+        self.write_file = open(self.segment_path(name), 'ab')
+        self.write_size = self.write_file.tell()
+
+    def append(self, rows: List[dict]) -> None:
+        data = b''.join(json.dumps(row).encode() + b'\n' for row in rows)
+        with self.lock:
+            self.write_file.write(data)
+            self.write_file.flush()
+            self.write_size += len(data)
+            self.size += len(data)
+            self.appended += len(rows)
+            self.pending += len(rows)
+            if self.write_size >= self.segment_size:
+                self.open_segment()
+            while len(self.segments) > 1 and self.size > self.max_size:
+                self.drop_oldest()
+
+    def drop_oldest(self) -> None:
+        name = self.segments.pop(0)
+        with open(self.segment_path(name), 'rb') as file:
+            if name == self.cursor[0]:
+                file.seek(self.cursor[1])
+            lost = sum(1 for line in file if line.endswith(b'\n'))
+        self.size -= os.path.getsize(self.segment_path(name))
+        os.remove(self.segment_path(name))
+        self.dropped += lost
+        self.pending -= lost
+        if name == self.cursor[0]:
+            # Rows of the last read() stay in read_positions, commit() skips the ones of this segment
+            self.cursor = (self.segments[0], 0)
+            self.save_cursor()
+
+    def read(self, max_rows: int) -> List[dict]:
+        """
+        Oldest samples not yet drained, they stay in the spool until commit() is called
+        """
+        rows = []
+        positions = []
+        with self.lock:
+            self.write_file.flush()
+            name, offset = self.cursor
+            while name and len(rows) < max_rows:
+                with open(self.segment_path(name), 'rb') as file:
+                    file.seek(offset)
+                    while len(rows) < max_rows:
+                        line = file.readline()
+                        # A line without newline is still being written
+                        if not line.endswith(b'\n'):
+                            break
+                        offset += len(line)
+                        try:
+                            rows.append(json.loads(line))
+                            positions.append((name, offset))
+                        except ValueError:
+                            self.corrupt += 1
+                index = self.segments.index(name)
+                if len(rows) >= max_rows or index + 1 >= len(self.segments):
+                    break
+                name, offset = self.segments[index + 1], 0
+            self.read_positions = positions
+        if rows:
+            self.oldest_pending = rows[0].get('created_at')
+        return rows
+
+    def commit(self, count: int) -> None:
+        """
+        Marks the first count rows of the last read() as stored in db_app
+
+        Rows of a segment drop_oldest() removed since were already counted as dropped, the cursor is past them.
+        """
+        with self.lock:
+            if count <= 0 or count > len(self.read_positions):
+                return
+            committed = [position for position in self.read_positions[:count] if position[0] in self.segments]
+            self.read_positions = self.read_positions[count:]
+            if not committed:
+                return
+            self.cursor = committed[-1]
+            self.drained += len(committed)
+            self.pending = max(self.pending - len(committed), 0)
+            self.save_cursor()
+            while len(self.segments) > 1 and self.segments[0] < self.cursor[0]:
+                path = self.segment_path(self.segments.pop(0))
+                self.size -= os.path.getsize(path)
+                os.remove(path)
+            if self.pending == 0:
+                self.oldest_pending = None
+
+    def get_lag(self) -> float:
+        """
+        Seconds since the oldest sample not yet in db_app was taken
+        """
+        if not self.pending or self.oldest_pending is None:
+            return 0.0
+        try:
+            return max(0.0, (datetime.now() - datetime.fromisoformat(self.oldest_pending)).total_seconds())
+        except ValueError:
+            return 0.0
+
+    def close(self) -> None:
+        with self.lock:
+            self.write_file.close()
+
+    def get_info(self) -> dict:
+        return {'spool_dir': self.directory,
+                'spool_size': self.size,
+                'spool_segments': len(self.segments),
+                'spool_pending': self.pending,
+                'spool_lag': round(self.get_lag(), 3),
+                'spool_dropped': self.dropped,
+                }
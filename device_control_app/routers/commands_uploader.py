@@ -0,0 +1,312 @@
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Union, List, Dict
+
+import requests
+
+from .commands_decoder import UM34CFrame, frame_values_decoded
+from .commands_models import UM34CCommands
+from .commands_spool import SampleSpool
+from .bl_connection import connection_pool
+from .bl_scheduler import Priority
+from .metrics import time_stage, upload_batch_rows, uploaded_rows
+
+
+request_session = requests.Session()
+request_session.trust_env = False
+
+
+def frame_to_db_row(bd_address: str, frame: UM34CFrame, timestamp: Union[datetime, None] = None) -> dict:
+    with time_stage('serialize'):
+        return {'created_at': str(timestamp or datetime.now()), 'bd_address': bd_address, **frame_values_decoded(frame)}
+
+
+class Uploader:
+    """
+    Samples a device and uploads the samples to db_app
+
+    A producer thread polls the device over the pooled connection and puts the samples into a bounded queue.
+    When the queue is full the producer waits up to one sample interval and then drops the sample.
+    A consumer thread takes the samples in batches of batch_size, or whatever arrived within batch_interval seconds,
+    and posts them to db_app. A batch goes to db_url/batch in one request. Against a db_app without that endpoint,
+    or for a batch db_app rejects, the samples are posted one by one.
+
+    Without bl_settings there is no producer thread and the samples are handed in with offer(), e.g. by a DeviceSampler.
+
+    With a spool_dir the consumer only appends the batches to a SampleSpool in spool_dir/name, and a drainer thread
+    uploads them from there. Samples survive db_app being down and restarts of this app, the drainer retries
+    with growing delays until db_app is back.
+    """
+    def __init__(self, bl_settings: Union[dict, None], db_url: str, sample_rate: float = 10.0, queue_size: int = 1000,
+                 batch_size: int = 50, batch_interval: float = 1.0, timeout: float = 5.0, spool_dir: str = '',
+                 spool_segment_size: int = 4_000_000, spool_max_size: int = 1_000_000_000, name: str = 'default'):
+        self.bl_settings = bl_settings
+        self.name = name
+        self.db_url = db_url
+        self.batch_url = db_url.rstrip('/') + '/batch'
+        self.batch_supported = True
+        self.sample_rate = float(sample_rate)
+        self.batch_size = int(batch_size)
+        self.batch_interval = float(batch_interval)
+        self.timeout = float(timeout)
+        self.queue = queue.Queue(maxsize=int(queue_size))
+        self.stop_event = threading.Event()
+        self.producer = threading.Thread(target=self.produce, name='uploader-producer', daemon=True) if bl_settings else None
+        self.consumer = threading.Thread(target=self.consume, name='uploader-consumer', daemon=True)
+        self.spool = SampleSpool(os.path.join(spool_dir, name), spool_segment_size, spool_max_size) if spool_dir else None
+        self.drainer = threading.Thread(target=self.drain, name='uploader-drainer', daemon=True) if self.spool else None
+        self.started = None
+
+        self.produced = 0
+        self.uploaded = 0
+        self.dropped = 0
+        self.failed = 0
+        self.device_errors = 0
+        self.batches = 0
+        self.retries = 0
+        self.last_error = None
+
+    def start(self) -> None:
+        self.started = time.monotonic()
+        if self.producer is not None:
+            self.producer.start()
+        self.consumer.start()
+        if self.drainer is not None:
+            self.drainer.start()
+
+    def stop(self, timeout: Union[float, None] = None) -> None:
+        """
+        Stops sampling, uploads what is left in the queue and waits for the threads
+
+        With a spool the samples db_app can not take right now stay in the spool for the next start
+        """
+        self.stop_event.set()
+        timeout = self.timeout + self.batch_interval if timeout is None else timeout
+        for thread in (self.producer, self.consumer, self.drainer):
+            if thread is not None and thread.is_alive():
+                thread.join(timeout)
+        if self.spool is not None and not self.drainer.is_alive():
+            self.spool.close()
+
+    def is_running(self) -> bool:
+        threads = (self.producer, self.consumer)
+        return all(thread.is_alive() for thread in threads if thread is not None) and not self.stop_event.is_set()
+
+    def offer(self, row: dict) -> bool:
+        """
+        Queues a sample without blocking, the sample is dropped if the queue is full
+        """
+        try:
+            self.queue.put_nowait(row)
+            self.produced += 1
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def put(self, row: dict) -> None:
+        """
+        Queues a sample, waits for free space if the queue is full
+        """
+        self.queue.put(row)
+        self.produced += 1
+
+    def sample(self) -> dict:
+        bl_device = connection_pool.acquire_sync(**self.bl_settings)
+        frame = bl_device.run_sync(bl_device.device.request_frame, UM34CCommands.request_data.value, priority=Priority.background)
+        return frame_to_db_row(bl_device.get_bd_address(), frame)
+
+    def produce(self) -> None:
+        interval = 1 / self.sample_rate
+        next_time = time.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                row = self.sample()
+            except Exception as error:
+                self.device_errors += 1
+                self.last_error = repr(error)
+                self.stop_event.wait(interval)
+                next_time = time.monotonic()
+                continue
+
+            try:
+                self.queue.put(row, timeout=interval)
+                self.produced += 1
+            except queue.Full:
+                self.dropped += 1
+
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay < 0:
+                next_time = time.monotonic()
+                delay = 0
+            self.stop_event.wait(delay)
+
+    def collect_batch(self) -> List[dict]:
+        batch = []
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def post_row(self, row: dict) -> bool:
+        """
+        Returns False if db_app rejected the row, raises RequestException if db_app could not be reached or failed
+        """
+        resp = request_session.post(url=self.db_url, json=row, timeout=self.timeout)
+        if 400 <= resp.status_code < 500:
+            self.last_error = f'{resp.status_code}: {resp.text[:200]}'
+            return False
+        resp.raise_for_status()
+        return True
+
+    def post_batch(self, rows: List[dict]) -> Union[bool, None]:
+        """
+        Returns True if db_app stored all rows, False if it rejected the batch and None if it has no batch endpoint,
+        raises RequestException if db_app could not be reached or failed
+        """
+        resp = request_session.post(url=self.batch_url, json=rows, timeout=self.timeout)
+        if resp.status_code in (404, 405):
+            self.batch_supported = False
+            return None
+        if 400 <= resp.status_code < 500:
+            self.last_error = f'{resp.status_code}: {resp.text[:200]}'
+            return False
+        resp.raise_for_status()
+        return True
+
+    def upload(self, batch: List[dict]) -> None:
+        if self.batch_supported:
+            try:
+                stored = self.post_batch(batch)
+            except requests.RequestException as error:
+                self.failed += len(batch)
+                self.last_error = repr(error)
+                self.count_batch(len(batch), 0)
+                return
+            if stored:
+                self.count_batch(len(batch), len(batch))
+                return
+
+        uploaded = 0
+        for row in batch:
+            try:
+                if self.post_row(row):
+                    uploaded += 1
+                else:
+                    self.failed += 1
+            except requests.RequestException as error:
+                self.failed += 1
+                self.last_error = repr(error)
+        self.count_batch(len(batch), uploaded)
+
+    def count_batch(self, size: int, uploaded: int) -> None:
+        self.uploaded += uploaded
+        self.batches += 1
+        upload_batch_rows.observe(size, self.name)
+        uploaded_rows.inc(self.name, amount=uploaded)
+
+    def consume(self) -> None:
+        while not (self.stop_event.is_set() and self.queue.empty()):
+            batch = self.collect_batch()
+            if batch:
+                if self.spool is not None:
+                    self.spool.append(batch)
+                else:
+                    self.upload(batch)
+
+    def drain(self) -> None:
+        retry_delay = self.batch_interval
+        while True:
+            stopping = self.stop_event.is_set()
+            rows = self.spool.read(self.batch_size)
+            if not rows:
+                if stopping and not self.consumer.is_alive():
+                    return
+                if stopping:
+                    time.sleep(0.05)
+                else:
+                    self.stop_event.wait(self.batch_interval)
+                continue
+
+            done = uploaded = 0
+            try:
+                if self.batch_supported and self.post_batch(rows):
+                    done = uploaded = len(rows)
+                for row in rows[done:]:
+                    if self.post_row(row):
+                        uploaded += 1
+                    else:
+                        self.failed += 1
+                    done += 1
+                retry_delay = self.batch_interval
+            except requests.RequestException as error:
+                self.last_error = repr(error)
+                self.retries += 1
+            self.spool.commit(done)
+            self.count_batch(done, uploaded)
+
+            if done < len(rows):
+                if stopping:
+                    return
+                self.stop_event.wait(retry_delay)
+                retry_delay = min(retry_delay * 2, 30.0)
+
+    def get_upload_rate(self) -> float:
+        if self.started is None:
+            return 0.0
+        return self.uploaded / max(time.monotonic() - self.started, 1e-9)
+
+    def get_info(self) -> dict:
+        return {'running': self.is_running(),
+                'db_url': self.db_url,
+                'sample_rate': self.sample_rate,
+                'queue_size': self.queue.maxsize,
+                'queued': self.queue.qsize(),
+                'produced': self.produced,
+                'uploaded': self.uploaded,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'device_errors': self.device_errors,
+                'batches': self.batches,
+                'retries': self.retries,
+                'upload_rate': round(self.get_upload_rate(), 3),
+                'last_error': self.last_error,
+                **(self.spool.get_info() if self.spool is not None else {}),
+                }
+
+
+uploaders: Dict[str, Uploader] = dict()
+
+
+def get_uploader(bd_address: str) -> Union[Uploader, None]:
+    return uploaders.get(bd_address)
+
+
+def start_uploader(bd_address: str, **settings) -> Uploader:
+    stop_uploader(bd_address)
+    uploader = uploaders[bd_address] = Uploader(bl_settings=None, name=bd_address.replace(':', ''), **settings)
+    uploader.start()
+    return uploader
+
+
+def stop_uploader(bd_address: str) -> bool:
+    uploader = uploaders.pop(bd_address, None)
+    if uploader is None:
+        return False
+    uploader.stop()
+    return True
+
+
+def stop_all_uploaders() -> None:
+    for bd_address in list(uploaders.keys()):
+        stop_uploader(bd_address)
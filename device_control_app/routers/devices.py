@@ -0,0 +1,134 @@
+from fastapi import APIRouter, HTTPException, Query, Path, status
+from starlette.concurrency import run_in_threadpool
+from typing import Union, List
+
+from .commands_models import DeviceInfo, ThroughputStats, BLErrorMessage400, BLErrorMessage404, BLErrorMessage409
+from .commands_sampler import samplers, get_sampler, start_sampler, stop_sampler
+from .commands_uploader import uploaders, get_uploader, start_uploader, stop_uploader, frame_to_db_row
+from .bl_connection import connection_pool
+from .metrics import TimedRoute
+from config import BluetoothSettings, SamplerSettings, UploadSettings
+
+
+router = APIRouter(
+    prefix='/devices',
+    tags=['devices'],
+    route_class=TimedRoute,
+    dependencies=[],
+    responses={400: {'model': BLErrorMessage400},
+               404: {'model': BLErrorMessage404},
+               409: {'model': BLErrorMessage409}}
+)
+
+
+def get_device_info(bd_address: str) -> dict:
+    bl_device = connection_pool.lookup(bd_address=bd_address)
+    sampler = get_sampler(bd_address)
+    uploader = get_uploader(bd_address)
+    info = bl_device.get_connection_info() if bl_device is not None else {'bd_address': bd_address}
+    return {**info,
+            'sampler': sampler.get_info() if sampler is not None else None,
+            'uploader': uploader.get_info() if uploader is not None else None,
+            }
+
+
+async def start_device(bd_address: str,
+                       sample_rate: Union[float, None] = None,
+                       buffer_size: Union[int, None] = None,
+                       upload: bool = False,
+                       batch_size: Union[int, None] = None) -> dict:
+    """
+    Starts the sampler of a device and, if wanted, the upload of its samples to db_app
+
+    Every device has its own connection, I/O thread, sampler and upload queue,
+    so devices are polled independently of each other.
+    """
+    settings = {**BluetoothSettings().dict(), 'name': None, 'bd_address': bd_address}
+    bl_device = await connection_pool.acquire(**settings)
+    bd_address = bl_device.get_bd_address()
+
+    sampler_settings = SamplerSettings()
+    sampler = await start_sampler(bl_device,
+                                  sample_rate=sample_rate or sampler_settings.sample_rate,
+                                  buffer_size=buffer_size or sampler_settings.buffer_size)
+    if upload:
+        upload_settings = UploadSettings().dict()
+        upload_settings.pop('sample_rate')
+        if batch_size is not None:
+            upload_settings['batch_size'] = batch_size
+        uploader = await run_in_threadpool(start_uploader, bd_address, sample_rate=sampler.sample_rate, **upload_settings)
+        sampler.sinks.append(lambda sample: uploader.offer(frame_to_db_row(bd_address, sample.frame, sample.timestamp)))
+    else:
+        await run_in_threadpool(stop_uploader, bd_address)
+    return get_device_info(bd_address)
+
+
+async def stop_device(bd_address: str) -> bool:
+    sampler_stopped = await stop_sampler(bd_address)
+    uploader_stopped = await run_in_threadpool(stop_uploader, bd_address)
+    return sampler_stopped or uploader_stopped
+
+
+@router.get('/', response_model=List[DeviceInfo], summary='Shows all known devices', response_description='List of devices with their sampler and uploader')
+async def get_devices():
+    """
+    Shows every device with an open connection, a sampler or an uploader
+    """
+    bd_addresses = dict.fromkeys(list(connection_pool.devices.keys()) + list(samplers.keys()) + list(uploaders.keys()))
+    return [get_device_info(bd_address) for bd_address in bd_addresses]
+
+
+@router.get('/stats', response_model=ThroughputStats, summary='Shows throughput of all devices', response_description='Summed up throughput')
+async def get_stats():
+    """
+    Sums up sample and upload rates and counters of all devices
+    - **sample_rate** : samples per second over the last 10 seconds
+    - **upload_rate** : uploaded samples per second since the uploaders started
+    - **control_wait_max** : longest time a control command waited behind other calls to its device
+    """
+    running_samplers = [sampler for sampler in list(samplers.values()) if sampler.is_running()]
+    running_uploaders = [uploader for uploader in list(uploaders.values()) if uploader.is_running()]
+    schedulers = [bl_device.scheduler.get_info() for bl_device in list(connection_pool.devices.values())]
+    return {'devices': len(connection_pool.devices),
+            'samplers_running': len(running_samplers),
+            'uploaders_running': len(running_uploaders),
+            'sample_rate': round(sum(sampler.get_rate() for sampler in running_samplers), 3),
+            'upload_rate': round(sum(uploader.get_upload_rate() for uploader in running_uploaders), 3),
+            'samples': sum(sampler.samples for sampler in list(samplers.values())),
+            'sample_errors': sum(sampler.errors for sampler in list(samplers.values())),
+            'uploaded': sum(uploader.uploaded for uploader in list(uploaders.values())),
+            'dropped': sum(uploader.dropped for uploader in list(uploaders.values())),
+            'failed': sum(uploader.failed for uploader in list(uploaders.values())),
+            'queue_depth': sum(scheduler['queue_depth'] for scheduler in schedulers),
+            'control_wait_max': max([scheduler['control']['wait_max'] for scheduler in schedulers], default=0.0),
+            }
+
+
+@router.get('/start/{bd_address}', response_model=DeviceInfo, summary='Starts sampling a device', response_description='Device with its sampler and uploader')
+async def start(bd_address: str = Path(default=..., min_length=17, max_length=17, description='bd address of the device', example='aa:bb:cc:dd:ee:ff'),
+                sample_rate: Union[float, None] = Query(default=None, gt=0, le=20, description='Samples per second (default from configuration)'),
+                buffer_size: Union[int, None] = Query(default=None, ge=1, description='Number of samples kept in memory (default from configuration)'),
+                upload: bool = Query(default=False, description='If samples should be sent to db'),
+                batch_size: Union[int, None] = Query(default=None, ge=1, description='Maximum samples per upload (default from configuration)')):
+    """
+    Connects to the device and starts sampling it in background, a running sampler of the device gets restarted
+    - **sample_rate** : Samples per second
+    - **buffer_size** : Number of samples kept in memory
+    - **upload** : If samples should be sent to db
+    - **batch_size** : Maximum samples per upload
+    """
+    return await start_device(bd_address, sample_rate=sample_rate, buffer_size=buffer_size, upload=upload, batch_size=batch_size)
+
+
+@router.get('/stop/{bd_address}', response_model=DeviceInfo, summary='Stops sampling a device', response_description='Device with its stopped sampler and uploader')
+async def stop(bd_address: str = Path(default=..., min_length=17, max_length=17, description='bd address of the device', example='aa:bb:cc:dd:ee:ff')):
+    """
+    Stops the sampler and the uploader of the device, the connection stays open
+    """
+    bd_address = bd_address.replace('_', ':')
+    if not await stop_device(bd_address):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"No sampler running for {bd_address}",
+                            headers={'X-Error': f"No sampler running for {bd_address}"}
+                            )
+    return get_device_info(bd_address)
@@ -0,0 +1,156 @@
+"""
+Metrics of device_control_app in the Prometheus text format, served by /metrics
+
+Besides the metrics every API request collects the seconds per stage for its Server-Timing header.
+"""
+import asyncio
+import functools
+import os
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Union
+
+from fastapi import Response
+from fastapi.routing import APIRoute
+
+# The metric types are shared with db_app, in shared/ of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from shared.prometheus import CONTENT_TYPE, SIZE_BUCKETS, CallbackMetric, Counter, Histogram, Registry
+
+
+registry = Registry()
+
+stage_seconds = registry.register(Histogram('um34c_bluetooth_stage_seconds',
+                                            'Seconds spent per stage of talking to a device: connect, send, recv, decode, serialize',
+                                            labels=('stage',)))
+http_request_seconds = registry.register(Histogram('um34c_http_request_seconds',
+                                                   'Seconds to answer an API request', labels=('endpoint',)))
+upload_batch_rows = registry.register(Histogram('um34c_upload_batch_rows', 'Samples per batch posted to db_app',
+                                                labels=('uploader',), buckets=SIZE_BUCKETS))
+uploaded_rows = registry.register(Counter('um34c_uploaded_rows_total', 'Samples stored by db_app', labels=('uploader',)))
+
+
+STAGE_DESCRIPTIONS = {'queue': 'waiting for the device I/O thread', 'recv': 'device round-trip',
+                      'validation': 'pydantic validation', 'json': 'JSON encoding'}
+
+
+class RequestTiming:
+    """
+    Seconds per stage of one API request
+
+    Stages of the same name add up, e.g. the recv of every command of a macro.
+    mark is the perf_counter() time the last stage before the JSON encoding ended.
+    """
+    def __init__(self):
+        self.stages: Dict[str, float] = dict()
+        self.mark = None
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def get_header(self, total: float) -> str:
+        """
+        Value of the Server-Timing header, durations in milliseconds
+        """
+        entries = [f'{stage};dur={seconds * 1000:.3f}' + (f';desc="{STAGE_DESCRIPTIONS[stage]}"' if stage in STAGE_DESCRIPTIONS else '')
+                   for stage, seconds in list(self.stages.items())]
+        return ', '.join(entries + [f'total;dur={total * 1000:.3f}'])
+
+
+# Set by the http middleware, calls on the device I/O threads see it too (see DeviceScheduler)
+request_timing: ContextVar[Union[RequestTiming, None]] = ContextVar('request_timing', default=None)
+
+
+def add_request_stage(stage: str, seconds: float) -> None:
+    timing = request_timing.get()
+    if timing is not None:
+        timing.add(stage, seconds)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    stage_seconds.observe(seconds, stage)
+    add_request_stage(stage, seconds)
+
+
+@contextmanager
+def time_stage(stage: str, histogram: bool = True):
+    """
+    Adds the time of the block to the stage of the current request, and with histogram to um34c_bluetooth_stage_seconds
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if histogram:
+            observe_stage(stage, seconds)
+        else:
+            add_request_stage(stage, seconds)
+
+
+def set_mark() -> None:
+    timing = request_timing.get()
+    if timing is not None:
+        timing.mark = time.perf_counter()
+
+
+class TimedField:
+    """
+    Response field of a route, adds the pydantic validation of the response to the request stages
+    """
+    def __init__(self, field):
+        self.field = field
+
+    def validate(self, *args, **kwargs):
+        try:
+            with time_stage('validation', histogram=False):
+                return self.field.validate(*args, **kwargs)
+        finally:
+            set_mark()
+
+    def __getattr__(self, name: str):
+        return getattr(self.field, name)
+
+
+def timed_endpoint(endpoint: Callable) -> Callable:
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def timed(*args, **kwargs):
+            result = await endpoint(*args, **kwargs)
+            if not isinstance(result, Response):
+                set_mark()
+            return result
+    else:
+        @functools.wraps(endpoint)
+        def timed(*args, **kwargs):
+            result = endpoint(*args, **kwargs)
+            if not isinstance(result, Response):
+                set_mark()
+            return result
+    return timed
+
+
+class TimedRoute(APIRoute):
+    """
+    Route that adds the pydantic validation and the JSON encoding of its response to the request stages
+
+    JSON encoding is everything from the end of the validation (or of the endpoint, without response_model)
+    until the response is rendered, so it includes jsonable_encoder.
+    """
+    def get_route_handler(self) -> Callable:
+        if self.secure_cloned_response_field is not None and not isinstance(self.secure_cloned_response_field, TimedField):
+            self.secure_cloned_response_field = TimedField(self.secure_cloned_response_field)
+        self.dependant.call = timed_endpoint(self.dependant.call)
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            response = await handler(request)
+            timing = request_timing.get()
+            if timing is not None and timing.mark is not None:
+                timing.add('json', time.perf_counter() - timing.mark)
+                timing.mark = None
+            return response
+
+        return timed_handler
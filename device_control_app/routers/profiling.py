@@ -0,0 +1,217 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Union, List
+
+from fastapi import APIRouter, HTTPException, Query, Path, Request, Response, status
+from fastapi.responses import FileResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+
+from .commands_models import ProfileInfo, BLErrorMessage404
+from .metrics import TimedRoute
+from config import ProfilingSettings
+
+
+SUFFIXES = {'cprofile': '.prof', 'sampling': '.txt'}
+
+router = APIRouter(
+    prefix='/profiles',
+    tags=['profiling'],
+    route_class=TimedRoute,
+    dependencies=[],
+    responses={}
+)
+
+# Both profilers see more than one request, so only one request is profiled at a time
+profile_lock = threading.Lock()
+
+
+class StackSampler:
+    """
+    Wall clock sampling profiler, records the stacks of all threads every interval seconds
+
+    Unlike cProfile it also sees the device I/O threads, where the device round-trips happen.
+    The report is in the collapsed stack format ('thread;outer;...;inner count' per line) read by flamegraph.pl and speedscope.
+    """
+    def __init__(self, interval: float = 0.001):
+        self.interval = float(interval)
+        self.stacks = Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+
+    def run(self) -> None:
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.thread.join()
+
+    def report(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class RequestProfile:
+    def __init__(self, profiler: str, sample_interval: float = 0.001):
+        self.profiler = profiler
+        self.cprofile = cProfile.Profile() if profiler == 'cprofile' else None
+        self.sampler = StackSampler(sample_interval) if profiler == 'sampling' else None
+
+    def start(self) -> None:
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        else:
+            self.sampler.start()
+
+    def stop(self) -> None:
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        else:
+            self.sampler.stop()
+
+    def save(self, path: str) -> None:
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(path)
+        else:
+            with open(path, 'w') as file:
+                file.write(self.sampler.report())
+
+
+def get_requested_profiler(request: Request) -> Union[str, None]:
+    """
+    Profiler asked for with the X-Profile header or the profile query parameter: cprofile (also 1 or true) or sampling
+    """
+    value = (request.headers.get('X-Profile') or request.query_params.get('profile') or '').lower()
+    if value in ('1', 'true', 'cprofile'):
+        return 'cprofile'
+    return value if value in SUFFIXES else None
+
+
+def get_profile_paths(directory: str) -> List[str]:
+    if not os.path.isdir(directory):
+        return []
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if os.path.splitext(name)[1] in SUFFIXES.values()]
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def save_profile(profile: RequestProfile, request: Request, settings: ProfilingSettings) -> str:
+    """
+    Stores the report and deletes the oldest ones above max_files, returns the profile id
+    """
+    endpoint = request.scope.get('endpoint')
+    profile_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{endpoint.__name__ if endpoint is not None else 'unmatched'}"
+    os.makedirs(settings.directory, exist_ok=True)
+    profile.save(os.path.join(settings.directory, profile_id + SUFFIXES[profile.profiler]))
+    for path in get_profile_paths(settings.directory)[settings.max_files:]:
+        os.remove(path)
+    return profile_id
+
+
+async def call_profiled(request: Request, call_next) -> Response:
+    """
+    Calls the endpoint, profiled if the request asks for it (see get_requested_profiler)
+
+    The response of a profiled request carries the id of the stored report in the X-Profile-Id header,
+    or X-Profile: busy if another request was being profiled.
+    """
+    settings = ProfilingSettings()
+    profiler = get_requested_profiler(request)
+    if profiler is None or not settings.enabled:
+        return await call_next(request)
+    if not profile_lock.acquire(blocking=False):
+        response = await call_next(request)
+        response.headers['X-Profile'] = 'busy'
+        return response
+    try:
+        profile = RequestProfile(profiler, settings.sample_interval)
+        profile.start()
+        try:
+            response = await call_next(request)
+        finally:
+            profile.stop()
+        profile_id = await run_in_threadpool(save_profile, profile, request, settings)
+    finally:
+        profile_lock.release()
+    response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+def find_profile(profile_id: str) -> str:
+    directory = ProfilingSettings().directory
+    for suffix in SUFFIXES.values():
+        path = os.path.join(directory, profile_id + suffix)
+        if os.path.isfile(path):
+            return path
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                        detail=f"No profile {profile_id}",
+                        headers={'X-Error': f"No profile {profile_id}"}
+                        )
+
+
+def get_profile_info(path: str) -> dict:
+    name, suffix = os.path.splitext(os.path.basename(path))
+    return {'profile_id': name,
+            'profiler': {value: key for key, value in SUFFIXES.items()}[suffix],
+            'created': datetime.fromtimestamp(os.path.getmtime(path)),
+            'size': os.path.getsize(path),
+            }
+
+
+def format_stats(path: str, sort: str, limit: int) -> str:
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+
+@router.get('', response_model=List[ProfileInfo], summary='Lists stored request profiles', response_description='Profiles, newest first')
+async def get_profiles():
+    """
+    Lists the stored profiles, newest first
+
+    A request gets profiled when it has the header 'X-Profile: cprofile' (or 'sampling'), or the query parameter
+    profile=cprofile (or sampling). Its response then carries the profile id in the 'X-Profile-Id' header.
+    - **cprofile** : deterministic profile of the event loop thread
+    - **sampling** : stacks of all threads, device I/O threads included, sampled every PROFILE_SAMPLE_INTERVAL seconds
+    """
+    return [get_profile_info(path) for path in await run_in_threadpool(get_profile_paths, ProfilingSettings().directory)]
+
+
+@router.get('/{profile_id}', summary='Downloads a request profile', response_description='Profile report',
+            responses={404: {'model': BLErrorMessage404}})
+async def get_profile(profile_id: str = Path(default=..., regex=r'^[\w-]+$', description='Id from the X-Profile-Id header'),
+                      raw: bool = Query(default=False, description='Download the cProfile data for pstats or snakeviz instead of a text report'),
+                      sort: str = Query(default='cumulative', regex=r'^(cumulative|tottime|ncalls)$', description='Sort order of the text report'),
+                      limit: int = Query(default=50, ge=1, description='Functions in the text report')):
+    """
+    Downloads a profile
+    - **raw** : cProfile data as written by dump_stats instead of the text report
+    - **sort** : cumulative, tottime or ncalls, for the text report of a cProfile profile
+    - **limit** : number of functions in the text report of a cProfile profile
+
+    Sampling profiles are always collapsed stacks, e.g. for flamegraph.pl or speedscope
+    """
+    path = find_profile(profile_id)
+    if raw or path.endswith(SUFFIXES['sampling']):
+        return FileResponse(path, filename=os.path.basename(path))
+    return PlainTextResponse(await run_in_threadpool(format_stats, path, sort, limit))
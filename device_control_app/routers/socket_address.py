@@ -0,0 +1,11 @@
+from typing import Union, Tuple
+
+
+def parse_address(address: str) -> Tuple[str, Union[str, Tuple[str, int]]]:
+    """
+    Splits tcp://host:port or unix:///path into the socket family and the address
+    """
+    if address.startswith('unix://'):
+        return 'unix', address[len('unix://'):]
+    host, _, port = address[len('tcp://'):].rpartition(':') if address.startswith('tcp://') else address.rpartition(':')
+    return 'tcp', (host or '127.0.0.1', int(port))
@@ -0,0 +1,275 @@
+"""
+Simulated UM34C meters for load tests without bluetooth hardware
+
+Run with 'python simulator.py' and set SIMULATOR_ADDRESS for the API, e.g. tcp://127.0.0.1:9034 or unix:///tmp/um34c.sock.
+After connecting, a client sends the bd address of the meter it wants followed by a newline, then it speaks the UM34C protocol.
+Every bd address gets its own virtual meter, so any number of meters can be served on one socket.
+"""
+import argparse
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Union, Dict
+
+from config import SimulatorSettings
+from routers.commands_decoder import FRAME_STRUCT, GROUP_COUNT, FIELD_NAMES
+from routers.commands_models import COMMAND_ARGUMENT_LIMITS, KNOWN_DEVICES, UM34CCommands
+from routers.socket_address import parse_address
+
+
+SCREEN_COUNT = 6
+
+
+class VirtualMeter:
+    """
+    State of one simulated meter, commands change it the same way they change a real UM34C
+    """
+    def __init__(self, bd_address: str, model: str = 'UM34C', seed: Union[int, None] = None, command_delay: float = 0.0):
+        self.bd_address = bd_address
+        # Seconds until a command shows in the frames, like the display of a real meter needs to follow
+        self.command_delay = float(command_delay)
+        self.pending = []
+        self.model_id = int({name: code for code, name in KNOWN_DEVICES.items()}[model], 16)
+        self.random = random.Random(seed if seed is not None else bd_address)
+        self.voltage = 5.0 + self.random.uniform(-0.1, 0.1)
+        self.amperage = self.random.uniform(0.1, 2.0)
+        self.temperature = 25 + self.random.uniform(-2, 2)
+        self.groups = [[0.0, 0.0] for i in range(GROUP_COUNT)]
+        self.selected_group = 0
+        self.cur_screen = 0
+        self.rotation = 0
+        self.backlight = 5
+        self.screen_timeout = 1
+        self.thresh_amps = 30
+        self.thresh_seconds = 0
+        self.last_update = time.monotonic()
+        self.requests = 0
+        self.commands = 0
+
+    def update(self) -> None:
+        """
+        Lets the readings drift and the selected group accumulate mAh and mWh since the last update
+        """
+        now = time.monotonic()
+        elapsed, self.last_update = now - self.last_update, now
+        self.voltage = min(max(self.voltage + self.random.gauss(0, 0.01), 4.5), 5.5)
+        self.amperage = min(max(self.amperage + self.random.gauss(0, 0.02), 0.0), 3.0)
+        hours = elapsed / 3600
+        group = self.groups[self.selected_group]
+        group[0] += self.amperage * 1000 * hours
+        group[1] += self.amperage * self.voltage * 1000 * hours
+        if self.amperage * 100 >= self.thresh_amps:
+            self.thresh_seconds += elapsed
+
+    def frame(self) -> bytes:
+        self.update()
+        self.apply_pending()
+        self.requests += 1
+        voltage = round(self.voltage * 100)
+        amperage = round(self.amperage * 1000)
+        group = self.groups[self.selected_group]
+        values = {'model_id': self.model_id,
+                  'voltage': voltage,
+                  'amperage': amperage,
+                  'wattage': voltage * amperage // 100,
+                  'temperature_c': round(self.temperature),
+                  'temperature_f': round(self.temperature * 9 / 5 + 32),
+                  'selected_group': self.selected_group,
+                  'group_data': [int(value) for group_values in self.groups for value in group_values],
+                  'usb_volt_pos': 0,
+                  'usb_volt_neg': 0,
+                  'charging_mode': 0,
+                  'thresh_mah': int(group[0]),
+                  'thresh_mwh': int(group[1]),
+                  'thresh_amps': self.thresh_amps,
+                  'thresh_seconds': int(self.thresh_seconds),
+                  'thresh_active': int(self.amperage * 100 >= self.thresh_amps),
+                  'screen_timeout': self.screen_timeout,
+                  'screen_backlight': self.backlight,
+                  'resistance': round(self.voltage / self.amperage * 10) if self.amperage > 0 else 99999,
+                  'cur_screen': self.cur_screen,
+                  'unknown': 0,
+                  'checksum': 0,
+                  }
+        flat = []
+        for name in FIELD_NAMES:
+            if name == 'group_data':
+                flat.extend(values[name])
+            else:
+                flat.append(values[name])
+        return FRAME_STRUCT.pack(*flat)
+
+    def handle(self, command: int) -> Union[bytes, None]:
+        """
+        Applies a one byte command, after command_delay, returns the frame for request_data
+        """
+        if command == UM34CCommands.request_data.value[0]:
+            return self.frame()
+        self.update()
+        self.commands += 1
+        if self.command_delay > 0:
+            self.pending.append((time.monotonic() + self.command_delay, command))
+        else:
+            self.apply(command)
+        return None
+
+    def apply_pending(self) -> None:
+        now = time.monotonic()
+        while self.pending and self.pending[0][0] <= now:
+            self.apply(self.pending.pop(0)[1])
+
+    def apply(self, command: int) -> None:
+        base, argument = command & 0xf0, command & 0x0f
+        if command == UM34CCommands.next_screen.value[0]:
+            self.cur_screen = (self.cur_screen + 1) % SCREEN_COUNT
+        elif command == UM34CCommands.previous_screen.value[0]:
+            self.cur_screen = (self.cur_screen - 1) % SCREEN_COUNT
+        elif command == UM34CCommands.rotate_screen.value[0]:
+            self.rotation = (self.rotation + 1) % 4
+        elif command == UM34CCommands.clear_data_group.value[0]:
+            self.groups[self.selected_group] = [0.0, 0.0]
+        elif base == UM34CCommands.select_group.value[0] and argument < GROUP_COUNT:
+            self.selected_group = argument
+        elif 0 <= command - UM34CCommands.recording_threshold.value[0] <= COMMAND_ARGUMENT_LIMITS['recording_threshold']:
+            # The threshold in centiamps is added to the command, 0xb0 ... 0xce
+            self.thresh_amps = command - UM34CCommands.recording_threshold.value[0]
+        elif base == UM34CCommands.backlight_level.value[0] and argument <= 5:
+            self.backlight = argument
+        elif base == UM34CCommands.screen_timeout.value[0] and argument <= 9:
+            self.screen_timeout = argument
+
+
+class Simulator:
+    """
+    Serves virtual meters over a TCP or unix socket with configurable link latency, jitter and drop rate
+
+    - **latency** : seconds until the answer to request_data is sent
+    - **jitter** : the latency varies by up to this many seconds in both directions
+    - **drop_rate** : share of request_data commands that never get an answer
+    - **command_delay** : seconds until other commands show in the frames
+    """
+    def __init__(self, address: str = 'tcp://127.0.0.1:9034', latency: float = 0.05, jitter: float = 0.01,
+                 drop_rate: float = 0.0, model: str = 'UM34C', command_delay: float = 0.0):
+        self.address = address
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.drop_rate = float(drop_rate)
+        self.model = model
+        self.command_delay = float(command_delay)
+        self.meters: Dict[str, VirtualMeter] = dict()
+        self.random = random.Random()
+        self.server = None
+        self.loop = None
+        self.thread = None
+        self.connections = 0
+        self.dropped = 0
+
+    def get_meter(self, bd_address: str) -> VirtualMeter:
+        meter = self.meters.get(bd_address)
+        if meter is None:
+            meter = self.meters[bd_address] = VirtualMeter(bd_address, model=self.model, command_delay=self.command_delay)
+        return meter
+
+    def get_delay(self) -> float:
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            meter = self.get_meter((await reader.readline()).decode().strip().lower())
+            while True:
+                command = await reader.read(1)
+                if not command:
+                    break
+                frame = meter.handle(command[0])
+                if frame is None:
+                    continue
+                if self.random.random() < self.drop_rate:
+                    self.dropped += 1
+                    continue
+                await asyncio.sleep(self.get_delay())
+                # Two writes, so clients have to put the frame together like with a real device
+                split = self.random.randint(1, len(frame) - 1)
+                writer.write(frame[:split])
+                await writer.drain()
+                writer.write(frame[split:])
+                await writer.drain()
+        except (ConnectionError, UnicodeDecodeError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def start(self) -> None:
+        family, address = parse_address(self.address)
+        if family == 'unix':
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = await asyncio.start_unix_server(self.handle_connection, path=address)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host=address[0], port=address[1])
+
+    async def serve(self) -> None:
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def start_thread(self) -> None:
+        """
+        Runs the simulator in a background thread, e.g. for benchmarks
+        """
+        started = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            self.loop.run_until_complete(self.start())
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, name='um34c-simulator', daemon=True)
+        self.thread.start()
+        started.wait()
+
+    def stop_thread(self) -> None:
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def get_info(self) -> dict:
+        return {'address': self.address,
+                'meters': len(self.meters),
+                'connections': self.connections,
+                'requests': sum(meter.requests for meter in self.meters.values()),
+                'commands': sum(meter.commands for meter in self.meters.values()),
+                'dropped': self.dropped,
+                }
+
+
+def get_meter_addresses(count: int) -> list:
+    return [':'.join(['00', '00', '00', '00', format(i // 256, '02x'), format(i % 256, '02x')]) for i in range(1, count + 1)]
+
+
+if __name__ == '__main__':
+    settings = SimulatorSettings()
+    parser = argparse.ArgumentParser(description='Simulated UM34C meters')
+    parser.add_argument('--address', default=settings.address, help='tcp://host:port or unix:///path')
+    parser.add_argument('--latency', type=float, default=settings.latency, help='Seconds until a frame is sent')
+    parser.add_argument('--jitter', type=float, default=settings.jitter, help='Seconds the latency varies')
+    parser.add_argument('--drop-rate', type=float, default=settings.drop_rate, help='Share of unanswered data requests')
+    parser.add_argument('--command-delay', type=float, default=settings.command_delay, help='Seconds until a command takes effect')
+    parser.add_argument('--meters', type=int, default=settings.meters, help='Number of meters to list bd addresses for')
+    args = parser.parse_args()
+
+    simulator = Simulator(args.address, latency=args.latency, jitter=args.jitter, drop_rate=args.drop_rate,
+                          command_delay=args.command_delay)
+    for bd_address in get_meter_addresses(args.meters):
+        simulator.get_meter(bd_address)
+    print(f'Serving {args.meters} meters on {args.address}, e.g. POLLING_BD_ADDRESSES={",".join(get_meter_addresses(min(args.meters, 3)))}')
+    try:
+        asyncio.run(simulator.serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix='um34c-test-')
+
+os.environ.setdefault('DISCOVERY_CACHE_FILE', os.path.join(WORK_DIR, 'discovery_cache.json'))
+
+# db_app has a config and a main module too, the tests import the ones of device_control_app
+for name in ('config', 'main'):
+    if not getattr(sys.modules.get(name), '__file__', APP_DIR).startswith(APP_DIR):
+        del sys.modules[name]
+sys.path.insert(0, APP_DIR)
@@ -0,0 +1,33 @@
+import time
+
+from routers.bl_connection import CircuitBreaker
+
+
+def test_opens_and_half_opens_after_the_cooldown():
+    breaker = CircuitBreaker(cooldown=0.05, max_cooldown=0.1)
+    assert breaker.get_state() == 'closed' and breaker.allow()
+    breaker.record_failure()
+    assert breaker.get_state() == 'open' and not breaker.allow()
+    assert 0 < breaker.get_retry_in() <= 0.05
+    time.sleep(0.06)
+    assert breaker.get_state() == 'half_open' and breaker.allow()
+
+
+def test_failed_probe_doubles_the_cooldown_up_to_the_maximum():
+    breaker = CircuitBreaker(cooldown=0.05, max_cooldown=0.15)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.current_cooldown == 0.1
+    breaker.record_failure()
+    assert breaker.current_cooldown == 0.15
+    assert breaker.trips == 3
+
+
+def test_success_closes_and_resets_the_cooldown():
+    breaker = CircuitBreaker(cooldown=0.05)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    assert breaker.get_state() == 'closed'
+    assert breaker.current_cooldown == 0.05
+    assert breaker.get_info() == {'breaker_state': 'closed', 'breaker_trips': 2, 'retry_in': 0.0}
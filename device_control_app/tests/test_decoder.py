@@ -0,0 +1,19 @@
+from routers.commands_decoder import FRAME_LENGTH, FRAME_STRUCT, decode_frame
+from simulator import VirtualMeter
+
+
+def test_frame_struct_matches_the_frame_length():
+    assert FRAME_STRUCT.size == FRAME_LENGTH
+
+
+def test_decode_frame():
+    meter = VirtualMeter('00:00:00:00:00:01', seed=1)
+    meter.handle(0xa3)
+    meter.handle(0xd2)
+    frame = decode_frame(meter.frame())
+    assert frame.model_id == 0x0d4c
+    assert frame.selected_group == 3
+    assert frame.screen_backlight == 2
+    assert len(frame.group_data) == 20
+    assert frame.voltage == round(meter.voltage * 100)
+    assert decode_frame(memoryview(meter.frame())).selected_group == 3
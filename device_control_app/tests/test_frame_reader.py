@@ -0,0 +1,52 @@
+from routers.commands_decoder import FrameReader
+from simulator import VirtualMeter
+
+
+class ChunkSocket:
+    """
+    recv_into of the given chunks, one per call
+    """
+    def __init__(self, *chunks: bytes):
+        self.chunks = list(chunks)
+
+    def recv_into(self, view) -> int:
+        chunk = self.chunks.pop(0)
+        view[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def get_frames(count: int) -> list:
+    meter = VirtualMeter('00:00:00:00:00:01', seed=1)
+    frames = []
+    for i in range(count):
+        meter.handle(0xa0 + i)
+        frames.append(meter.frame())
+    return frames
+
+
+def test_frames_split_over_reads():
+    first, second = get_frames(2)
+    reader = FrameReader()
+    sock = ChunkSocket(first[:7], first[7:] + second[:50], second[50:])
+    assert bytes(reader.read_frame(sock)) == first
+    # The beginning of the second frame stays buffered for the next read
+    assert reader.buffered() == 50
+    assert bytes(reader.read_frame(sock)) == second
+    assert reader.resyncs == 0
+
+
+def test_resync_skips_leading_bytes():
+    frame, = get_frames(1)
+    reader = FrameReader()
+    assert bytes(reader.read_frame(ChunkSocket(b'\x01\x02\x03' + frame))) == frame
+    assert (reader.resyncs, reader.skipped) == (1, 3)
+
+
+def test_resync_rejects_a_model_id_within_other_data():
+    first, second = get_frames(2)
+    # After a skipped byte, a model id followed by bytes that do not fit the frame layout
+    garbage = b'\x01' + first[:2] + b'\xff' * 140
+    reader = FrameReader()
+    sock = ChunkSocket(garbage[:60], garbage[60:], second)
+    assert bytes(reader.read_frame(sock)) == second
+    assert reader.skipped == len(garbage)
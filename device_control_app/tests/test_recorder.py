@@ -0,0 +1,46 @@
+import pytest
+
+from routers.commands_recorder import LOG_MAGIC, RECORD_LENGTH, FrameRecorder, read_log
+from simulator import VirtualMeter
+
+
+def record(path, count: int) -> None:
+    meter = VirtualMeter('00:00:00:00:00:01', seed=1)
+    recorder = FrameRecorder(str(path))
+    for _ in range(count):
+        recorder.record('00:00:00:00:00:01', meter.frame())
+    recorder.close()
+
+
+def test_reopening_a_cut_off_log_drops_the_partial_record(tmp_path):
+    path = tmp_path / 'frames.um34clog'
+    record(path, 2)
+    with open(path, 'r+b') as file:
+        file.truncate(len(LOG_MAGIC) + RECORD_LENGTH + 50)
+    record(path, 2)
+    assert path.stat().st_size == len(LOG_MAGIC) + 3 * RECORD_LENGTH
+    records = [(record.bd_address, bytes(record.frame[:2])) for record in read_log(str(path))]
+    assert records == [('00:00:00:00:00:01', b'\x0d\x4c')] * 3
+
+
+def test_log_cut_off_within_the_magic_starts_over(tmp_path):
+    path = tmp_path / 'frames.um34clog'
+    path.write_bytes(LOG_MAGIC[:4])
+    record(path, 1)
+    assert len(list(read_log(str(path)))) == 1
+
+
+def test_refuses_other_files(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_bytes(b'not a frame log\n')
+    with pytest.raises(ValueError):
+        FrameRecorder(str(path))
+    assert path.read_bytes() == b'not a frame log\n'
+
+
+def test_flushes_while_recording(tmp_path):
+    path = tmp_path / 'frames.um34clog'
+    recorder = FrameRecorder(str(path), flush_interval=0)
+    recorder.record('00:00:00:00:00:01', VirtualMeter('00:00:00:00:00:01', seed=1).frame())
+    assert path.stat().st_size == len(LOG_MAGIC) + RECORD_LENGTH
+    recorder.close()
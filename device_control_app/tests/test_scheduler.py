@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from routers.bl_scheduler import DeviceScheduler, Priority
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = DeviceScheduler(name='test-io')
+    yield scheduler
+    scheduler.shutdown()
+
+
+def block(scheduler: DeviceScheduler) -> threading.Event:
+    """
+    Keeps the I/O thread busy until the returned event is set
+    """
+    release = threading.Event()
+    started = threading.Event()
+    scheduler.submit(lambda: started.set() or release.wait(5))
+    started.wait(5)
+    return release
+
+
+def test_runs_by_priority_then_in_order(scheduler):
+    order = []
+    release = block(scheduler)
+    futures = [scheduler.submit(order.append, name, priority=priority)
+               for name, priority in (('maintenance', Priority.maintenance), ('background', Priority.background),
+                                      ('read 1', Priority.read), ('control', Priority.control), ('read 2', Priority.read))]
+    release.set()
+    for future in futures:
+        future.result(5)
+    assert order == ['control', 'read 1', 'read 2', 'background', 'maintenance']
+    # The blocking call is a read too
+    assert scheduler.get_info()['read']['executed'] == 3
+
+
+def test_expired_deadline_fails_with_408(scheduler):
+    release = block(scheduler)
+    calls = []
+    future = scheduler.submit(calls.append, 1, deadline=time.monotonic() + 0.01)
+    time.sleep(0.05)
+    release.set()
+    with pytest.raises(HTTPException) as error:
+        future.result(5)
+    assert error.value.status_code == 408
+    assert calls == []
+    assert scheduler.get_info()['read']['expired'] == 1
+
+
+def test_errors_go_to_the_caller(scheduler):
+    future = scheduler.submit(lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        future.result(5)
+    assert scheduler.submit(lambda: 'still running').result(5) == 'still running'
+
+
+def test_shutdown_cancels_queued_calls():
+    scheduler = DeviceScheduler(name='test-io')
+    release = block(scheduler)
+    future = scheduler.submit(lambda: None)
+    scheduler.shutdown()
+    release.set()
+    assert future.cancelled()
+    with pytest.raises(RuntimeError):
+        scheduler.submit(lambda: None)
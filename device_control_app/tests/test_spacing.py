@@ -0,0 +1,45 @@
+import time
+
+import pytest
+
+from routers.bl_connection import BluetoothDevice
+from routers.commands_models import COMMAND_SPACING
+from routers.commands_spacing import CALIBRATION_COMMANDS, calibrate_spacing, load_spacing, save_spacing
+from simulator import Simulator
+
+BD_ADDRESS = '00:00:00:00:00:01'
+
+
+@pytest.fixture
+def device(tmp_path):
+    address = f'unix://{tmp_path / "um34c.sock"}'
+    simulator = Simulator(address, latency=0, jitter=0, command_delay=0.05)
+    simulator.start_thread()
+    device = BluetoothDevice(None, BD_ADDRESS, simulator_address=address)
+    device.connect()
+    yield device, simulator.get_meter(BD_ADDRESS)
+    device.close()
+    deadline = time.monotonic() + 5
+    while simulator.connections and time.monotonic() < deadline:
+        time.sleep(0.01)
+    simulator.stop_thread()
+
+
+def test_calibration_measures_the_command_delay(device):
+    device, meter = device
+    settings = (meter.cur_screen, meter.selected_group, meter.thresh_amps, meter.backlight, meter.screen_timeout)
+    spacing, measured = calibrate_spacing(device, rounds=2, margin=1.0)
+    assert set(spacing) == set(CALIBRATION_COMMANDS)
+    for name, times in measured.items():
+        # Two rounds of the command and two of the undo, which is the same or the opposite command
+        assert len(times) == 4
+        assert all(0.05 <= seconds < 0.5 for seconds in times)
+    assert (meter.cur_screen, meter.selected_group, meter.thresh_amps, meter.backlight, meter.screen_timeout) == settings
+
+
+def test_saved_spacing(tmp_path):
+    path = str(tmp_path / 'command_spacing.json')
+    assert load_spacing(path) == {}
+    save_spacing(path, {'next_screen': 0.2, 'unknown': 1})
+    assert load_spacing(path) == {'next_screen': 0.2}
+    assert 'rotate_screen' in COMMAND_SPACING
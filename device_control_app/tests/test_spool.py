@@ -0,0 +1,52 @@
+from routers.commands_spool import SampleSpool
+
+ROW_SIZE = 80
+
+
+def make_rows(start: int, count: int) -> list:
+    return [{'i': i, 'pad': 'x' * (ROW_SIZE - 20)} for i in range(start, start + count)]
+
+
+def fill(spool: SampleSpool, segments: int, rows_per_segment: int = 3) -> None:
+    for segment in range(segments):
+        spool.append(make_rows(segment * rows_per_segment, rows_per_segment))
+
+
+def test_read_commit_and_delete_drained_segments(tmp_path):
+    spool = SampleSpool(str(tmp_path), segment_size=2 * ROW_SIZE)
+    fill(spool, 3)
+    assert len(spool.segments) == 4 and spool.pending == 9
+    rows = spool.read(4)
+    assert [row['i'] for row in rows] == [0, 1, 2, 3]
+    # Not committed yet, the next read gets the same rows
+    assert spool.read(4) == rows
+    spool.commit(4)
+    assert spool.pending == 5 and spool.drained == 4
+    assert len(spool.segments) == 3
+    assert [row['i'] for row in spool.read(10)] == [4, 5, 6, 7, 8]
+
+
+def test_cursor_survives_a_restart(tmp_path):
+    spool = SampleSpool(str(tmp_path), segment_size=2 * ROW_SIZE)
+    fill(spool, 2)
+    spool.read(2)
+    spool.commit(2)
+    spool.close()
+    spool = SampleSpool(str(tmp_path), segment_size=2 * ROW_SIZE)
+    assert spool.pending == 4
+    assert [row['i'] for row in spool.read(10)] == [2, 3, 4, 5]
+
+
+def test_drop_oldest_while_rows_are_in_flight(tmp_path):
+    spool = SampleSpool(str(tmp_path), segment_size=2 * ROW_SIZE)
+    fill(spool, 3)
+    rows = spool.read(6)
+    # The spool gets full while the rows are posted, the segment of rows 0-2 is dropped
+    spool.max_size = spool.size + ROW_SIZE // 2
+    spool.append(make_rows(9, 1))
+    assert spool.dropped == 3
+    spool.commit(len(rows))
+    assert spool.drained == 3
+    # Rows 3-5 were posted, they must not come again
+    assert [row['i'] for row in spool.read(10)] == [6, 7, 8, 9]
+    assert spool.pending == 4
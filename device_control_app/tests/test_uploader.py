@@ -0,0 +1,34 @@
+import time
+from concurrent.futures import CancelledError
+
+from routers.commands_uploader import Uploader
+
+
+class FailingUploader(Uploader):
+    """
+    Uploader whose device calls fail with the given errors, then return rows
+    """
+    def __init__(self, errors: list):
+        super().__init__({'bd_address': '00:00:00:00:00:01'}, 'http://127.0.0.1:9/data', sample_rate=200, batch_interval=0.01)
+        self.errors = list(errors)
+
+    def sample(self) -> dict:
+        if self.errors:
+            raise self.errors.pop(0)
+        return {'bd_address': '00:00:00:00:00:01'}
+
+    def consume(self) -> None:
+        self.stop_event.wait()
+
+
+def test_producer_keeps_running_on_device_errors():
+    uploader = FailingUploader([RuntimeError('Scheduler is shut down'), CancelledError(), IndexError('frame')])
+    uploader.start()
+    deadline = time.monotonic() + 5
+    while uploader.produced == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert uploader.is_running()
+    assert uploader.device_errors == 3
+    assert uploader.produced >= 1
+    uploader.stop()
+    assert not uploader.is_running()
@@ -0,0 +1,141 @@
+"""
+Metrics in the Prometheus text format, see https://prometheus.io/docs/instrumenting/exposition_formats/
+
+Shared by db_app and device_control_app, which register their metrics in metrics.py.
+Counters only ever grow, rates like frames/sec come from rate() in Prometheus.
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names: Tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """
+        Name suffix, formatted labels and value of every sample
+        """
+        return []
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{self.name}{suffix}{labels} {format_value(value)}' for suffix, labels, value in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[tuple, float] = dict()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        with self.lock:
+            values = list(self.values.items())
+        return [('', format_labels(self.labels, label_values), value) for label_values, value in values]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values: Dict[tuple, list] = dict()
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                # One count per bucket, +Inf, then the sum
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        with self.lock:
+            values = [(label_values, list(counts)) for label_values, counts in self.values.items()]
+        samples = []
+        names = self.labels + ('le',)
+        for label_values, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                total += count
+                samples.append(('_bucket', format_labels(names, label_values + (format_value(float(bound)),)), total))
+            samples.append(('_count', format_labels(self.labels, label_values), total))
+            samples.append(('_sum', format_labels(self.labels, label_values), counts[-1]))
+        return samples
+
+
+class CallbackMetric(Metric):
+    """
+    Metric whose values are read when scraped, collect returns (label values, value) pairs
+
+    Used for numbers the app counts anyway, e.g. the frames of a device, so the hot path does no extra work.
+    """
+    def __init__(self, name: str, documentation: str, kind: str, labels: Tuple[str, ...],
+                 collect: Callable[[], Iterable[Tuple[tuple, float]]]):
+        super().__init__(name, documentation, labels)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        return [('', format_labels(self.labels, label_values), value) for label_values, value in self.collect()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = list()
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
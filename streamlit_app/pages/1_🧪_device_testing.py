@@ -58,6 +58,7 @@ class UM34CApiCommand(Enum):
     send_response_to_db = base_url + 'command/''send_response_to_db'
     send_response_to_db_loop = base_url + 'command/''send_response_to_db_loop'
     stop_sending_loop = base_url + 'command/''stop_sending_loop'
+    sending_loop = base_url + 'command/''sending_loop'
 
 
 def get_api_response(url: str):